@@ -0,0 +1,90 @@
+"""
+Micro-benchmark of the address conversions done for each deposit, with and without the memoized canonical addresses
+
+The conversions are the ones the pipeline does for a deposit from a new user: parsing the deposit (token, receiver
+and bridge addresses), checking and queueing the reward, and signing the reward transaction. The addresses come in
+checksummed, as web3 returns them.
+
+Usage:
+    python -m benchmarks.bench_addresses --deposits 10000
+"""
+import json
+from time import perf_counter
+from typing import Callable, List, Optional
+
+import click
+from eth_utils import to_checksum_address
+
+from sovryn_bridge_rewarder.utils import _canonical_address, address, canonical_address, lower_address
+from .fake_chain import make_address
+
+BRIDGE_ADDRESS = to_checksum_address(make_address('bridge'))
+MAIN_TOKEN_ADDRESS = to_checksum_address(make_address('main token'))
+SIDE_TOKEN_ADDRESS = to_checksum_address(make_address('side token'))
+REWARDER_ADDRESS = to_checksum_address(make_address('rewarder'))
+
+
+def convert_unmemoized(user_address: str):
+    # The conversions of the pipeline before canonical_address
+    main_token_address = MAIN_TOKEN_ADDRESS.lower()
+    side_token_address = SIDE_TOKEN_ADDRESS.lower()
+    user_address = user_address.lower()
+    contract_address = BRIDGE_ADDRESS.lower()
+    user_address.lower()  # queue_rewards
+    to_checksum_address(user_address.lower())  # get_balance
+    to_checksum_address(user_address.lower())  # get_transaction_count
+    from_address = REWARDER_ADDRESS.lower()
+    to_checksum_address(from_address)  # get_balance of the rewarder
+    to_checksum_address(from_address)  # transaction from
+    to_checksum_address(user_address)  # transaction to
+    return main_token_address, side_token_address, contract_address
+
+
+def convert_memoized(user_address: str):
+    main_token_address = lower_address(MAIN_TOKEN_ADDRESS)
+    side_token_address = lower_address(SIDE_TOKEN_ADDRESS)
+    user_address = lower_address(user_address)
+    contract_address = lower_address(BRIDGE_ADDRESS)
+    lower_address(user_address)  # queue_rewards
+    address(user_address)  # get_balance and get_transaction_count
+    from_address = canonical_address(REWARDER_ADDRESS)
+    from_address.checksummed  # get_balance of the rewarder and transaction from
+    address(user_address)  # transaction to
+    return main_token_address, side_token_address, contract_address
+
+
+def time_per_deposit(convert: Callable[[str], object], user_addresses: List[str]) -> float:
+    start = perf_counter()
+    for user_address in user_addresses:
+        convert(user_address)
+    return (perf_counter() - start) / len(user_addresses)
+
+
+@click.command()
+@click.option('--deposits', 'num_deposits', default=10000, show_default=True, help='Number of deposits (users)')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results as JSON to this file')
+def main(num_deposits: int, output: Optional[str]):
+    user_addresses = [to_checksum_address(make_address(f'user {i}')) for i in range(num_deposits)]
+    _canonical_address.cache_clear()
+    unmemoized = time_per_deposit(convert_unmemoized, user_addresses)
+    memoized = time_per_deposit(convert_memoized, user_addresses)
+    cache_info = _canonical_address.cache_info()
+    results = {
+        'num_deposits': num_deposits,
+        'unmemoized_us_per_deposit': unmemoized * 10**6,
+        'memoized_us_per_deposit': memoized * 10**6,
+        'saved_us_per_deposit': (unmemoized - memoized) * 10**6,
+        'cache_hits': cache_info.hits,
+        'cache_misses': cache_info.misses,
+    }
+    click.echo(f'Unmemoized: {unmemoized * 10**6:8.1f} us/deposit')
+    click.echo(f'Memoized:   {memoized * 10**6:8.1f} us/deposit')
+    click.echo(f'Saved:      {(unmemoized - memoized) * 10**6:8.1f} us/deposit ({1 - memoized / unmemoized:.0%})')
+    click.echo(f'Cache:      {cache_info.hits} hits, {cache_info.misses} misses')
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Memory benchmark of the Deposit representation, compared to the previous dataclass with hex strings
+
+Usage:
+    python -m benchmarks.bench_deposit_memory --deposits 100000
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+import gc
+import json
+import tracemalloc
+from typing import Any, Callable, List, Optional
+
+import click
+from eth_utils import keccak
+
+from sovryn_bridge_rewarder.deposits import Deposit, intern_deposit_token
+from .fake_chain import make_address
+
+MAIN_TOKEN_ADDRESS = make_address('main token')
+SIDE_TOKEN_ADDRESS = make_address('side token')
+BRIDGE_ADDRESS = make_address('bridge')
+FEE_PERCENTAGE = Decimal('0.002')
+
+
+@dataclass
+class DictDeposit:
+    """
+    Deposit as it was before the compact representation
+    """
+    user_address: str
+    side_token_address: str
+    side_token_symbol: str
+    main_token_address: str
+    amount_minus_fees_wei: int
+    amount_decimal: Decimal
+    block_hash: str
+    transaction_hash: str
+    log_index: int
+    contract_address: str
+    event: Any = None
+
+
+def _raw_values(i: int):
+    # Like the values decoded from a log: fresh objects for each deposit, except the token symbol
+    return dict(
+        user_address=make_address(f'user {i}'),
+        side_token_address=SIDE_TOKEN_ADDRESS.lower(),
+        side_token_symbol='DAIbs',
+        main_token_address=MAIN_TOKEN_ADDRESS.lower(),
+        contract_address=BRIDGE_ADDRESS.lower(),
+        amount_minus_fees_wei=(100 + i) * 10**18,
+        block_hash=keccak(text=f'block {i // 10}'),
+        transaction_hash=keccak(text=f'transaction {i}'),
+        log_index=i % 10,
+    )
+
+
+def make_dict_deposit(i: int) -> DictDeposit:
+    values = _raw_values(i)
+    return DictDeposit(
+        amount_decimal=Decimal(values['amount_minus_fees_wei']) / Decimal(10) ** 18 / (1 - FEE_PERCENTAGE),
+        block_hash='0x' + values.pop('block_hash').hex(),
+        transaction_hash='0x' + values.pop('transaction_hash').hex(),
+        **values,
+    )
+
+
+def make_compact_deposit(i: int) -> Deposit:
+    values = _raw_values(i)
+    return Deposit(
+        token=intern_deposit_token(
+            side_token_address=values['side_token_address'],
+            side_token_symbol=values['side_token_symbol'],
+            main_token_address=values['main_token_address'],
+            contract_address=values['contract_address'],
+            decimals=18,
+            fee_percentage=FEE_PERCENTAGE,
+        ),
+        user_address=values['user_address'],
+        amount_minus_fees_wei=values['amount_minus_fees_wei'],
+        block_hash=values['block_hash'],
+        transaction_hash=values['transaction_hash'],
+        log_index=values['log_index'],
+        block_number=1000 + i // 10,
+    )
+
+
+def measure_bytes(make_deposit: Callable[[int], Any], num_deposits: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        deposits: List[Any] = [make_deposit(i) for i in range(num_deposits)]
+        gc.collect()
+        size, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del deposits
+    return size
+
+
+@click.command()
+@click.option('--deposits', 'num_deposits', default=100000, show_default=True, help='Number of deposits held')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results as JSON to this file')
+def main(num_deposits: int, output: Optional[str]):
+    results = {'num_deposits': num_deposits, 'bytes_per_deposit': {}}
+    for name, make_deposit in [('dataclass', make_dict_deposit), ('compact', make_compact_deposit)]:
+        size = measure_bytes(make_deposit, num_deposits)
+        results['bytes_per_deposit'][name] = size / num_deposits
+        click.echo(f'{name:<10} {size / 2**20:8.1f} MiB {size / num_deposits:8.0f} bytes/deposit')
+    ratio = results['bytes_per_deposit']['compact'] / results['bytes_per_deposit']['dataclass']
+    click.echo(f'The compact deposits take {ratio:.0%} of the memory of the dataclass')
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
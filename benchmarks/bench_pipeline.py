@@ -0,0 +1,170 @@
+"""
+Benchmark the stages of the reward pipeline against a fake chain, without network access
+
+Usage:
+    python -m benchmarks.bench_pipeline --sizes 10,1000,100000 --db-url sqlite:// --db-url postgresql:///bench
+
+The database URLs should point to scratch databases -- all tables are dropped before each run.
+"""
+from dataclasses import dataclass, field
+from decimal import Decimal
+import json
+import os
+import tempfile
+from time import perf_counter
+from typing import Dict, List, Optional
+
+import click
+from eth_account import Account
+from prometheus_client import REGISTRY
+from sqlalchemy.orm import sessionmaker
+from web3 import Web3
+
+from sovryn_bridge_rewarder.config import RewardThresholdMap
+from sovryn_bridge_rewarder.deposits import get_side_token, parse_deposits_from_events
+from sovryn_bridge_rewarder.main import get_bridge_contract, init_sqlalchemy
+from sovryn_bridge_rewarder.models import Base
+from sovryn_bridge_rewarder.rewards import queue_rewards, send_queued_rewards
+from sovryn_bridge_rewarder.utils import get_events, is_contract
+from .fake_chain import FakeChain, FakeChainProvider, make_address
+
+BRIDGE_ADDRESS = make_address('bridge')
+MAIN_TOKEN_ADDRESS = make_address('main token')
+SIDE_TOKEN_ADDRESS = make_address('side token')
+SIDE_TOKEN_SYMBOL = 'DAIbs'
+DEPOSITS_PER_BLOCK = 10
+STAGES = ['get_events', 'parse_deposits_from_events', 'queue_rewards', 'send_reward', 'confirm_rewards']
+
+
+@dataclass
+class BenchmarkResult:
+    db_url: str
+    num_deposits: int
+    seconds: Dict[str, float] = field(default_factory=dict)
+
+    def as_dict(self):
+        return {
+            'db_url': self.db_url,
+            'num_deposits': self.num_deposits,
+            'seconds': self.seconds,
+            'per_deposit_ms': {
+                stage: seconds * 1000 / self.num_deposits
+                for (stage, seconds) in self.seconds.items()
+            },
+        }
+
+
+def build_chain(num_deposits: int) -> FakeChain:
+    chain = FakeChain()
+    chain.add_side_token(
+        bridge_address=BRIDGE_ADDRESS,
+        main_token_address=MAIN_TOKEN_ADDRESS,
+        side_token_address=SIDE_TOKEN_ADDRESS,
+        symbol=SIDE_TOKEN_SYMBOL,
+    )
+    for i in range(num_deposits):
+        if i % DEPOSITS_PER_BLOCK == 0:
+            chain.mine_block()
+        chain.add_deposit(
+            bridge_address=BRIDGE_ADDRESS,
+            main_token_address=MAIN_TOKEN_ADDRESS,
+            to=make_address(f'user {i}'),
+            amount_wei=100 * 10**18,
+            block_number=chain.head,
+        )
+    return chain
+
+
+def reset_database(db_url: str) -> sessionmaker:
+    DBSession = init_sqlalchemy(db_url, create_models=False)
+    engine = DBSession.kw['bind']
+    Base.metadata.drop_all(engine)
+    return init_sqlalchemy(db_url, create_models=True)
+
+
+def run_benchmark(*, num_deposits: int, db_url: str, stages: List[str]) -> BenchmarkResult:
+    result = BenchmarkResult(db_url=db_url, num_deposits=num_deposits)
+    chain = build_chain(num_deposits)
+    web3 = Web3(FakeChainProvider(chain))
+    bridge_contract = get_bridge_contract(bridge_address=BRIDGE_ADDRESS, web3=web3)
+    account = Account.create()
+    chain.set_balance(account.address, 10**30)
+    DBSession = reset_database(db_url)
+    get_side_token.cache_clear()
+    is_contract.cache_clear()
+
+    start = perf_counter()
+    events = get_events(
+        event=bridge_contract.events.AcceptedCrossTransfer,
+        from_block=1,
+        to_block=chain.head,
+    )
+    result.seconds['get_events'] = perf_counter() - start
+    assert len(events) == num_deposits
+
+    start = perf_counter()
+    deposits = parse_deposits_from_events(
+        web3=web3,
+        bridge_contract=bridge_contract,
+        events=events,
+    )
+    result.seconds['parse_deposits_from_events'] = perf_counter() - start
+
+    if 'queue_rewards' in stages or 'send_reward' in stages or 'confirm_rewards' in stages:
+        start = perf_counter()
+        with DBSession.begin() as dbsession:
+            queue_rewards(
+                deposits=deposits,
+                dbsession=dbsession,
+                web3=web3,
+                reward_amount_rbtc=Decimal('0.0001'),
+                deposit_thresholds=RewardThresholdMap({SIDE_TOKEN_SYMBOL: Decimal('1')}),
+            )
+        result.seconds['queue_rewards'] = perf_counter() - start
+
+    if 'send_reward' in stages or 'confirm_rewards' in stages:
+        # send_reward and confirm_rewards are interleaved, so they are measured from the stage metrics
+        send_before = _stage_seconds('send_reward')
+        confirm_before = _stage_seconds('confirm_rewards')
+        send_queued_rewards(
+            web3=web3,
+            DBSession=DBSession,
+            from_account=account,
+        )
+        result.seconds['send_reward'] = _stage_seconds('send_reward') - send_before
+        result.seconds['confirm_rewards'] = _stage_seconds('confirm_rewards') - confirm_before
+
+    return result
+
+
+def _stage_seconds(stage: str) -> float:
+    return REGISTRY.get_sample_value('rewarder_stage_seconds_sum', {'stage': stage}) or 0.0
+
+
+@click.command()
+@click.option('--sizes', default='10,1000', help='Comma-separated numbers of deposits')
+@click.option('--db-url', 'db_urls', multiple=True, help='Scratch database URL (default: temporary SQLite file)')
+@click.option('--stages', default=','.join(STAGES), help='Comma-separated stages to run')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results as JSON to this file')
+def main(sizes: str, db_urls: List[str], stages: str, output: Optional[str]):
+    stage_list = [s.strip() for s in stages.split(',') if s.strip()]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if not db_urls:
+            db_urls = [f'sqlite:///{os.path.join(tmpdir, "bench.sqlite3")}']
+        results = []
+        for db_url in db_urls:
+            for num_deposits in [int(s) for s in sizes.split(',')]:
+                click.echo(f'Running with {num_deposits} deposits on {db_url}...')
+                result = run_benchmark(num_deposits=num_deposits, db_url=db_url, stages=stage_list)
+                results.append(result.as_dict())
+                for stage, seconds in result.seconds.items():
+                    click.echo(
+                        f'  {stage:<28} {seconds:10.3f} s {seconds * 1000 / num_deposits:10.3f} ms/deposit'
+                    )
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+"""
+In-memory stand-in for an RSK node with bridge contracts, for running the rewarder offline
+
+It answers the JSON-RPC calls the rewarder makes (eth_getLogs for AcceptedCrossTransfer events,
+the knownTokens/mappedTokens/symbol/decimals calls, balances, nonces, transactions and receipts)
+from in-memory state, so it can be used with web3 as a provider.
+"""
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import rlp
+from eth_abi import decode_single, encode_abi, encode_single
+from eth_account import Account
+from eth_utils import keccak, to_checksum_address, to_hex
+from web3 import Web3
+from web3.providers import BaseProvider
+
+from sovryn_bridge_rewarder.main import get_bridge_contract_event
+from sovryn_bridge_rewarder.utils import get_event_topic
+
+ACCEPTED_CROSS_TRANSFER_TOPIC = get_event_topic(get_bridge_contract_event(Web3()))
+SELECTORS = {
+    to_hex(keccak(text=signature)[:4]): name
+    for (name, signature) in [
+        ('knownTokens', 'knownTokens(address)'),
+        ('mappedTokens', 'mappedTokens(address)'),
+        ('symbol', 'symbol()'),
+        ('decimals', 'decimals()'),
+    ]
+}
+CHAIN_ID = 31
+
+
+def _address_topic(address: str) -> str:
+    return '0x' + address.lower()[2:].rjust(64, '0')
+
+
+def _block_hash(block_number: int) -> str:
+    return to_hex(keccak(text=f'block {block_number}'))
+
+
+class FakeChain:
+    """
+    Chain state: blocks with bridge logs, token mappings, balances, nonces and sent transactions
+    """
+    def __init__(self, *, block_time: float = 30.0, mine_transactions: bool = True):
+        """
+        If `mine_transactions` is True, each sent transaction is mined in a new block immediately.
+        Otherwise transactions are pending until the next `mine_block` call.
+        """
+        self.block_time = block_time
+        self.mine_transactions = mine_transactions
+        self.head = 0
+        self.logs_by_block: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        # by (bridge address, main token address) and ('token', side token address)
+        self.side_tokens: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.balances: Dict[str, int] = defaultdict(int)
+        self.nonces: Dict[str, int] = defaultdict(int)
+        # (first block, balance, nonce) of each address after each change, for queries at past blocks
+        self.state_history: Dict[str, List[Tuple[int, int, int]]] = defaultdict(list)
+        self.contracts = set()
+        self.receipts: Dict[str, Dict[str, Any]] = {}
+        self.pending_receipts: List[Dict[str, Any]] = []
+        self.lock = threading.RLock()
+        self._counter = itertools.count()
+
+    def add_side_token(self, *, bridge_address: str, main_token_address: str, side_token_address: str,
+                       symbol: str, decimals: int = 18):
+        with self.lock:
+            self.side_tokens[(bridge_address.lower(), main_token_address.lower())] = {
+                'address': side_token_address.lower(),
+                'symbol': symbol,
+                'decimals': decimals,
+            }
+            self.side_tokens[('token', side_token_address.lower())] = {
+                'symbol': symbol,
+                'decimals': decimals,
+            }
+            self.contracts.add(side_token_address.lower())
+
+    def mine_block(self) -> int:
+        with self.lock:
+            self.head += 1
+            for receipt in self.pending_receipts:
+                receipt['blockNumber'] = hex(self.head)
+                receipt['blockHash'] = _block_hash(self.head)
+                self.receipts[receipt['transactionHash']] = receipt
+            self.pending_receipts = []
+            return self.head
+
+    def add_deposit(
+        self,
+        *,
+        bridge_address: str,
+        main_token_address: str,
+        to: str,
+        amount_wei: int,
+        user_data: bytes = b'',
+        block_number: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Add an AcceptedCrossTransfer log to the given block (by default, the next block to be mined)
+        """
+        with self.lock:
+            if block_number is None:
+                block_number = self.head + 1
+            block_logs = self.logs_by_block[block_number]
+            log = {
+                'address': bridge_address.lower(),
+                'topics': [
+                    ACCEPTED_CROSS_TRANSFER_TOPIC,
+                    _address_topic(main_token_address),
+                    _address_topic(to),
+                ],
+                'data': to_hex(encode_abi(
+                    ['uint256', 'uint8', 'uint256', 'uint256', 'uint8', 'uint256', 'bytes'],
+                    [amount_wei, 18, 1, amount_wei, 18, 1, user_data],
+                )),
+                'blockNumber': hex(block_number),
+                'blockHash': _block_hash(block_number),
+                'transactionHash': to_hex(keccak(text=f'deposit {next(self._counter)}')),
+                'transactionIndex': hex(len(block_logs)),
+                'logIndex': hex(len(block_logs)),
+                'removed': False,
+            }
+            block_logs.append(log)
+            return log
+
+    def get_block(self, block_number: int) -> Optional[Dict[str, Any]]:
+        if block_number > self.head or block_number < 0:
+            return None
+        return {
+            'number': hex(block_number),
+            'hash': _block_hash(block_number),
+            'parentHash': _block_hash(block_number - 1),
+            'timestamp': hex(int(block_number * self.block_time)),
+            'transactions': [],
+        }
+
+    def get_logs(self, filter_params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        from_block = self._parse_block_number(filter_params.get('fromBlock', 'latest'))
+        to_block = self._parse_block_number(filter_params.get('toBlock', 'latest'))
+        addresses = filter_params.get('address') or []
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        addresses = {a.lower() for a in addresses}
+        topics = filter_params.get('topics') or []
+        ret = []
+        with self.lock:
+            for block_number in range(from_block, min(to_block, self.head) + 1):
+                for log in self.logs_by_block.get(block_number, ()):
+                    if addresses and log['address'] not in addresses:
+                        continue
+                    if not self._topics_match(log['topics'], topics):
+                        continue
+                    ret.append(log)
+        return ret
+
+    def call(self, transaction: Dict[str, Any]) -> str:
+        to = transaction['to'].lower()
+        data = transaction['data']
+        function_name = SELECTORS.get(data[:10])
+        if function_name in ('knownTokens', 'mappedTokens'):
+            main_token_address = decode_single('address', bytes.fromhex(data[10:])).lower()
+            side_token = self.side_tokens.get((to, main_token_address))
+            if function_name == 'knownTokens':
+                return to_hex(encode_single('bool', False))
+            return to_hex(encode_single('address', side_token['address'] if side_token else '0x' + '00' * 20))
+        token = self.side_tokens.get(('token', to))
+        if token and function_name == 'symbol':
+            return to_hex(encode_abi(['string'], [token['symbol']]))
+        if token and function_name == 'decimals':
+            return to_hex(encode_single('uint8', token['decimals']))
+        raise ValueError(f'unsupported call to {to}: {data[:10]}')
+
+    def send_raw_transaction(self, raw_transaction: str) -> str:
+        sender = Account.recover_transaction(raw_transaction).lower()
+        nonce, gas_price, gas, to, value = [
+            int.from_bytes(v, 'big') if i != 3 else to_checksum_address(v)
+            for (i, v) in enumerate(rlp.decode(bytes.fromhex(raw_transaction[2:]))[:5])
+        ]
+        transaction_hash = to_hex(keccak(hexstr=raw_transaction))
+        with self.lock:
+            if nonce != self.nonces[sender]:
+                raise ValueError(f'invalid nonce {nonce}, expected {self.nonces[sender]}')
+            self.nonces[sender] += 1
+            self.balances[sender] -= value + gas_price * gas
+            self.balances[to.lower()] += value
+            self._record_state(sender)
+            self._record_state(to.lower())
+            self.pending_receipts.append({
+                'transactionHash': transaction_hash,
+                'transactionIndex': hex(len(self.pending_receipts)),
+                'from': sender,
+                'to': to.lower(),
+                'cumulativeGasUsed': hex(gas),
+                'gasUsed': hex(gas),
+                'contractAddress': None,
+                'logs': [],
+                'logsBloom': '0x' + '00' * 256,
+                'status': '0x1',
+            })
+            if self.mine_transactions:
+                self.mine_block()
+        return transaction_hash
+
+    def set_balance(self, address: str, balance: int):
+        """
+        Set the balance of the address, from the next block on
+        """
+        with self.lock:
+            self.balances[address.lower()] = balance
+            self._record_state(address.lower())
+
+    def get_balance_and_nonce(self, address: str, block_identifier='latest') -> Tuple[int, int]:
+        address = address.lower()
+        block_number = self._parse_block_number(block_identifier)
+        with self.lock:
+            if block_number >= self.head:
+                return self.balances[address], self.nonces[address]
+            balance, nonce = 0, 0
+            for (first_block, block_balance, block_nonce) in self.state_history[address]:
+                if first_block > block_number:
+                    break
+                balance, nonce = block_balance, block_nonce
+            return balance, nonce
+
+    def _record_state(self, address: str):
+        self.state_history[address].append((self.head + 1, self.balances[address], self.nonces[address]))
+
+    def _parse_block_number(self, block_identifier) -> int:
+        if block_identifier in ('latest', 'pending'):
+            return self.head
+        if block_identifier == 'earliest':
+            return 0
+        if isinstance(block_identifier, int):
+            return block_identifier
+        return int(block_identifier, 16)
+
+    @staticmethod
+    def _topics_match(log_topics: List[str], filter_topics: List[Any]) -> bool:
+        for (log_topic, filter_topic) in zip(log_topics, filter_topics):
+            if filter_topic is None:
+                continue
+            if isinstance(filter_topic, list):
+                if log_topic not in filter_topic:
+                    return False
+            elif log_topic != filter_topic:
+                return False
+        return True
+
+
+class FakeChainProvider(BaseProvider):
+    """
+    Web3 provider that answers JSON-RPC requests from a FakeChain
+    """
+    def __init__(self, chain: FakeChain):
+        super().__init__()
+        self.chain = chain
+
+    def make_request(self, method, params):
+        try:
+            result = self.handle_request(method, params)
+        except ValueError as e:
+            return {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': str(e)}}
+        return {'jsonrpc': '2.0', 'id': 1, 'result': result}
+
+    def isConnected(self):
+        return True
+
+    def handle_request(self, method: str, params: List[Any]) -> Any:
+        chain = self.chain
+        if method == 'eth_chainId':
+            return hex(CHAIN_ID)
+        if method == 'net_version':
+            return str(CHAIN_ID)
+        if method == 'eth_blockNumber':
+            return hex(chain.head)
+        if method == 'eth_gasPrice':
+            return hex(60_000_000)
+        if method == 'eth_getBlockByNumber':
+            return chain.get_block(chain._parse_block_number(params[0]))
+        if method == 'eth_getBlockByHash':
+            for block_number in range(chain.head, -1, -1):
+                if _block_hash(block_number) == params[0]:
+                    return chain.get_block(block_number)
+            return None
+        if method == 'eth_getLogs':
+            return chain.get_logs(params[0])
+        if method == 'eth_newFilter':
+            return hex(next(chain._counter))
+        if method == 'eth_call':
+            return chain.call(params[0])
+        if method == 'eth_getCode':
+            return '0x6080' if params[0].lower() in chain.contracts else '0x00'
+        if method == 'eth_getBalance':
+            return hex(chain.get_balance_and_nonce(*params)[0])
+        if method == 'eth_getTransactionCount':
+            return hex(chain.get_balance_and_nonce(*params)[1])
+        if method == 'eth_sendRawTransaction':
+            return chain.send_raw_transaction(to_hex(params[0]) if isinstance(params[0], bytes) else params[0])
+        if method == 'eth_getTransactionReceipt':
+            return chain.receipts.get(to_hex(params[0]) if isinstance(params[0], bytes) else params[0])
+        raise ValueError(f'method {method} not supported by the fake chain')
+
+
+class _JSONRPCRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        response = self.server.provider.make_request(request['method'], request.get('params', []))
+        response['id'] = request['id']
+        body = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fake_chain(chain: FakeChain, *, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    Serve the chain as a JSON-RPC node over HTTP in a background thread.
+    The URL is http://{host}:{server.server_address[1]}
+    """
+    server = ThreadingHTTPServer((host, port), _JSONRPCRequestHandler)
+    server.daemon_threads = True
+    server.provider = FakeChainProvider(chain)
+    thread = threading.Thread(target=server.serve_forever, name='fake-chain-rpc', daemon=True)
+    thread.start()
+    return server
+
+
+def make_address(seed: Any) -> str:
+    """
+    Deterministic address for test data
+    """
+    return to_hex(keccak(text=f'address {seed}')[-20:])
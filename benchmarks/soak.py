@@ -0,0 +1,307 @@
+"""
+End-to-end soak/load test: runs the full rewarder process against a fake chain that receives synthetic
+deposits at a configurable rate, and reports deposit-to-confirmed-payout latencies, throughput and memory use.
+
+Usage:
+    python -m benchmarks.soak --rates 0.5,1,2,5 --duration 120 --bridges 2 --block-time 5
+
+The rewarder runs in a subprocess through the normal CLI entry point, talking JSON-RPC over HTTP to the fake
+chain served by this process. Payout latency is measured from the time a deposit is added to the chain to the
+time its reward is seen as confirmed in the database, so it has the resolution of `--poll-interval`.
+
+After injecting, the run waits for the outstanding rewards to drain, so every injected deposit counts. A rate is
+sustainable if all of its deposits were paid and the latency didn't grow during the run: with a backlog building
+up, the deposits injected later wait longer.
+"""
+from dataclasses import dataclass, field
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import click
+from eth_account import Account
+from sqlalchemy.exc import OperationalError
+
+from sovryn_bridge_rewarder.main import init_sqlalchemy
+from sovryn_bridge_rewarder.models import Reward, RewardStatus
+from .fake_chain import FakeChain, make_address, serve_fake_chain
+
+
+@dataclass
+class SoakResult:
+    rate: float
+    duration: float
+    max_latency_growth: float  # seconds
+    injected: int = 0
+    latencies: List[Tuple[float, float]] = field(default_factory=list)  # (seconds since start injected, latency)
+    rss_samples: List[Tuple[float, int]] = field(default_factory=list)  # (seconds since start, bytes)
+
+    @property
+    def confirmed(self) -> int:
+        return len(self.latencies)
+
+    @property
+    def confirmed_fraction(self) -> float:
+        return self.confirmed / self.injected if self.injected else 1.0
+
+    @property
+    def latency_growth(self) -> Optional[float]:
+        """
+        p90 latency of the deposits injected in the second half of the run minus that of the first half
+        """
+        first_half = [latency for (injected, latency) in self.latencies if injected < self.duration / 2]
+        second_half = [latency for (injected, latency) in self.latencies if injected >= self.duration / 2]
+        if not first_half or not second_half:
+            return None
+        return _percentile(second_half, 0.9) - _percentile(first_half, 0.9)
+
+    @property
+    def sustainable(self) -> bool:
+        # In a steady state, all rewards are paid and deposits don't wait longer as the run goes on
+        latency_growth = self.latency_growth
+        return (
+            self.injected > 0
+            and self.confirmed == self.injected
+            and latency_growth is not None
+            and latency_growth <= self.max_latency_growth
+        )
+
+    def latency_percentile(self, fraction: float) -> Optional[float]:
+        return _percentile([latency for (_, latency) in self.latencies], fraction)
+
+    def as_dict(self):
+        return {
+            'rate': self.rate,
+            'duration': self.duration,
+            'injected': self.injected,
+            'confirmed': self.confirmed,
+            'confirmed_fraction': self.confirmed_fraction,
+            'sustainable': self.sustainable,
+            'latency_growth': self.latency_growth,
+            'max_latency_growth': self.max_latency_growth,
+            'latency_p50': self.latency_percentile(0.5),
+            'latency_p90': self.latency_percentile(0.9),
+            'latency_p99': self.latency_percentile(0.99),
+            'latency_max': self.latency_percentile(1.0),
+            'peak_rss_bytes': max((rss for (_, rss) in self.rss_samples), default=None),
+            'rss_samples': self.rss_samples,
+        }
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_soak(
+    *,
+    rate: float,
+    duration: float,
+    drain_seconds: float,
+    num_bridges: int,
+    block_time: float,
+    confirmations: int,
+    poll_interval: float,
+    max_latency_growth: float,
+    workdir: str,
+) -> SoakResult:
+    chain = FakeChain(block_time=block_time, mine_transactions=False)
+    bridges = []
+    for i in range(num_bridges):
+        bridge_address = make_address(f'bridge {i}')
+        main_token_address = make_address(f'main token {i}')
+        chain.add_side_token(
+            bridge_address=bridge_address,
+            main_token_address=main_token_address,
+            side_token_address=make_address(f'side token {i}'),
+            symbol=f'TOKEN{i}',
+        )
+        bridges.append((bridge_address, main_token_address))
+    account = Account.create()
+    chain.set_balance(account.address, 10**30)
+    server = serve_fake_chain(chain)
+
+    db_path = os.path.join(workdir, f'soak-{rate}.sqlite3')
+    db_url = f'sqlite:///{db_path}'
+    private_key_path = os.path.join(workdir, 'private_key.key')
+    with open(private_key_path, 'w') as f:
+        f.write(account.key.hex())
+    config_path = os.path.join(workdir, f'config-{rate}.json')
+    with open(config_path, 'w') as f:
+        json.dump({
+            'bridgeAddresses': {f'BRIDGE{i}': bridge_address for (i, (bridge_address, _)) in enumerate(bridges)},
+            'rpcUrl': f'http://127.0.0.1:{server.server_address[1]}',
+            'dbUrl': db_url,
+            'defaultStartBlock': 1,
+            'requiredBlockConfirmations': confirmations,
+            'rewardRbtc': '0.0001',
+            'rewardThresholds': {f'TOKEN{i}': '1.0' for i in range(num_bridges)},
+            'privateKeyFile': private_key_path,
+            'sleepSeconds': max(int(block_time), 1),
+            'minSleepSeconds': 1,
+        }, f)
+
+    result = SoakResult(rate=rate, duration=duration, max_latency_growth=max_latency_growth)
+    injected_at: Dict[str, float] = {}
+    confirmed_at: Dict[str, float] = {}
+    stopped = threading.Event()
+
+    def mine_blocks():
+        while not stopped.wait(block_time):
+            chain.mine_block()
+
+    miner = threading.Thread(target=mine_blocks, name='miner', daemon=True)
+    miner.start()
+    log_file = open(os.path.join(workdir, f'rewarder-{rate}.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'from sovryn_bridge_rewarder.cli import main; main()', config_path],
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+    DBSession = init_sqlalchemy(db_url, create_models=False)
+    try:
+        start = time.monotonic()
+        next_poll = start
+        deposit_number = 0
+        while True:
+            now = time.monotonic()
+            elapsed = now - start
+            if elapsed < duration:
+                while deposit_number < elapsed * rate:
+                    bridge_address, main_token_address = bridges[deposit_number % num_bridges]
+                    log = chain.add_deposit(
+                        bridge_address=bridge_address,
+                        main_token_address=main_token_address,
+                        to=make_address(f'user {rate} {deposit_number}'),
+                        amount_wei=100 * 10**18,
+                    )
+                    injected_at[log['transactionHash']] = time.monotonic()
+                    deposit_number += 1
+            elif len(confirmed_at) >= len(injected_at) or elapsed > duration + drain_seconds:
+                break
+
+            if now >= next_poll:
+                for transaction_hash in _get_confirmed_deposit_hashes(DBSession):
+                    if transaction_hash not in confirmed_at:
+                        confirmed_at[transaction_hash] = now
+                rss = _get_rss_bytes(process.pid)
+                if rss is not None:
+                    result.rss_samples.append((round(elapsed, 3), rss))
+                next_poll = now + poll_interval
+            if process.poll() is not None:
+                raise RuntimeError(f'rewarder exited with code {process.returncode}, see logs in {workdir}')
+            time.sleep(min(0.05, poll_interval))
+    finally:
+        stopped.set()
+        process.terminate()
+        process.wait(timeout=10)
+        log_file.close()
+        server.shutdown()
+
+    result.injected = len(injected_at)
+    result.latencies = [
+        (injected_time - start, confirmed_at[transaction_hash] - injected_time)
+        for (transaction_hash, injected_time) in injected_at.items()
+        if transaction_hash in confirmed_at
+    ]
+    return result
+
+
+def _get_confirmed_deposit_hashes(DBSession) -> List[str]:
+    try:
+        with DBSession.begin() as dbsession:
+            return [
+                r.deposit_transaction_hash
+                for r in dbsession.query(Reward.deposit_transaction_hash).filter_by(status=RewardStatus.confirmed)
+            ]
+    except OperationalError:
+        # The rewarder has not created the tables yet
+        return []
+
+
+def _get_rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+@click.command()
+@click.option('--rates', default='0.5,1,2', help='Comma-separated deposit rates (deposits per second) to test')
+@click.option('--duration', default=60.0, help='Seconds to inject deposits for, per rate')
+@click.option('--drain-seconds', default=60.0, help='Max seconds to wait for outstanding rewards after injecting')
+@click.option('--bridges', 'num_bridges', default=2, help='Number of bridges to spread the deposits over')
+@click.option('--block-time', default=2.0, help='Seconds between blocks on the fake chain')
+@click.option('--confirmations', default=2, help='requiredBlockConfirmations for the rewarder')
+@click.option('--poll-interval', default=0.5, help='Seconds between database polls for confirmed rewards')
+@click.option('--max-latency-growth', type=float,
+              help='Max growth of the p90 latency from the first to the second half of a sustainable run, in seconds '
+                   '(default: 2 block times)')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results as JSON to this file')
+def main(
+    rates: str,
+    duration: float,
+    drain_seconds: float,
+    num_bridges: int,
+    block_time: float,
+    confirmations: int,
+    poll_interval: float,
+    max_latency_growth: Optional[float],
+    output: Optional[str],
+):
+    if max_latency_growth is None:
+        max_latency_growth = 2 * block_time
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rate in [float(r) for r in rates.split(',')]:
+            click.echo(f'Soaking at {rate} deposits/s for {duration} s...')
+            result = run_soak(
+                rate=rate,
+                duration=duration,
+                drain_seconds=drain_seconds,
+                num_bridges=num_bridges,
+                block_time=block_time,
+                confirmations=confirmations,
+                poll_interval=poll_interval,
+                max_latency_growth=max_latency_growth,
+                workdir=workdir,
+            )
+            results.append(result)
+            data = result.as_dict()
+            click.echo(
+                f'  confirmed {data["confirmed"]}/{data["injected"]} ({data["confirmed_fraction"]:.0%}), '
+                f'latency growth {_format_seconds(data["latency_growth"])}, '
+                f'latency p50 {_format_seconds(data["latency_p50"])} '
+                f'p90 {_format_seconds(data["latency_p90"])} '
+                f'p99 {_format_seconds(data["latency_p99"])} '
+                f'max {_format_seconds(data["latency_max"])}, '
+                f'peak RSS {(data["peak_rss_bytes"] or 0) / 2**20:.1f} MiB'
+            )
+
+    sustainable_rates = [r.rate for r in results if r.sustainable]
+    if sustainable_rates:
+        click.echo(f'Max sustainable rate: {max(sustainable_rates)} deposits/s')
+    else:
+        click.echo('None of the tested rates was sustainable')
+    if output:
+        with open(output, 'w') as f:
+            json.dump([r.as_dict() for r in results], f, indent=2)
+
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    return '-' if seconds is None else f'{seconds:.1f} s'
+
+
+if __name__ == '__main__':
+    main()
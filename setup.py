@@ -5,7 +5,7 @@ setup(
     version='0.0.1',
     url='',
     author='Sovryn',
-    packages=find_packages(exclude=['tests', 'tests*']),
+    packages=find_packages(exclude=['tests', 'tests*', 'benchmarks', 'benchmarks*']),
     package_data={'': [
         'abi/*.json',
     ]},
@@ -20,6 +20,8 @@ setup(
         'click',
         'justpy',
         'sentry-sdk',
+        'websockets',
+        'prometheus-client',
     ],
     extras_require={
         'dev': [
@@ -29,7 +31,18 @@ setup(
             # Easier command-line experience
             'ipython',
             'ipdb',
-        ]
+        ],
+        'parquet': [
+            # Parquet export
+            'pyarrow',
+        ],
+        'opentelemetry': [
+            # Exporting traces with OpenTelemetry (run with opentelemetry-instrument)
+            'opentelemetry-api',
+            'opentelemetry-sdk',
+            'opentelemetry-distro',
+            'opentelemetry-exporter-otlp',
+        ],
     },
     entry_points={
         'console_scripts': [
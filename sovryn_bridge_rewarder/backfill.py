@@ -0,0 +1,209 @@
+"""
+Scanning a historical block range for deposits in parallel, e.g. to rebuild the database or to audit a range
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import logging
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session, sessionmaker
+from web3 import Web3
+from web3.contract import Contract
+
+from .config import Config
+from .database import init_sqlalchemy
+from .deposits import Deposit, get_deposits
+from .log_archive import LogArchive
+from .main import get_start_block, update_last_processed_block
+from .models import Reward
+from .reorgs import get_block_hash, record_scanned_window
+from .rewards import BULK_BATCH_SIZE, queue_rewards
+from .utils import lower_address
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BackfillResult:
+    from_block: int
+    to_block: int
+    num_deposits: int = 0
+    num_queued: int = 0
+    checkpoint_updated: bool = False
+
+
+def split_range(from_block: int, to_block: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Split the inclusive block range into consecutive (from_block, to_block) chunks of at most chunk_size blocks
+    """
+    if chunk_size < 1:
+        raise ValueError('chunk_size must be at least 1')
+    return [
+        (chunk_from_block, min(chunk_from_block + chunk_size - 1, to_block))
+        for chunk_from_block in range(from_block, to_block + 1, chunk_size)
+    ]
+
+
+def backfill(
+    *,
+    web3: Web3,
+    bridge_contracts: Dict[str, Contract],
+    DBSession: sessionmaker,
+    config: Config,
+    from_block: int,
+    to_block: int,
+    chunk_size: int = 10000,
+    workers: int = 4,
+    dry_run: bool = False,
+    archive: Optional[LogArchive] = None,
+) -> BackfillResult:
+    """
+    Scan the block range in chunks with a pool of worker threads, and queue rewards for the deposits found.
+
+    The chunks are merged in block order in the calling thread, so the outcome is the same as with a sequential
+    scan, and running the backfill again over the same range doesn't queue anything twice.
+
+    The last processed block of the live rewarder is only moved forward after the whole range is merged, and
+    only if the range connects to it (so that no gap is left). With `dry_run`, nothing is written to the
+    database: the rewards are queued in a scratch in-memory database instead, which gets a copy of the existing
+    rewards of the users in each chunk. The configured database is only read, so the dry run doesn't lock it.
+
+    If an archive is given, the logs are read from it and the missing ranges are added to it.
+    """
+    result = BackfillResult(from_block=from_block, to_block=to_block)
+    chunks = split_range(from_block, to_block, chunk_size)
+    logger.info(
+        'Backfilling blocks %s to %s in %s chunks with %s workers%s',
+        from_block, to_block, len(chunks), workers, ' (dry run)' if dry_run else '',
+    )
+    # Fetched before the logs, like in process_new_deposits
+    to_block_hash = get_block_hash(web3, to_block)
+    if to_block_hash is None:
+        raise ValueError(f'block {to_block} not found')
+
+    if dry_run:
+        ScratchSession = init_sqlalchemy('sqlite://', create_models=True)
+        dbsession = ScratchSession()
+        copied_users = set()
+    else:
+        dbsession = DBSession()
+    try:
+        for (chunk_from_block, chunk_to_block), deposits in scan_chunks(
+            web3=web3,
+            bridge_contracts=bridge_contracts,
+            config=config,
+            chunks=chunks,
+            workers=workers,
+            archive=archive,
+        ):
+            if dry_run:
+                _copy_existing_rewards(
+                    DBSession=DBSession,
+                    scratch_session=dbsession,
+                    user_addresses={lower_address(deposit.user_address) for deposit in deposits} - copied_users,
+                )
+                copied_users.update(lower_address(deposit.user_address) for deposit in deposits)
+            result.num_queued += queue_rewards(
+                deposits=deposits,
+                dbsession=dbsession,
+                web3=web3,
+                reward_amount_rbtc=config.reward_rbtc,
+                deposit_thresholds=config.reward_thresholds,
+            )
+            result.num_deposits += len(deposits)
+            dbsession.commit()
+            logger.info(
+                'Merged chunk %s-%s: %s deposits, %s rewards queued so far',
+                chunk_from_block, chunk_to_block, len(deposits), result.num_queued,
+            )
+    finally:
+        dbsession.rollback()
+        dbsession.close()
+
+    if dry_run:
+        return result
+
+    with DBSession.begin() as dbsession:
+        start_block = get_start_block(dbsession, config.default_start_block, for_update=True)
+        if from_block <= start_block <= to_block:
+            logger.info('Moving last processed block to %s', to_block)
+            update_last_processed_block(dbsession, to_block)
+            record_scanned_window(
+                dbsession,
+                from_block=from_block,
+                to_block=to_block,
+                to_block_hash=to_block_hash,
+            )
+            result.checkpoint_updated = True
+        else:
+            logger.info(
+                'Not moving last processed block: the next block to process (%s) is not in the range %s-%s',
+                start_block, from_block, to_block,
+            )
+    return result
+
+
+def _copy_existing_rewards(*, DBSession: sessionmaker, scratch_session: Session, user_addresses: Set[str]):
+    """
+    Copy the rewards of the users from the database to the scratch database of a dry run, in a short read-only
+    transaction
+    """
+    if not user_addresses:
+        return
+    reward = Reward.__table__
+    columns = [column for column in reward.columns if column.name != 'id']
+    user_addresses = list(user_addresses)
+    with DBSession() as dbsession:
+        rows = []
+        for i in range(0, len(user_addresses), BULK_BATCH_SIZE):
+            rows.extend(dbsession.execute(
+                select(*columns).where(
+                    func.lower(reward.c.user_address).in_(user_addresses[i:i + BULK_BATCH_SIZE])
+                )
+            ).mappings())
+    for i in range(0, len(rows), BULK_BATCH_SIZE):
+        scratch_session.execute(reward.insert(), [dict(row) for row in rows[i:i + BULK_BATCH_SIZE]])
+
+
+def scan_chunks(
+    *,
+    web3: Web3,
+    bridge_contracts: Dict[str, Contract],
+    config: Config,
+    chunks: List[Tuple[int, int]],
+    workers: int,
+    archive: Optional[LogArchive],
+) -> Iterator[Tuple[Tuple[int, int], List[Deposit]]]:
+    """
+    Yield (chunk, deposits) in chunk order, scanning at most 2 * workers chunks ahead of the consumer
+    """
+    def scan_chunk(chunk: Tuple[int, int]) -> List[Deposit]:
+        chunk_from_block, chunk_to_block = chunk
+        deposits = []
+        for bridge_contract in bridge_contracts.values():
+            deposits.extend(get_deposits(
+                bridge_contract=bridge_contract,
+                web3=web3,
+                from_block=chunk_from_block,
+                to_block=chunk_to_block,
+                fee_percentage=config.deposit_fee_percentage,
+                archive=archive,
+            ))
+        return deposits
+
+    remaining_chunks = iter(chunks)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backfill') as executor:
+        pending = deque()
+        for chunk in remaining_chunks:
+            pending.append((chunk, executor.submit(scan_chunk, chunk)))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            chunk, future = pending.popleft()
+            deposits = future.result()
+            next_chunk = next(remaining_chunks, None)
+            if next_chunk is not None:
+                pending.append((next_chunk, executor.submit(scan_chunk, next_chunk)))
+            yield chunk, deposits
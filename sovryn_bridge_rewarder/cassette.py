@@ -0,0 +1,92 @@
+"""
+Recording and replaying JSON-RPC responses, for running the pipeline repeatably against real chain data without
+a node
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from eth_utils import to_hex
+from web3.providers import BaseProvider
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteMiss(Exception):
+    def __init__(self, method: str, params: Any):
+        super().__init__(f'no recorded response for {method} {params!r}')
+        self.method = method
+        self.params = params
+
+
+class CassetteProvider(BaseProvider):
+    """
+    Web3 provider that answers requests from responses recorded in a cassette file.
+
+    If an upstream provider is given, requests that are not in the cassette are passed to it and the responses
+    are recorded. Otherwise they raise CassetteMiss. The file is JSON lines, gzipped if the path ends with .gz.
+    """
+    def __init__(self, path: str, *, upstream: Optional[BaseProvider] = None):
+        super().__init__()
+        self.path = path
+        self.upstream = upstream
+        self.hits = 0
+        self.misses = 0
+        self._responses: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if os.path.exists(path):
+            with self._open('rt') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._responses[(entry['method'], entry['params'])] = entry['response']
+            logger.info('Loaded %s recorded responses from %s', len(self._responses), path)
+
+    def make_request(self, method, params):
+        key = (method, _serialize_params(params))
+        response = self._responses.get(key)
+        if response is not None:
+            self.hits += 1
+            return response
+        if self.upstream is None:
+            raise CassetteMiss(method, params)
+
+        self.misses += 1
+        response = self.upstream.make_request(method, params)
+        if 'error' not in response:
+            with self._lock:
+                self._responses[key] = response
+                if self._file is None:
+                    self._file = self._open('at')
+                self._file.write(json.dumps({'method': method, 'params': key[1], 'response': response}))
+                self._file.write('\n')
+        return response
+
+    def isConnected(self):
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _open(self, mode: str):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, mode)
+        return open(self.path, mode)
+
+
+def _serialize_params(params: Any) -> str:
+    return json.dumps(params, sort_keys=True, default=_json_default)
+
+
+def _json_default(value: Any):
+    if isinstance(value, (bytes, bytearray)):
+        return to_hex(value)
+    if hasattr(value, 'items'):
+        return dict(value)
+    return str(value)
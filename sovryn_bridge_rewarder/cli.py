@@ -1,24 +1,274 @@
+import csv
+import dataclasses
+from datetime import datetime, timezone
+from decimal import Decimal
 import sys
 from multiprocessing import Process
 import json
 import logging
 import os
+from typing import List, Optional
 
 import click
+from web3 import Web3
 
-from .main import run_rewarder
-from .config import load_from_json
+from .backfill import backfill
+from .cassette import CassetteProvider
+from .log_archive import LogArchive
+from .database import init_read_sqlalchemy, init_sqlalchemy
+from .export import EXPORT_FORMATS, export_rewards
+from .main import get_bridge_contract, run_rewarder
+from .config import Config, RewardThresholdMap, load_from_json
+from .models import RewardStatus
+from .profiling import RoundProfiler, install_signal_handler
+from .rpc import RPCStats, init_web3
+from .simulation import SimulatedReward, simulate
+from .statistics import rebuild_reward_statistics
 
 
-@click.command('sovryn_bridge_rewarder')
+class _DefaultCommandGroup(click.Group):
+    """
+    Group that runs the `run` command if no other command is given, so that the original invocation
+    `sovryn_bridge_rewarder [--ui] config.json` still works
+    """
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args = ['run'] + list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group('sovryn_bridge_rewarder', cls=_DefaultCommandGroup)
+def main():
+    """
+    Bot that rewards RBTC to users of the token bridge
+    """
+
+
+@main.command('run')
 @click.argument('config_file')
 @click.option('--rewarder/--no-rewarder', default=True)
 @click.option('--ui/--no-ui', default=False)
+@click.option('--profile', 'profile_rounds', default=0, show_default=True,
+              help='Profile CPU and memory use of the first N rounds')
+@click.option('--profile-dir', default='profiles', show_default=True, help='Directory for the profiles')
+@click.option('--profile-signal-rounds', default=3, show_default=True,
+              help='Number of rounds to profile when the process gets SIGUSR1')
 @click.pass_context
-def main(context, config_file: str, rewarder: bool, ui: bool):
+def run(context, config_file: str, rewarder: bool, ui: bool, profile_rounds: int, profile_dir: str,
+        profile_signal_rounds: int):
     """
     Start a bot that rewards RBTC to users of the token bridge
     """
+    config = _load_config(context, config_file)
+
+    ui_process = None
+    if ui:
+        ui_process = _launch(target=_start_ui, args=(config,), in_process=rewarder)
+
+    try:
+        if rewarder:
+            click.echo('Starting rewarder bot')
+            profiler = RoundProfiler(output_dir=profile_dir)
+            if profile_rounds:
+                profiler.arm(profile_rounds)
+            install_signal_handler(profiler, num_rounds=profile_signal_rounds)
+            run_rewarder(config, profiler=profiler)
+    finally:
+        if ui_process:
+            _close_process(ui_process)
+
+
+@main.command('backfill')
+@click.argument('config_file')
+@click.option('--from-block', type=int, help='First block to scan (default: defaultStartBlock)')
+@click.option('--to-block', type=int, help='Last block to scan (default: the latest confirmed block)')
+@click.option('--chunk-size', default=10000, show_default=True, help='Number of blocks scanned per task')
+@click.option('--workers', default=4, show_default=True, help='Number of parallel scanning threads')
+@click.option('--dry-run', is_flag=True, help='Only report what would be queued, without writing to the database')
+@click.pass_context
+def backfill_command(context, config_file: str, from_block: Optional[int], to_block: Optional[int],
+                     chunk_size: int, workers: int, dry_run: bool):
+    """
+    Scan a historical block range in parallel and queue rewards for the deposits found.
+    The rewards are sent by the rewarder bot.
+    """
+    config = _load_config(context, config_file)
+    DBSession = init_sqlalchemy(config.db_url, create_models=True, profile=config.db_profile)
+    rpc_stats = RPCStats()
+    web3 = init_web3(config.rpc_url, stats=rpc_stats)
+    if from_block is None:
+        from_block = config.default_start_block
+    if to_block is None:
+        to_block = web3.eth.get_block_number() - config.required_block_confirmations
+    if to_block < from_block:
+        context.fail(f'--to-block {to_block} is smaller than --from-block {from_block}')
+
+    bridge_contracts = {
+        k: get_bridge_contract(bridge_address=v, web3=web3)
+        for (k, v) in config.bridge_addresses.items()
+    }
+    result = backfill(
+        web3=web3,
+        bridge_contracts=bridge_contracts,
+        DBSession=DBSession,
+        config=config,
+        from_block=from_block,
+        to_block=to_block,
+        chunk_size=chunk_size,
+        workers=workers,
+        dry_run=dry_run,
+        archive=LogArchive(config.log_archive_dir) if config.log_archive_dir else None,
+    )
+    rpc_stats.log_summary()
+    click.echo(
+        f'Scanned blocks {result.from_block}-{result.to_block}: {result.num_deposits} deposits, '
+        f'{result.num_queued} rewards {"would be " if dry_run else ""}queued'
+    )
+    if not dry_run and not result.checkpoint_updated:
+        click.echo('Last processed block was not changed, as the range does not connect to it')
+
+
+@main.command('simulate')
+@click.argument('config_file')
+@click.option('--from-block', type=int, required=True, help='First block to simulate')
+@click.option('--to-block', type=int, required=True, help='Last block to simulate')
+@click.option('--cassette', type=click.Path(dir_okay=False), help='Replay RPC responses recorded in this file')
+@click.option('--record', is_flag=True, help='Fetch responses missing from the cassette from rpcUrl and record them')
+@click.option('--threshold', 'thresholds', multiple=True, metavar='SYMBOL=AMOUNT',
+              help='Override the reward threshold of a token, e.g. --threshold DAIbs=20')
+@click.option('--reward-rbtc', type=str, help='Override the reward amount')
+@click.option('--chunk-size', default=10000, show_default=True, help='Number of blocks scanned per task')
+@click.option('--workers', default=1, show_default=True, help='Number of parallel scanning threads')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write the rewards that would be paid as CSV')
+@click.pass_context
+def simulate_command(context, config_file: str, from_block: int, to_block: int, cassette: Optional[str],
+                     record: bool, thresholds: List[str], reward_rbtc: Optional[str], chunk_size: int,
+                     workers: int, output: Optional[str]):
+    """
+    Run the reward decisions over a historical block range in dry-run mode, and report which rewards would be
+    paid. Nothing is signed, sent or written to the database.
+    """
+    config = _load_config(context, config_file)
+    if to_block < from_block:
+        context.fail(f'--to-block {to_block} is smaller than --from-block {from_block}')
+    if record and not cassette:
+        context.fail('--record requires --cassette')
+    reward_thresholds = dict(config.reward_thresholds)
+    for threshold in thresholds:
+        symbol, sep, amount = threshold.partition('=')
+        if not sep:
+            context.fail(f'invalid --threshold {threshold!r}, expected SYMBOL=AMOUNT')
+        reward_thresholds[symbol] = Decimal(amount)
+    config = dataclasses.replace(
+        config,
+        reward_thresholds=RewardThresholdMap(reward_thresholds),
+        reward_rbtc=Decimal(reward_rbtc) if reward_rbtc else config.reward_rbtc,
+    )
+    config.validate()
+
+    provider = None
+    rpc_stats = None
+    if cassette:
+        # The calls that reach the node are the recorded ones, reported with the cassette
+        provider = CassetteProvider(cassette, upstream=Web3.HTTPProvider(config.rpc_url) if record else None)
+        web3 = Web3(provider)
+    else:
+        rpc_stats = RPCStats()
+        web3 = init_web3(config.rpc_url, stats=rpc_stats)
+    bridge_contracts = {
+        k: get_bridge_contract(bridge_address=v, web3=web3)
+        for (k, v) in config.bridge_addresses.items()
+    }
+    try:
+        result = simulate(
+            web3=web3,
+            bridge_contracts=bridge_contracts,
+            config=config,
+            from_block=from_block,
+            to_block=to_block,
+            chunk_size=chunk_size,
+            workers=workers,
+            archive=LogArchive(config.log_archive_dir) if config.log_archive_dir else None,
+        )
+    finally:
+        if provider:
+            provider.close()
+    if rpc_stats:
+        rpc_stats.log_summary()
+
+    click.echo(f'Simulated blocks {from_block}-{to_block} in {result.seconds:.1f} s '
+               f'({result.blocks_per_second:.0f} blocks/s, {result.deposits_per_second:.1f} deposits/s)')
+    click.echo(f'{result.num_deposits} deposits, {len(result.rewards)} rewards would be paid, '
+               f'{result.total_reward_rbtc} RBTC in total')
+    rewards_by_token = result.rewards_by_token
+    for symbol, num_deposits in sorted(result.deposits_by_token.items()):
+        click.echo(f'  {symbol:<12} {num_deposits:>8} deposits {rewards_by_token.get(symbol, 0):>8} rewards '
+                   f'(threshold: {config.reward_thresholds.get(symbol, "-")})')
+    if provider:
+        click.echo(f'Cassette: {provider.hits} responses replayed, {provider.misses} recorded')
+    if output:
+        with open(output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            field_names = [field.name for field in dataclasses.fields(SimulatedReward)]
+            writer.writerow(field_names)
+            for reward in result.rewards:
+                writer.writerow([getattr(reward, name) for name in field_names])
+
+
+@main.command('export')
+@click.argument('config_file')
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS),
+              help='Output format (default: from the file extension)')
+@click.option('--status', 'statuses', multiple=True, type=click.Choice([s.value for s in RewardStatus]),
+              help='Only export rewards with this status (can be given multiple times)')
+@click.option('--token', 'token_symbols', multiple=True, metavar='SYMBOL',
+              help='Only export rewards for deposits of this side token (can be given multiple times)')
+@click.option('--since', type=click.DateTime(), help='Only export rewards created at or after this time (UTC)')
+@click.option('--until', type=click.DateTime(), help='Only export rewards created before this time (UTC)')
+@click.option('--chunk-size', default=5000, show_default=True,
+              help='Number of rows fetched from the database at a time')
+@click.pass_context
+def export_command(context, config_file: str, output: str, export_format: Optional[str], statuses: List[str],
+                   token_symbols: List[str], since: Optional[datetime], until: Optional[datetime], chunk_size: int):
+    """
+    Export rewards to a CSV (.csv, .csv.gz) or Parquet (.parquet) file. The rows are streamed from the
+    read database (dbReadUrl, or dbUrl), so exports of any size run in constant memory alongside the bot.
+    """
+    config = _load_config(context, config_file)
+    DBSession = init_read_sqlalchemy(config.db_url, db_read_url=config.db_read_url, profile='reporting')
+    try:
+        num_rows = export_rewards(
+            DBSession=DBSession,
+            path=output,
+            export_format=export_format,
+            statuses=[RewardStatus(status) for status in statuses],
+            token_symbols=token_symbols,
+            created_since=since.replace(tzinfo=timezone.utc) if since else None,
+            created_before=until.replace(tzinfo=timezone.utc) if until else None,
+            chunk_size=chunk_size,
+        )
+    except (ValueError, RuntimeError) as e:
+        context.fail(str(e))
+    click.echo(f'Exported {num_rows} rewards to {output}')
+
+
+@main.command('rebuild-statistics')
+@click.argument('config_file')
+@click.pass_context
+def rebuild_statistics_command(context, config_file: str):
+    """
+    Recompute the reward statistics from all rewards, e.g. after rewards were changed with bulk updates, which the
+    statistics don't track
+    """
+    config = _load_config(context, config_file)
+    DBSession = init_sqlalchemy(config.db_url, create_models=True, profile=config.db_profile)
+    with DBSession.begin() as dbsession:
+        rebuild_reward_statistics(dbsession.connection())
+    click.echo('Rebuilt the reward statistics')
+
+
+def _load_config(context, config_file: str) -> Config:
     if not os.path.exists(config_file):
         context.fail(f'config file not found at path {config_file!r}')
     with open(config_file) as f:
@@ -36,18 +286,7 @@ def main(context, config_file: str, rewarder: bool, ui: bool):
         click.echo("Sentry DSN not provided -- Sentry not initialized")
 
     _setup_logging()
-
-    ui_process = None
-    if ui:
-        ui_process = _launch(target=_start_ui, args=(config,), in_process=rewarder)
-
-    try:
-        if rewarder:
-            click.echo('Starting rewarder bot')
-            run_rewarder(config)
-    finally:
-        if ui_process:
-            _close_process(ui_process)
+    return config
 
 
 def _setup_logging():
@@ -8,9 +8,12 @@ from eth_account import Account
 from eth_account.signers.base import BaseAccount
 from eth_utils import is_hex_address
 
+from .database import STORAGE_PROFILES
+
 BridgeAddressMap = NewType('RewardThresholdMap', Dict[str, str])
 RewardThresholdMap = NewType('RewardThresholdMap', Dict[str, Decimal])
 UIConfig = NewType('UIConfig', Dict[str, Any])
+MonitoringConfig = NewType('MonitoringConfig', Dict[str, Any])
 
 
 @dataclass()
@@ -24,14 +27,23 @@ class Config:
     reward_thresholds: RewardThresholdMap
     account: BaseAccount = field(repr=False)
     deposit_fee_percentage: Decimal = Decimal(0)
+    db_profile: str = 'default'
+    db_read_url: str = ''
     sleep_seconds: int = 30
+    min_sleep_seconds: int = 2
+    error_sleep_seconds: int = 60
+    max_blocks_per_round: int = 2000
+    backlog_threshold_blocks: int = 0
     explorer_url: str = 'https://explorer.rsk.co'
     sentry_dsn: str = ''
+    ws_url: str = ''
+    log_archive_dir: str = ''
     ui: UIConfig = field(default_factory=dict)
+    monitoring: MonitoringConfig = field(default_factory=dict)
 
     def validate(self):
         for field in fields(self):
-            type_ = dict if field.name in ('bridge_addresses', 'reward_thresholds', 'ui') else field.type
+            type_ = dict if field.name in ('bridge_addresses', 'reward_thresholds', 'ui', 'monitoring') else field.type
             value = getattr(self, field.name, None)
             if value is None:
                 raise ValueError(f'missing value for {field.name}')
@@ -53,6 +65,12 @@ class Config:
                 'Cannot be over 10% (0.1).'
             )
 
+        if self.db_profile not in STORAGE_PROFILES:
+            raise ValueError(f'unknown db_profile {self.db_profile!r}, expected one of {list(STORAGE_PROFILES)}')
+
+        if self.max_blocks_per_round < 1:
+            raise ValueError('max_blocks_per_round must be at least 1')
+
         if not self.reward_thresholds:
             raise ValueError(
                 'Empty reward_thresholds -- no rewards would be given'
@@ -76,16 +94,25 @@ def load_from_json(json_dict) -> Config:
             bridge_addresses=json_dict['bridgeAddresses'],
             rpc_url=json_dict['rpcUrl'],
             db_url=json_dict['dbUrl'],
+            db_profile=json_dict.get('dbProfile', Config.db_profile),
+            db_read_url=json_dict.get('dbReadUrl', Config.db_read_url),
             default_start_block=json_dict['defaultStartBlock'],
             required_block_confirmations=json_dict['requiredBlockConfirmations'],
             deposit_fee_percentage=Decimal(json_dict.get('depositFeePercentage', Config.deposit_fee_percentage)),
             reward_rbtc=Decimal(json_dict['rewardRbtc']),
             reward_thresholds=reward_thresholds,
             sleep_seconds=json_dict.get('sleepSeconds', Config.sleep_seconds),
+            min_sleep_seconds=json_dict.get('minSleepSeconds', Config.min_sleep_seconds),
+            error_sleep_seconds=json_dict.get('errorSleepSeconds', Config.error_sleep_seconds),
+            max_blocks_per_round=json_dict.get('maxBlocksPerRound', Config.max_blocks_per_round),
+            backlog_threshold_blocks=json_dict.get('backlogThresholdBlocks', Config.backlog_threshold_blocks),
             explorer_url=json_dict.get('explorerUrl', Config.explorer_url),
             account=account,
             sentry_dsn=json_dict.get('sentryDsn', Config.sentry_dsn),
+            ws_url=json_dict.get('wsUrl', Config.ws_url),
+            log_archive_dir=json_dict.get('logArchiveDir', Config.log_archive_dir),
             ui=json_dict.get('ui', dict()),
+            monitoring=json_dict.get('monitoring', dict()),
         )
     except KeyError as e:
         raise ValueError(f'missing required configuration option: {e.args[0]}')
@@ -0,0 +1,145 @@
+"""
+Database engine setup, with named storage profiles tuned for SQLite and PostgreSQL
+"""
+from dataclasses import dataclass
+import logging
+from typing import Any, Dict, Optional
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+
+from .migrations import migrate
+from . import statistics  # noqa: F401 -- registers the session event that keeps the reward statistics up to date
+from . import tracing  # noqa: F401 -- registers the session events that trace commits
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class StorageProfile:
+    # SQLite. WAL lets readers (e.g. the UI) run concurrently with the writer
+    sqlite_journal_mode: str = 'wal'
+    sqlite_synchronous: str = 'normal'  # durable enough with WAL, and much faster than full
+    sqlite_busy_timeout_ms: int = 10_000
+    # PostgreSQL
+    postgresql_pool_size: int = 5
+    postgresql_max_overflow: int = 5
+    postgresql_pool_recycle_seconds: int = 1800
+    postgresql_statement_timeout_ms: int = 60_000  # 0 = no timeout
+    postgresql_stream_results: bool = False  # use server-side cursors for all queries
+    tuned: bool = True  # False = SQLAlchemy defaults
+
+
+STORAGE_PROFILES: Dict[str, StorageProfile] = {
+    # The rewarder and the UI
+    'default': StorageProfile(),
+    # Long-running reads of many rows, e.g. exports
+    'reporting': StorageProfile(
+        postgresql_pool_size=2,
+        postgresql_max_overflow=0,
+        postgresql_statement_timeout_ms=0,
+        postgresql_stream_results=True,
+    ),
+    # Plain create_engine, as before the profiles
+    'legacy': StorageProfile(tuned=False),
+}
+
+
+def get_storage_profile(name: str) -> StorageProfile:
+    try:
+        return STORAGE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f'unknown storage profile {name!r}, expected one of {list(STORAGE_PROFILES)}') from None
+
+
+def get_engine_options(db_url: str, profile: StorageProfile) -> Dict[str, Any]:
+    """
+    Get the keyword arguments for create_engine for the database URL and storage profile
+    """
+    if not profile.tuned:
+        return {}
+    backend = make_url(db_url).get_backend_name()
+    if backend == 'sqlite':
+        return {
+            'connect_args': {
+                'timeout': profile.sqlite_busy_timeout_ms / 1000,
+            },
+        }
+    if backend == 'postgresql':
+        options = {
+            'pool_size': profile.postgresql_pool_size,
+            'max_overflow': profile.postgresql_max_overflow,
+            'pool_pre_ping': True,
+            'pool_recycle': profile.postgresql_pool_recycle_seconds,
+            'connect_args': {
+                'options': f'-c statement_timeout={profile.postgresql_statement_timeout_ms}',
+            },
+        }
+        if profile.postgresql_stream_results:
+            options['execution_options'] = {'stream_results': True}
+        return options
+    return {}
+
+
+def create_db_engine(db_url: str, *, profile: str = 'default') -> Engine:
+    storage_profile = get_storage_profile(profile)
+    engine = sqlalchemy.create_engine(db_url, echo=False, **get_engine_options(db_url, storage_profile))
+    if storage_profile.tuned and engine.dialect.name == 'sqlite':
+        _set_sqlite_pragmas_on_connect(engine, storage_profile)
+    return engine
+
+
+def init_sqlalchemy(db_url: str, *, create_models: bool = True, profile: str = 'default') -> sessionmaker:
+    """
+    Create a session factory for the database. With create_models, the schema is created or migrated to the
+    latest version.
+    """
+    logger.info('Connecting to database %s with storage profile %s', db_url, profile)
+    engine = create_db_engine(db_url, profile=profile)
+    Session = sessionmaker(bind=engine)
+    if create_models:
+        migrate(engine)
+    return Session
+
+
+def init_read_sqlalchemy(
+    db_url: str,
+    *,
+    db_read_url: Optional[str] = None,
+    profile: str = 'default',
+) -> sessionmaker:
+    """
+    Create a session factory for read-only queries (the UI and reporting). If db_read_url is given, the sessions
+    connect to it (e.g. a read replica) instead of the primary database. Flushing changes in the sessions is an
+    error, so that writes always go through the primary.
+    """
+    url = db_read_url or db_url
+    logger.info(
+        'Connecting to %s database %s with storage profile %s', 'read' if db_read_url else 'primary', url, profile,
+    )
+    engine = create_db_engine(url, profile=profile)
+    ReadSession = sessionmaker(bind=engine)
+    event.listen(ReadSession, 'before_flush', _prevent_writes)
+    return ReadSession
+
+
+def _prevent_writes(session: Session, flush_context, instances):
+    if session.new or session.dirty or session.deleted:
+        raise RuntimeError('cannot write using a read-only database session')
+
+
+def _set_sqlite_pragmas_on_connect(engine: Engine, profile: StorageProfile):
+    in_memory = make_url(engine.url).database in (None, '', ':memory:')
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if not in_memory:
+                cursor.execute(f'PRAGMA journal_mode={profile.sqlite_journal_mode}')
+            cursor.execute(f'PRAGMA synchronous={profile.sqlite_synchronous}')
+            cursor.execute(f'PRAGMA busy_timeout={int(profile.sqlite_busy_timeout_ms)}')
+        finally:
+            cursor.close()
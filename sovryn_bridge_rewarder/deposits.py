@@ -5,16 +5,22 @@ from dataclasses import dataclass
 from decimal import Decimal
 import functools
 import logging
-from typing import List, Any
+from typing import Any, Dict, List, Optional, Union
 
 from web3 import Web3
 from eth_utils import to_int
 from web3.contract import Contract
 
+from .log_archive import LogArchive
+from .metrics import time_stage
+from .tracing import span
 from .utils import (
     get_erc20_contract,
     get_events,
+    get_raw_logs,
+    decode_logs,
     address,
+    lower_address,
     is_contract,
     decode_address_from_userdata,
     UserDataNotAddress,
@@ -23,22 +29,156 @@ from .utils import (
 logger = logging.getLogger(__name__)
 
 
-@dataclass
-class Deposit:
+@dataclass(frozen=True)
+class DepositToken:
     """
-    Token transfer from another chain to RSK
+    The token and bridge of a deposit, shared by all deposits of the token (see intern_deposit_token)
     """
-    user_address: str
     side_token_address: str  # token address in RSK
     side_token_symbol: str  # token symbol in RSK
     main_token_address: str  # the token in the other chain
-    amount_minus_fees_wei: int
-    amount_decimal: Decimal  # Amount without fees in "real" units, decimal adjusted
-    block_hash: str
-    transaction_hash: str
-    log_index: int
-    contract_address: str
-    event: Any = None  # For debugging
+    contract_address: str  # the bridge
+    decimals: int = 18  # of the side token
+    fee_percentage: Decimal = Decimal(0)  # bridge fee, for amount_decimal
+
+
+_deposit_tokens: Dict[DepositToken, DepositToken] = {}
+
+
+def intern_deposit_token(**kwargs: Any) -> DepositToken:
+    """
+    Get the shared DepositToken with the given values. There are only a few, one for each token, bridge and fee
+    """
+    token = DepositToken(**kwargs)
+    return _deposit_tokens.setdefault(token, token)
+
+
+class Deposit:
+    """
+    Token transfer from another chain to RSK
+
+    Catching up a long block range can keep a lot of these in memory, so they're compact: the token data is a
+    reference to a shared DepositToken, and the user address and the hashes are kept as raw bytes. They're
+    converted to (lowercase) hex when read, which is mostly when the reward is written to the database.
+    """
+    __slots__ = (
+        'token',
+        'amount_minus_fees_wei',
+        'log_index',
+        'block_number',
+        '_user_address',
+        '_block_hash',
+        '_transaction_hash',
+    )
+
+    def __init__(
+        self,
+        *,
+        token: DepositToken,
+        user_address: Union[bytes, str],
+        amount_minus_fees_wei: int,
+        block_hash: Union[bytes, str],
+        transaction_hash: Union[bytes, str],
+        log_index: int,
+        block_number: Optional[int] = None,
+    ):
+        self.token = token
+        self.amount_minus_fees_wei = amount_minus_fees_wei
+        self.log_index = log_index
+        self.block_number = block_number
+        self._user_address = _to_bytes(user_address, 20)
+        self._block_hash = _to_bytes(block_hash, 32)
+        self._transaction_hash = _to_bytes(transaction_hash, 32)
+
+    @property
+    def user_address(self) -> str:
+        return '0x' + self._user_address.hex()
+
+    @property
+    def block_hash(self) -> str:
+        return '0x' + self._block_hash.hex()
+
+    @property
+    def transaction_hash(self) -> str:
+        return '0x' + self._transaction_hash.hex()
+
+    @property
+    def side_token_address(self) -> str:
+        return self.token.side_token_address
+
+    @property
+    def side_token_symbol(self) -> str:
+        return self.token.side_token_symbol
+
+    @property
+    def main_token_address(self) -> str:
+        return self.token.main_token_address
+
+    @property
+    def contract_address(self) -> str:
+        return self.token.contract_address
+
+    @property
+    def amount_decimal(self) -> Decimal:
+        """
+        Amount without fees in "real" units, decimal adjusted
+        """
+        amount_minus_fees_decimal = Decimal(self.amount_minus_fees_wei) / (Decimal(10) ** self.token.decimals)
+        return amount_minus_fees_decimal / (Decimal(1) - self.token.fee_percentage)
+
+    def replace(self, **changes: Any) -> 'Deposit':
+        """
+        Get a copy of the deposit with the given constructor arguments changed
+        """
+        values = dict(
+            token=self.token,
+            user_address=self._user_address,
+            amount_minus_fees_wei=self.amount_minus_fees_wei,
+            block_hash=self._block_hash,
+            transaction_hash=self._transaction_hash,
+            log_index=self.log_index,
+            block_number=self.block_number,
+        )
+        values.update(changes)
+        return Deposit(**values)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in DEPOSIT_FIELDS}
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Deposit):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return 'Deposit({})'.format(', '.join(f'{name}={value!r}' for name, value in self.as_dict().items()))
+
+
+DEPOSIT_FIELDS = (
+    'user_address',
+    'side_token_address',
+    'side_token_symbol',
+    'main_token_address',
+    'amount_minus_fees_wei',
+    'amount_decimal',
+    'block_number',
+    'block_hash',
+    'transaction_hash',
+    'log_index',
+    'contract_address',
+)
+
+
+def _to_bytes(value: Union[bytes, str], length: int) -> bytes:
+    if isinstance(value, str):
+        value = bytes.fromhex(value[2:] if value.startswith(('0x', '0X')) else value)
+    else:
+        value = bytes(value)
+    if len(value) != length:
+        raise ValueError(f'expected {length} bytes, got {len(value)}')
+    return value
 
 
 def get_deposits(
@@ -48,14 +188,68 @@ def get_deposits(
     from_block: int,
     to_block: int,
     fee_percentage: Decimal,
+    archive: Optional[LogArchive] = None,
+):
+    """
+    Load all Deposits (token transfers from another chain to RSK) from the RSK bridge contract.
+
+    If an archive is given, the logs are read from it, and the parts of the range that are not archived yet
+    are fetched from the node and added to it.
+    """
+    if archive is None:
+        events = get_events(
+            event=bridge_contract.events.AcceptedCrossTransfer,
+            from_block=from_block,
+            to_block=to_block,
+        )
+    else:
+        for (missing_from_block, missing_to_block) in archive.get_missing_ranges(
+            address=bridge_contract.address,
+            from_block=from_block,
+            to_block=to_block,
+        ):
+            archive.add_logs(
+                address=bridge_contract.address,
+                from_block=missing_from_block,
+                to_block=missing_to_block,
+                logs=get_raw_logs(
+                    web3=web3,
+                    event=bridge_contract.events.AcceptedCrossTransfer,
+                    contract_address=bridge_contract.address,
+                    from_block=missing_from_block,
+                    to_block=missing_to_block,
+                ),
+            )
+        events = decode_logs(
+            event=bridge_contract.events.AcceptedCrossTransfer,
+            raw_logs=archive.iter_logs(
+                address=bridge_contract.address,
+                from_block=from_block,
+                to_block=to_block,
+            ),
+        )
+    return parse_deposits_from_events(
+        web3=web3,
+        bridge_contract=bridge_contract,
+        events=events,
+        fee_percentage=fee_percentage,
+    )
+
+
+def get_deposits_from_logs(
+    *,
+    bridge_contract: Contract,
+    web3: Web3,
+    raw_logs: List[Dict[str, Any]],
+    fee_percentage: Decimal,
 ):
     """
-    Load all Deposits (token transfers from another chain to RSK) from the RSK bridge contract
+    Parse Deposits from raw JSON-RPC logs (e.g. from a subscription), ignoring logs not from the bridge contract
     """
-    events = get_events(
+    bridge_address = bridge_contract.address.lower()
+    events = decode_logs(
         event=bridge_contract.events.AcceptedCrossTransfer,
-        from_block=from_block,
-        to_block=to_block,
+        raw_logs=[log for log in raw_logs if log['address'].lower() == bridge_address],
     )
     return parse_deposits_from_events(
         web3=web3,
@@ -81,34 +275,37 @@ def get_side_token(
     bridge_contract: Contract,
     main_token_address,
 ):
-    is_main_token = bridge_contract.functions.knownTokens(
-        address(main_token_address)
-    ).call()
-    if is_main_token:
-        logger.info('Token %s is main token', main_token_address)
-        return None
-
-    side_token_address = bridge_contract.functions.mappedTokens(
-        address(main_token_address)
-    ).call()
-    if to_int(hexstr=side_token_address) == 0:
-        logger.error('side token not found for %s', main_token_address)
-        return None
-
-    side_token_contract = get_erc20_contract(
-        web3=web3,
-        token_address=side_token_address,
-    )
-    side_token_symbol = side_token_contract.functions.symbol().call()
-    side_token_decimals = side_token_contract.functions.decimals().call()
-    return SideToken(
-        address=side_token_address.lower(),
-        symbol=side_token_symbol,
-        decimals=side_token_decimals,
-        contract=side_token_contract,
-    )
+    with span('deposits.resolve_token', main_token_address=main_token_address) as token_span:
+        is_main_token = bridge_contract.functions.knownTokens(
+            address(main_token_address)
+        ).call()
+        if is_main_token:
+            logger.info('Token %s is main token', main_token_address)
+            return None
+
+        side_token_address = bridge_contract.functions.mappedTokens(
+            address(main_token_address)
+        ).call()
+        if to_int(hexstr=side_token_address) == 0:
+            logger.error('side token not found for %s', main_token_address)
+            return None
+
+        side_token_contract = get_erc20_contract(
+            web3=web3,
+            token_address=side_token_address,
+        )
+        side_token_symbol = side_token_contract.functions.symbol().call()
+        side_token_decimals = side_token_contract.functions.decimals().call()
+        token_span.set_data('side_token_symbol', side_token_symbol)
+        return SideToken(
+            address=lower_address(side_token_address),
+            symbol=side_token_symbol,
+            decimals=side_token_decimals,
+            contract=side_token_contract,
+        )
 
 
+@time_stage('parse_deposits_from_events')
 def parse_deposits_from_events(
     *,
     web3: Web3,
@@ -138,7 +335,7 @@ def parse_deposits_from_events(
     ret = []
     for event in events:
         args = event['args']
-        main_token_address = args['_tokenAddress'].lower()  # this is in another chain
+        main_token_address = lower_address(args['_tokenAddress'])  # this is in another chain
         side_token = get_side_token(
             web3=web3,
             bridge_contract=bridge_contract,
@@ -172,23 +369,23 @@ def parse_deposits_from_events(
                 )
                 continue
         else:
-            user_address = receiver_address.lower()
-
-        amount_minus_fees_decimal = Decimal(amount_minus_fees_wei) / (Decimal(10) ** side_token.decimals)
-        amount_decimal = amount_minus_fees_decimal / (Decimal(1) - fee_percentage)
+            user_address = receiver_address
 
         deposit = Deposit(
+            token=intern_deposit_token(
+                side_token_address=side_token.address,
+                side_token_symbol=side_token.symbol,
+                main_token_address=main_token_address,
+                contract_address=lower_address(event.address),
+                decimals=side_token.decimals,
+                fee_percentage=fee_percentage,
+            ),
             user_address=user_address,
-            side_token_address=side_token.address,
-            side_token_symbol=side_token.symbol,
-            main_token_address=main_token_address,
             amount_minus_fees_wei=amount_minus_fees_wei,
-            amount_decimal=amount_decimal,
-            block_hash=event.blockHash.hex().lower(),
-            transaction_hash=event.transactionHash.hex().lower(),
-            contract_address=event.address.lower(),
+            block_number=event.blockNumber,
+            block_hash=event.blockHash,
+            transaction_hash=event.transactionHash,
             log_index=event.logIndex,
-            #event=event,
         )
         ret.append(deposit)
     return ret
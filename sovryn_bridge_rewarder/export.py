@@ -0,0 +1,198 @@
+"""
+Streaming export of the reward history to CSV or Parquet files
+"""
+import csv
+from datetime import datetime
+import gzip
+import logging
+from typing import Any, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from .models import Reward, RewardStatus
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = ('csv', 'csv.gz', 'parquet')
+EXPORT_COLUMNS = (
+    Reward.id,
+    Reward.status,
+    Reward.created_at,
+    Reward.sent_at,
+    Reward.updated_at,
+    Reward.user_address,
+    Reward.reward_rbtc_wei,
+    Reward.reward_transaction_hash,
+    Reward.reward_transaction_nonce,
+    Reward.deposit_side_token_symbol,
+    Reward.deposit_side_token_address,
+    Reward.deposit_main_token_address,
+    Reward.deposit_amount_minus_fees_wei,
+    Reward.deposit_transaction_hash,
+    Reward.deposit_log_index,
+    Reward.deposit_block_number,
+    Reward.deposit_block_hash,
+    Reward.deposit_contract_address,
+)
+EXPORT_COLUMN_NAMES = [column.key for column in EXPORT_COLUMNS]
+
+
+def get_export_format(path: str) -> str:
+    """
+    Get the export format from the file extension of path
+    """
+    if path.endswith('.csv.gz'):
+        return 'csv.gz'
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith('.parquet'):
+        return 'parquet'
+    raise ValueError(f'cannot determine the export format of {path!r}, expected one of {EXPORT_FORMATS}')
+
+
+def export_rewards(
+    *,
+    DBSession: sessionmaker,
+    path: str,
+    export_format: Optional[str] = None,
+    statuses: Sequence[RewardStatus] = (),
+    token_symbols: Sequence[str] = (),
+    created_since: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    chunk_size: int = 5000,
+) -> int:
+    """
+    Write the rewards matching the filters to path, ordered by id, and return the number of rewards written.
+
+    The rows are streamed from the database in chunks of chunk_size (with a server-side cursor, where supported)
+    and written as they arrive, so the memory used doesn't depend on the number of rows.
+    """
+    if export_format is None:
+        export_format = get_export_format(path)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'unknown export format {export_format!r}, expected one of {EXPORT_FORMATS}')
+
+    with DBSession() as dbsession:
+        chunks = _iter_chunks(
+            _iter_rows(
+                dbsession=dbsession,
+                statuses=statuses,
+                token_symbols=token_symbols,
+                created_since=created_since,
+                created_before=created_before,
+                chunk_size=chunk_size,
+            ),
+            chunk_size,
+        )
+        if export_format == 'parquet':
+            num_rows = _write_parquet(path, chunks)
+        else:
+            num_rows = _write_csv(path, chunks, compress=export_format == 'csv.gz')
+    logger.info('Exported %s rewards to %s', num_rows, path)
+    return num_rows
+
+
+def _iter_rows(
+    *,
+    dbsession: Session,
+    statuses: Sequence[RewardStatus],
+    token_symbols: Sequence[str],
+    created_since: Optional[datetime],
+    created_before: Optional[datetime],
+    chunk_size: int,
+) -> Iterator[Tuple[Any, ...]]:
+    query = dbsession.query(*EXPORT_COLUMNS)
+    if statuses:
+        query = query.filter(Reward.status.in_(statuses))
+    if token_symbols:
+        query = query.filter(Reward.deposit_side_token_symbol.in_(token_symbols))
+    if created_since is not None:
+        query = query.filter(Reward.created_at >= created_since)
+    if created_before is not None:
+        query = query.filter(Reward.created_at < created_before)
+    # yield_per also enables stream_results (server-side cursors in PostgreSQL)
+    yield from query.order_by(Reward.id).yield_per(chunk_size)
+
+
+def _iter_chunks(rows: Iterable[Tuple[Any, ...]], chunk_size: int) -> Iterator[List[Tuple[Any, ...]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _to_csv_value(value: Any) -> Any:
+    if isinstance(value, RewardStatus):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _write_csv(path: str, chunks: Iterable[List[Tuple[Any, ...]]], *, compress: bool) -> int:
+    num_rows = 0
+    if compress:
+        f = gzip.open(path, 'wt', newline='')
+    else:
+        f = open(path, 'w', newline='')
+    with f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMN_NAMES)
+        for chunk in chunks:
+            writer.writerows([_to_csv_value(value) for value in row] for row in chunk)
+            num_rows += len(chunk)
+    return num_rows
+
+
+def _write_parquet(path: str, chunks: Iterable[List[Tuple[Any, ...]]]) -> int:
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('Parquet export requires pyarrow: pip install -e ".[parquet]"') from None
+
+    # Wei amounts don't fit in 64 bits, so they're stored as decimal strings
+    schema = pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('status', pyarrow.string()),
+        ('created_at', pyarrow.timestamp('us', tz='UTC')),
+        ('sent_at', pyarrow.timestamp('us', tz='UTC')),
+        ('updated_at', pyarrow.timestamp('us', tz='UTC')),
+        ('user_address', pyarrow.string()),
+        ('reward_rbtc_wei', pyarrow.string()),
+        ('reward_transaction_hash', pyarrow.string()),
+        ('reward_transaction_nonce', pyarrow.int64()),
+        ('deposit_side_token_symbol', pyarrow.string()),
+        ('deposit_side_token_address', pyarrow.string()),
+        ('deposit_main_token_address', pyarrow.string()),
+        ('deposit_amount_minus_fees_wei', pyarrow.string()),
+        ('deposit_transaction_hash', pyarrow.string()),
+        ('deposit_log_index', pyarrow.int64()),
+        ('deposit_block_number', pyarrow.int64()),
+        ('deposit_block_hash', pyarrow.string()),
+        ('deposit_contract_address', pyarrow.string()),
+    ])
+    assert schema.names == EXPORT_COLUMN_NAMES
+    string_amounts = {'reward_rbtc_wei', 'deposit_amount_minus_fees_wei'}
+
+    num_rows = 0
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for chunk in chunks:
+            columns = []
+            for i, name in enumerate(EXPORT_COLUMN_NAMES):
+                values = [row[i] for row in chunk]
+                if name == 'status':
+                    values = [value.value for value in values]
+                elif name in string_amounts:
+                    values = [str(value) for value in values]
+                columns.append(values)
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(values, type=schema.field(i).type) for i, values in enumerate(columns)],
+                schema=schema,
+            ))
+            num_rows += len(chunk)
+    return num_rows
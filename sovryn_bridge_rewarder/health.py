@@ -0,0 +1,179 @@
+"""
+Liveness and readiness checks of the rewarder, served over HTTP for process managers and orchestrators
+
+GET /healthz  liveness: the main loop is completing rounds (successfully or not). If this fails, the loop is wedged
+              and the process should be restarted
+GET /readyz   readiness: the last round succeeded recently, the rewarder is keeping up with the chain, rewards are
+              not piling up and the RPC node is answering
+
+Both return 200 if healthy and 503 if not, with the checks and the observed values as JSON.
+"""
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .models import RewardStatus
+from .rpc import RPCStats
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HealthThresholds:
+    liveness_max_seconds: float = 900  # since the last completed round
+    readiness_max_seconds: float = 600  # since the last successful round
+    max_backlog_blocks: int = 1000
+    max_queued_rewards: int = 100
+    max_sending_rewards: int = 0  # rewards should only be sending during a round
+    max_sent_rewards: int = 50  # waiting for confirmation
+    max_rpc_consecutive_errors: int = 5
+
+    @classmethod
+    def from_monitoring_config(cls, monitoring_config: Dict[str, Any]) -> 'HealthThresholds':
+        return cls(
+            liveness_max_seconds=monitoring_config.get('livenessMaxSeconds', cls.liveness_max_seconds),
+            readiness_max_seconds=monitoring_config.get('readinessMaxSeconds', cls.readiness_max_seconds),
+            max_backlog_blocks=monitoring_config.get('maxBacklogBlocks', cls.max_backlog_blocks),
+            max_queued_rewards=monitoring_config.get('maxQueuedRewards', cls.max_queued_rewards),
+            max_sending_rewards=monitoring_config.get('maxSendingRewards', cls.max_sending_rewards),
+            max_sent_rewards=monitoring_config.get('maxSentRewards', cls.max_sent_rewards),
+            max_rpc_consecutive_errors=monitoring_config.get(
+                'maxRpcConsecutiveErrors', cls.max_rpc_consecutive_errors,
+            ),
+        )
+
+
+@dataclass
+class HealthReport:
+    ok: bool
+    checks: Dict[str, bool] = field(default_factory=dict)
+    details: Dict[str, Any] = field(default_factory=dict)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'ok': self.ok,
+            'checks': self.checks,
+            **self.details,
+        }
+
+
+class HealthMonitor:
+    """
+    Health state of the rewarder, updated by the main loop at the end of each round
+    """
+    def __init__(
+        self,
+        *,
+        thresholds: HealthThresholds,
+        rpc_stats: Optional[RPCStats] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.thresholds = thresholds
+        self.rpc_stats = rpc_stats
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Until the first round completes, the age is counted from the start
+        self._started_at = clock()
+        self._last_round_at: Optional[float] = None
+        self._last_success_at: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._current_block: Optional[int] = None
+        self._backlog: Optional[int] = None
+        self._reward_counts: Dict[RewardStatus, int] = {}
+
+    def round_succeeded(self, *, current_block: int, backlog: int, reward_counts: Dict[RewardStatus, int]):
+        with self._lock:
+            self._last_round_at = self._last_success_at = self._clock()
+            self._last_error = None
+            self._current_block = current_block
+            self._backlog = backlog
+            self._reward_counts = dict(reward_counts)
+
+    def round_failed(self, error: BaseException):
+        with self._lock:
+            self._last_round_at = self._clock()
+            self._last_error = repr(error)
+
+    def check_liveness(self) -> HealthReport:
+        with self._lock:
+            seconds = self._clock() - (self._last_round_at or self._started_at)
+        ok = seconds <= self.thresholds.liveness_max_seconds
+        return HealthReport(
+            ok=ok,
+            checks={'round_completed': ok},
+            details={'seconds_since_last_round': round(seconds, 3)},
+        )
+
+    def check_readiness(self) -> HealthReport:
+        t = self.thresholds
+        with self._lock:
+            now = self._clock()
+            seconds_since_success = now - (self._last_success_at or self._started_at)
+            counts = {status: self._reward_counts.get(status, 0) for status in (
+                RewardStatus.queued, RewardStatus.sending, RewardStatus.sent,
+            )}
+            details = {
+                'seconds_since_last_success': round(seconds_since_success, 3),
+                'last_error': self._last_error,
+                'current_block': self._current_block,
+                'backlog_blocks': self._backlog,
+                'rewards': {status.value: count for status, count in counts.items()},
+            }
+            checks = {
+                'round_succeeded': (
+                    self._last_success_at is not None and seconds_since_success <= t.readiness_max_seconds
+                ),
+                'backlog': self._backlog is not None and self._backlog <= t.max_backlog_blocks,
+                'queued_rewards': counts[RewardStatus.queued] <= t.max_queued_rewards,
+                'sending_rewards': counts[RewardStatus.sending] <= t.max_sending_rewards,
+                'sent_rewards': counts[RewardStatus.sent] <= t.max_sent_rewards,
+            }
+        if self.rpc_stats is not None:
+            consecutive_errors = self.rpc_stats.consecutive_errors
+            last_success_at = self.rpc_stats.last_success_at
+            details['rpc_consecutive_errors'] = consecutive_errors
+            details['seconds_since_rpc_success'] = (
+                round(now - last_success_at, 3) if last_success_at is not None else None
+            )
+            checks['rpc'] = consecutive_errors < t.max_rpc_consecutive_errors
+        return HealthReport(ok=all(checks.values()), checks=checks, details=details)
+
+
+class _HealthRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        monitor: HealthMonitor = self.server.monitor
+        path = self.path.split('?', 1)[0]
+        if path == '/healthz':
+            report = monitor.check_liveness()
+        elif path == '/readyz':
+            report = monitor.check_readiness()
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(report.as_dict()).encode()
+        self.send_response(200 if report.ok else 503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_health_server(monitor: HealthMonitor, *, host: str = '0.0.0.0', port: int) -> ThreadingHTTPServer:
+    """
+    Serve /healthz and /readyz in a background thread
+    """
+    server = ThreadingHTTPServer((host, port), _HealthRequestHandler)
+    server.daemon_threads = True
+    server.monitor = monitor
+    thread = threading.Thread(target=server.serve_forever, name='health-server', daemon=True)
+    thread.start()
+    logger.info('Serving health checks at http://%s:%s/healthz and /readyz', host, server.server_address[1])
+    return server
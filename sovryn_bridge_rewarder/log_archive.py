@@ -0,0 +1,406 @@
+"""
+Local append-only archive of raw contract logs, so that ranges that were scanned once can be parsed again without
+fetching the logs from the RPC node
+
+Layout:
+    <directory>/<contract address>/<first block of segment>.jsonl.gz -- logs, one JSON array per line
+    <directory>/<contract address>/<first block of segment>.index.jsonl -- [first block, last block, offset, length]
+        of each gzip member of the segment, one per line
+    <directory>/<contract address>/coverage.jsonl -- block ranges that are archived, one [from, to] per line
+    <directory>/<contract address>/.lock -- locked with flock while reading or writing the files of the address
+
+Each write appends a new gzip member to the segment, so segments never need to be rewritten (except when rolling
+back a reorg, or compacting) and a block range can be read by decompressing only the members that overlap it. The
+coverage of a range is appended only after its logs are written, so an interrupted write is fetched again instead
+of leaving a hole. A segment without an index (archived before the indexes were added, or interrupted while being
+rewritten) is read as a single member.
+
+The archive can be shared by several processes (e.g. the rewarder and a backfill): the files of an address are
+only read under a shared lock and written under an exclusive lock, and the coverage and indexes are read again
+whenever the files change. Once a segment is completely covered, its many small members are compacted into a few
+larger ones.
+"""
+import contextlib
+import gzip
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from eth_utils import to_int
+from hexbytes import HexBytes
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+DEFAULT_SEGMENT_BLOCKS = 100_000
+COMPACTED_MEMBERS_PER_SEGMENT = 100  # i.e. 1000 blocks per member with the default segment size
+COVERAGE_FILE_NAME = 'coverage.jsonl'
+LOCK_FILE_NAME = '.lock'
+SEGMENT_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.index.jsonl'
+
+Range = Tuple[int, int]  # inclusive
+IndexEntry = Tuple[int, int, int, int]  # first block, last block, offset, length
+
+
+class LogArchive:
+    def __init__(self, directory: str, *, segment_blocks: int = DEFAULT_SEGMENT_BLOCKS):
+        self.directory = directory
+        self.segment_blocks = segment_blocks
+        self.compacted_member_blocks = max(segment_blocks // COMPACTED_MEMBERS_PER_SEGMENT, 1)
+        # Parsed coverage and index files by path, with the stat of the file when it was parsed
+        self._parsed_files: Dict[str, Tuple[tuple, Any]] = {}
+        # Only used if flock is not available, in which case other processes are not locked out
+        self._thread_lock = threading.RLock()
+
+    def get_missing_ranges(self, *, address: str, from_block: int, to_block: int) -> List[Range]:
+        """
+        Get the parts of the block range that are not archived for the address
+        """
+        ret = []
+        next_block = from_block
+        with self._locked(address, exclusive=False):
+            _num_lines, coverage = self._read_coverage(address)
+        for (covered_from, covered_to) in coverage:
+            if covered_to < next_block:
+                continue
+            if covered_from > to_block:
+                break
+            if covered_from > next_block:
+                ret.append((next_block, covered_from - 1))
+            next_block = covered_to + 1
+            if next_block > to_block:
+                break
+        if next_block <= to_block:
+            ret.append((next_block, to_block))
+        return ret
+
+    def is_covered(self, *, address: str, from_block: int, to_block: int) -> bool:
+        return not self.get_missing_ranges(address=address, from_block=from_block, to_block=to_block)
+
+    def add_logs(self, *, address: str, from_block: int, to_block: int, logs: Iterable[Dict[str, Any]]):
+        """
+        Archive all logs of the address in the block range. The logs can be either raw JSON-RPC logs
+        or logs returned by web3
+        """
+        address = address.lower()
+        records_by_segment: Dict[int, List[list]] = {}
+        for log in logs:
+            record = _to_record(log)
+            if not from_block <= record[0] <= to_block:
+                raise ValueError(f'log in block {record[0]} is not in range {from_block}-{to_block}')
+            records_by_segment.setdefault(self._get_segment_start(record[0]), []).append(record)
+
+        with self._locked(address, exclusive=True):
+            for (segment_start, records) in records_by_segment.items():
+                self._append_member(address, segment_start, records)
+            num_lines, coverage = self._read_coverage(address)
+            coverage = _merge_ranges(coverage + [(from_block, to_block)])
+            if num_lines + 1 > 2 * len(coverage) + 100:
+                self._write_coverage(address, coverage)
+            else:
+                with open(self._get_coverage_path(address), 'a') as f:
+                    f.write(json.dumps([from_block, to_block]))
+                    f.write('\n')
+
+            segment_start = self._get_segment_start(from_block)
+            while segment_start <= to_block:
+                segment_end = segment_start + self.segment_blocks - 1
+                if _is_range_covered(coverage, segment_start, segment_end):
+                    self._compact_segment(address, segment_start)
+                segment_start += self.segment_blocks
+
+    def iter_logs(self, *, address: str, from_block: int, to_block: int) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the archived logs of the address in the block range as raw JSON-RPC logs, ordered by block and
+        log index. Only complete for the ranges that are covered.
+        """
+        address = address.lower()
+        segment_start = self._get_segment_start(from_block)
+        while segment_start <= to_block:
+            # Only reading the compressed members is locked, so that a member that is being appended is not read
+            with self._locked(address, exclusive=False):
+                members = self._read_members(address, segment_start, from_block=from_block, to_block=to_block)
+            records = {}
+            for member in members:
+                for record in _decompress_records(member):
+                    if from_block <= record[0] <= to_block:
+                        # The same range can be written twice if a write was interrupted
+                        records[(record[0], record[4])] = record
+            for key in sorted(records):
+                yield _from_record(address, records[key])
+            segment_start += self.segment_blocks
+
+    def get_logs(self, *, address: str, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        return list(self.iter_logs(address=address, from_block=from_block, to_block=to_block))
+
+    def truncate(self, from_block: int):
+        """
+        Remove the logs and coverage of all addresses from from_block onwards, e.g. after a reorg
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for address in os.listdir(self.directory):
+            address_directory = self._get_address_directory(address)
+            if not os.path.isdir(address_directory):
+                continue
+            with self._locked(address, exclusive=True):
+                _num_lines, coverage = self._read_coverage(address)
+                self._write_coverage(address, [
+                    (covered_from, min(covered_to, from_block - 1))
+                    for (covered_from, covered_to) in coverage
+                    if covered_from < from_block
+                ])
+                for file_name in os.listdir(address_directory):
+                    if not file_name.endswith(SEGMENT_SUFFIX):
+                        continue
+                    segment_start = int(file_name[:-len(SEGMENT_SUFFIX)])
+                    if segment_start + self.segment_blocks <= from_block:
+                        continue
+                    records = [
+                        record
+                        for member in self._read_members(address, segment_start)
+                        for record in _decompress_records(member)
+                        if record[0] < from_block
+                    ]
+                    self._rewrite_segment(address, segment_start, records)
+        logger.info('Truncated log archive from block %s', from_block)
+
+    @contextlib.contextmanager
+    def _locked(self, address: str, *, exclusive: bool) -> Iterator[None]:
+        """
+        Lock the files of the address against other threads and processes. Each lock opens the lock file again,
+        as flock locks of different open files exclude each other also within a process
+        """
+        address_directory = self._get_address_directory(address)
+        if exclusive:
+            os.makedirs(address_directory, exist_ok=True)
+        elif not os.path.isdir(address_directory):
+            # Nothing archived yet
+            yield
+            return
+        if fcntl is None:
+            with self._thread_lock:
+                yield
+            return
+        with open(os.path.join(address_directory, LOCK_FILE_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_coverage(self, address: str) -> Tuple[int, List[Range]]:
+        """
+        Get the number of lines in the coverage file and the merged coverage. Must be called with the address locked
+        """
+        def parse(f) -> Tuple[int, List[Range]]:
+            ranges = [tuple(json.loads(line)) for line in f if line.strip()]
+            return len(ranges), _merge_ranges(ranges)
+        return self._read_parsed_file(self._get_coverage_path(address), parse, default=(0, []))
+
+    def _write_coverage(self, address: str, coverage: List[Range]):
+        path = self._get_coverage_path(address)
+        with open(path + '.tmp', 'w') as f:
+            for covered_range in coverage:
+                f.write(json.dumps(list(covered_range)))
+                f.write('\n')
+        os.replace(path + '.tmp', path)
+
+    def _read_index(self, address: str, segment_start: int) -> List[IndexEntry]:
+        """
+        Get the index of the members of a segment. Must be called with the address locked
+        """
+        segment_path = self._get_segment_path(address, segment_start)
+        if not os.path.exists(segment_path):
+            return []
+        index_path = self._get_index_path(address, segment_start)
+        if not os.path.exists(index_path):
+            return [self._get_unindexed_entry(segment_start, os.path.getsize(segment_path))]
+
+        def parse(f) -> List[IndexEntry]:
+            return [tuple(json.loads(line)) for line in f if line.strip()]
+        return self._read_parsed_file(index_path, parse, default=[])
+
+    def _read_members(
+        self,
+        address: str,
+        segment_start: int,
+        *,
+        from_block: int = 0,
+        to_block: int = 2**63,
+    ) -> List[bytes]:
+        """
+        Read the compressed members of the segment that have logs in the block range. Must be called with the
+        address locked
+        """
+        entries = [
+            entry for entry in self._read_index(address, segment_start)
+            if entry[0] <= to_block and entry[1] >= from_block
+        ]
+        if not entries:
+            return []
+        ret = []
+        with open(self._get_segment_path(address, segment_start), 'rb') as f:
+            for (_first_block, _last_block, offset, length) in entries:
+                f.seek(offset)
+                ret.append(f.read(length))
+        return ret
+
+    def _append_member(self, address: str, segment_start: int, records: List[list]):
+        segment_path = self._get_segment_path(address, segment_start)
+        index_path = self._get_index_path(address, segment_start)
+        if os.path.exists(segment_path) and not os.path.exists(index_path):
+            self._write_index(index_path, [self._get_unindexed_entry(segment_start, os.path.getsize(segment_path))])
+        data = _compress_records(records)
+        with open(segment_path, 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+        block_numbers = [record[0] for record in records]
+        with open(index_path, 'a') as f:
+            f.write(json.dumps([min(block_numbers), max(block_numbers), offset, len(data)]))
+            f.write('\n')
+
+    def _compact_segment(self, address: str, segment_start: int):
+        """
+        Rewrite a segment that has more members than a compacted one. Must be called with the address locked
+        exclusively
+        """
+        if len(self._read_index(address, segment_start)) <= COMPACTED_MEMBERS_PER_SEGMENT:
+            return
+        records = {}
+        for member in self._read_members(address, segment_start):
+            for record in _decompress_records(member):
+                records[(record[0], record[4])] = record
+        self._rewrite_segment(address, segment_start, list(records.values()))
+        logger.info('Compacted log archive segment %s of %s', segment_start, address)
+
+    def _rewrite_segment(self, address: str, segment_start: int, records: List[list]):
+        """
+        Replace the segment with the records, in members of compacted_member_blocks blocks. Must be called with
+        the address locked exclusively
+        """
+        segment_path = self._get_segment_path(address, segment_start)
+        index_path = self._get_index_path(address, segment_start)
+        records_by_member: Dict[int, List[list]] = {}
+        for record in sorted(records, key=lambda r: (r[0], r[4])):
+            records_by_member.setdefault(record[0] // self.compacted_member_blocks, []).append(record)
+        entries = []
+        if records_by_member:
+            with open(segment_path + '.tmp', 'wb') as f:
+                for member_records in records_by_member.values():
+                    data = _compress_records(member_records)
+                    entries.append((member_records[0][0], member_records[-1][0], f.tell(), len(data)))
+                    f.write(data)
+            self._write_index(index_path + '.tmp', entries)
+        # Without the index, the segment is read as a single member, which is correct for both the old and the new
+        # segment if this is interrupted
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        if entries:
+            os.replace(segment_path + '.tmp', segment_path)
+            os.replace(index_path + '.tmp', index_path)
+        elif os.path.exists(segment_path):
+            os.remove(segment_path)
+
+    def _write_index(self, path: str, entries: List[IndexEntry]):
+        with open(path, 'w') as f:
+            for entry in entries:
+                f.write(json.dumps(list(entry)))
+                f.write('\n')
+
+    def _get_unindexed_entry(self, segment_start: int, size: int) -> IndexEntry:
+        return segment_start, segment_start + self.segment_blocks - 1, 0, size
+
+    def _read_parsed_file(self, path: str, parse, *, default: Any) -> Any:
+        """
+        Parse the file, or get it parsed from the last time if it hasn't changed since
+        """
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return default
+        stat_key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        parsed = self._parsed_files.get(path)
+        if parsed is None or parsed[0] != stat_key:
+            with open(path) as f:
+                parsed = (stat_key, parse(f))
+            self._parsed_files[path] = parsed
+        return parsed[1]
+
+    def _get_segment_start(self, block_number: int) -> int:
+        return block_number - block_number % self.segment_blocks
+
+    def _get_address_directory(self, address: str) -> str:
+        return os.path.join(self.directory, address.lower())
+
+    def _get_coverage_path(self, address: str) -> str:
+        return os.path.join(self._get_address_directory(address), COVERAGE_FILE_NAME)
+
+    def _get_segment_path(self, address: str, segment_start: int) -> str:
+        return os.path.join(self._get_address_directory(address), f'{segment_start:012d}{SEGMENT_SUFFIX}')
+
+    def _get_index_path(self, address: str, segment_start: int) -> str:
+        return os.path.join(self._get_address_directory(address), f'{segment_start:012d}{INDEX_SUFFIX}')
+
+
+def _merge_ranges(ranges: List[Range]) -> List[Range]:
+    ret = []
+    for (from_block, to_block) in sorted(ranges):
+        if ret and from_block <= ret[-1][1] + 1:
+            ret[-1] = (ret[-1][0], max(ret[-1][1], to_block))
+        else:
+            ret.append((from_block, to_block))
+    return ret
+
+
+def _is_range_covered(coverage: List[Range], from_block: int, to_block: int) -> bool:
+    return any(covered_from <= from_block and to_block <= covered_to for (covered_from, covered_to) in coverage)
+
+
+def _compress_records(records: List[list]) -> bytes:
+    return gzip.compress(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in records).encode())
+
+
+def _decompress_records(data: bytes) -> Iterator[list]:
+    # Decompresses all members if given several, e.g. a segment without an index
+    for line in gzip.decompress(data).decode().splitlines():
+        if line:
+            yield json.loads(line)
+
+
+def _hex(value) -> str:
+    return HexBytes(value).hex()
+
+
+def _to_record(log: Dict[str, Any]) -> list:
+    # The address is implied by the directory, and "removed" logs are never archived
+    return [
+        to_int(hexstr=log['blockNumber']) if isinstance(log['blockNumber'], str) else log['blockNumber'],
+        _hex(log['blockHash']),
+        _hex(log['transactionHash']),
+        to_int(hexstr=log['transactionIndex']) if isinstance(log['transactionIndex'], str) else log['transactionIndex'],
+        to_int(hexstr=log['logIndex']) if isinstance(log['logIndex'], str) else log['logIndex'],
+        [_hex(topic) for topic in log['topics']],
+        _hex(log['data']),
+    ]
+
+
+def _from_record(address: str, record: list) -> Dict[str, Any]:
+    block_number, block_hash, transaction_hash, transaction_index, log_index, topics, data = record
+    return {
+        'address': address,
+        'blockNumber': hex(block_number),
+        'blockHash': block_hash,
+        'transactionHash': transaction_hash,
+        'transactionIndex': hex(transaction_index),
+        'logIndex': hex(log_index),
+        'topics': topics,
+        'data': data,
+        'removed': False,
+    }
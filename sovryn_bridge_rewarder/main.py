@@ -1,28 +1,57 @@
+import contextlib
 import logging
-from time import sleep
-from typing import Dict, Optional, Union
+from time import perf_counter, sleep
+from typing import Dict, Optional, Type, Union
 
-import sqlalchemy
 from eth_typing import AnyAddress
+from eth_utils import from_wei
+from sqlalchemy import func
 from sqlalchemy.orm import Session, sessionmaker
 from web3 import Web3
-from web3.contract import Contract
+from web3.contract import Contract, ContractEvent
 
 from .config import Config
-from .deposits import get_deposits
-from .models import Base, BlockInfo
-from .rewards import queue_reward, confirm_unconfirmed_rewards, send_queued_rewards
-from .utils import address, load_abi
+from .database import init_sqlalchemy
+from .deposits import get_deposits, get_deposits_from_logs
+from .health import HealthMonitor, HealthThresholds, start_health_server
+from .log_archive import LogArchive
+from .metrics import BLOCK_LAG, LAST_PROCESSED_BLOCK, REWARDER_BALANCE, REWARDS, start_metrics_server
+from .models import BlockInfo, Reward, RewarderStatus, RewardStatus
+from .profiling import RoundProfiler
+from .reorgs import record_scanned_window, rollback_reorganized_windows
+from .rpc import RPCStats, init_web3
+from .rewards import queue_rewards, confirm_unconfirmed_rewards, send_queued_rewards
+from .scheduling import RoundScheduler
+from .subscriptions import LogSubscription
+from .tracing import deposit_ids, span, trace_round
+from .utils import address, get_event_topic, load_abi, utcnow
 
 logger = logging.getLogger(__name__)
 BRIDGE_ABI = load_abi('Bridge.json')
+UNFINISHED_REWARD_STATUSES = (RewardStatus.queued, RewardStatus.sending, RewardStatus.sent)
 
 
-def run_rewarder(config: Config):
+def run_rewarder(config: Config, *, profiler: Optional[RoundProfiler] = None):
     logger.info('Starting rewarder')
-    DBSession = init_sqlalchemy(config.db_url, create_models=True)
+    if config.monitoring.get('port'):
+        start_metrics_server(
+            host=config.monitoring.get('host', '0.0.0.0'),
+            port=config.monitoring['port'],
+        )
+    rpc_stats = RPCStats()
+    health_monitor = HealthMonitor(
+        thresholds=HealthThresholds.from_monitoring_config(config.monitoring),
+        rpc_stats=rpc_stats,
+    )
+    if config.monitoring.get('healthPort'):
+        start_health_server(
+            health_monitor,
+            host=config.monitoring.get('healthHost', '0.0.0.0'),
+            port=config.monitoring['healthPort'],
+        )
+    DBSession = init_sqlalchemy(config.db_url, create_models=True, profile=config.db_profile)
 
-    web3 = Web3(Web3.HTTPProvider(config.rpc_url))
+    web3 = init_web3(config.rpc_url, stats=rpc_stats)
     logger.info('Connected to chain %s, rpc url: %s', web3.eth.chain_id, config.rpc_url)
     gas_price = web3.eth.gas_price
     logger.info('Gas price: %s (%s GWei)', gas_price, gas_price * 10**9 / 10**18)
@@ -46,34 +75,113 @@ def run_rewarder(config: Config):
         from_account=config.account,
     )
 
+    archive = None
+    if config.log_archive_dir:
+        logger.info('Archiving logs in %s', config.log_archive_dir)
+        archive = LogArchive(config.log_archive_dir)
+
+    subscription = None
+    if config.ws_url:
+        subscription = LogSubscription(
+            ws_url=config.ws_url,
+            addresses=list(config.bridge_addresses.values()),
+            topics=[get_event_topic(get_bridge_contract_event(web3))],
+        )
+        subscription.start()
+
     with DBSession.begin() as dbsession:
         start_block = get_start_block(dbsession, config.default_start_block)
-    while True:
-        try:
-            logger.info('Starting rewarder round')
-            new_start_block = process_new_deposits(
-                web3=web3,
-                bridge_contracts=bridge_contracts,
-                DBSession=DBSession,
-                config=config,
-                start_block=start_block,
-            )
-            if new_start_block:
-                start_block = new_start_block
+    scheduler = RoundScheduler(
+        max_sleep_seconds=config.sleep_seconds,
+        min_sleep_seconds=config.min_sleep_seconds,
+        backlog_threshold=config.backlog_threshold_blocks,
+        max_error_sleep_seconds=config.error_sleep_seconds,
+    )
+    try:
+        while True:
+            try:
+                logger.info('Starting rewarder round')
+                round_profile = profiler.profile_round() if profiler else contextlib.nullcontext()
+                with round_profile, trace_round(start_block=start_block) as round_span:
+                    round_start = perf_counter()
+                    # The head is updated by the subscription thread, so it's only read once
+                    subscription_head = subscription.head if subscription and subscription.connected else None
+                    if subscription_head is not None:
+                        current_block = subscription_head
+                    else:
+                        current_block = web3.eth.get_block_number()
+                    scheduler.observe_head(current_block)
+                    round_span.set_data('current_block', current_block)
+                    with DBSession.begin() as dbsession:
+                        last_valid_block = rollback_reorganized_windows(web3=web3, dbsession=dbsession)
+                        if last_valid_block is not None:
+                            update_last_processed_block(dbsession, last_valid_block)
+                            start_block = last_valid_block + 1
+                            if archive:
+                                archive.truncate(start_block)
+                    new_start_block = process_new_deposits(
+                        web3=web3,
+                        bridge_contracts=bridge_contracts,
+                        DBSession=DBSession,
+                        config=config,
+                        start_block=start_block,
+                        current_block=current_block,
+                        subscription=subscription,
+                        archive=archive,
+                    )
+                    if new_start_block:
+                        start_block = new_start_block
 
-            send_queued_rewards(
-                web3=web3,
-                DBSession=DBSession,
-                from_account=config.account,
-            )
-            logger.info('Round complete, sleeping %s s', config.sleep_seconds)
-            sleep(config.sleep_seconds)
-        except KeyboardInterrupt:
-            logger.info('Quitting.')
-            break
-        except Exception:
-            logger.exception('Error running rewarder, sleeping a bit and trying again.')
-            sleep(60)
+                    send_queued_rewards(
+                        web3=web3,
+                        DBSession=DBSession,
+                        from_account=config.account,
+                    )
+
+                    backlog = get_backlog(
+                        current_block=current_block,
+                        required_block_confirmations=config.required_block_confirmations,
+                        start_block=start_block,
+                    )
+                    round_span.set_data('backlog', backlog)
+                    reward_counts = update_metrics(
+                        web3=web3,
+                        DBSession=DBSession,
+                        config=config,
+                        backlog=backlog,
+                        current_block=current_block,
+                        last_processed_block=start_block - 1,
+                        round_seconds=perf_counter() - round_start,
+                    )
+                    health_monitor.round_succeeded(
+                        current_block=current_block,
+                        backlog=backlog,
+                        reward_counts=reward_counts,
+                    )
+                    rpc_stats.log_round_summary()
+                sleep_seconds = scheduler.get_sleep_seconds(backlog=backlog)
+                if not sleep_seconds:
+                    logger.info('Round complete, %s blocks left to process -- starting next round', backlog)
+                elif subscription and subscription.connected:
+                    logger.info('Round complete, waiting for new blocks for up to %.1f s', sleep_seconds)
+                    subscription.wait_for_block(
+                        start_block + config.required_block_confirmations,
+                        timeout=sleep_seconds,
+                    )
+                else:
+                    logger.info('Round complete, sleeping %.1f s', sleep_seconds)
+                    sleep(sleep_seconds)
+            except KeyboardInterrupt:
+                logger.info('Quitting.')
+                break
+            except Exception as e:
+                health_monitor.round_failed(e)
+                sleep_seconds = scheduler.get_error_sleep_seconds()
+                logger.exception('Error running rewarder, sleeping %s s and trying again.', sleep_seconds)
+                sleep(sleep_seconds)
+    finally:
+        if subscription:
+            subscription.stop()
 
 
 def process_new_deposits(
@@ -83,41 +191,145 @@ def process_new_deposits(
     DBSession: sessionmaker,
     config: Config,
     start_block: int,
+    current_block: Optional[int] = None,
+    subscription: Optional[LogSubscription] = None,
+    archive: Optional[LogArchive] = None,
 ) -> Optional[int]:
-    current_block = web3.eth.get_block_number()
-    to_block = current_block - config.required_block_confirmations
+    if current_block is None:
+        current_block = web3.eth.get_block_number()
+    to_block = min(
+        current_block - config.required_block_confirmations,
+        start_block + config.max_blocks_per_round - 1,
+    )
     logger.info('Processing new deposits from %s to %s', start_block, to_block)
 
     if to_block < start_block:
         logger.info('to_block %s is smaller than start_block %s, not doing anything', to_block, start_block)
         return None
 
+    # Fetched before the logs, so that a reorg happening in between will be detected on the next round
+    to_block_hash = web3.eth.get_block(to_block).hash.hex()
+
+    # Use the logs pushed through the subscription if it covers the whole range, else poll with eth_getLogs
+    raw_logs = subscription.get_logs(from_block=start_block, to_block=to_block) if subscription else None
+
     deposits = []
     for bridge_key, bridge_contract in bridge_contracts.items():
-        logger.info("Getting deposits for %s", bridge_key)
-        bridge_deposits = get_deposits(
-            bridge_contract=bridge_contract,
-            web3=web3,
+        with span(
+            'deposits.fetch_window',
+            bridge=bridge_key,
             from_block=start_block,
             to_block=to_block,
-            fee_percentage=config.deposit_fee_percentage,
-        )
-        logger.info("Found %s deposits for %s", len(bridge_deposits), bridge_key)
+            source='subscription' if raw_logs is not None else 'rpc',
+        ) as fetch_span:
+            logger.info("Getting deposits for %s", bridge_key)
+            if raw_logs is not None:
+                if archive:
+                    archive.add_logs(
+                        address=bridge_contract.address,
+                        from_block=start_block,
+                        to_block=to_block,
+                        logs=[log for log in raw_logs if log['address'].lower() == bridge_contract.address.lower()],
+                    )
+                bridge_deposits = get_deposits_from_logs(
+                    bridge_contract=bridge_contract,
+                    web3=web3,
+                    raw_logs=raw_logs,
+                    fee_percentage=config.deposit_fee_percentage,
+                )
+            else:
+                bridge_deposits = get_deposits(
+                    bridge_contract=bridge_contract,
+                    web3=web3,
+                    from_block=start_block,
+                    to_block=to_block,
+                    fee_percentage=config.deposit_fee_percentage,
+                    archive=archive,
+                )
+            logger.info("Found %s deposits for %s", len(bridge_deposits), bridge_key)
+            fetch_span.set_data('deposit_ids', deposit_ids(bridge_deposits))
         deposits.extend(bridge_deposits)
 
     with DBSession.begin() as dbsession:
-        for deposit in deposits:
-            queue_reward(
-                deposit=deposit,
-                dbsession=dbsession,
-                web3=web3,
-                reward_amount_rbtc=config.reward_rbtc,
-                deposit_thresholds=config.reward_thresholds,
+        queue_rewards(
+            deposits=deposits,
+            dbsession=dbsession,
+            web3=web3,
+            reward_amount_rbtc=config.reward_rbtc,
+            deposit_thresholds=config.reward_thresholds,
+        )
+        # A backfill can have moved the last processed block since the round started. It's not moved back, but
+        # the rewarder continues from there
+        checkpoint_start_block = get_start_block(dbsession, config.default_start_block, for_update=True)
+        if checkpoint_start_block != start_block:
+            logger.warning(
+                'Last processed block was moved to %s by another process, continuing from there',
+                checkpoint_start_block - 1,
             )
+            return checkpoint_start_block
         last_processed_block = to_block
         update_last_processed_block(dbsession, last_processed_block)
+        record_scanned_window(
+            dbsession,
+            from_block=start_block,
+            to_block=to_block,
+            to_block_hash=to_block_hash,
+        )
         start_block = last_processed_block + 1
-        return start_block
+
+    if subscription:
+        subscription.discard_logs(up_to_block=last_processed_block)
+    return start_block
+
+
+def get_backlog(*, current_block: int, required_block_confirmations: int, start_block: int) -> int:
+    """
+    Get the number of confirmed blocks that are not yet processed
+    """
+    return max(current_block - required_block_confirmations - start_block + 1, 0)
+
+
+def update_metrics(
+    *,
+    web3: Web3,
+    DBSession: sessionmaker,
+    config: Config,
+    backlog: int,
+    current_block: int,
+    last_processed_block: int,
+    round_seconds: float,
+) -> Dict[RewardStatus, int]:
+    """
+    Update the Prometheus metrics and the RewarderStatus snapshot at the end of a round. Returns the number of
+    unfinished rewards by status
+    """
+    balance_wei = web3.eth.get_balance(address(config.account.address))
+    gas_price_wei = web3.eth.gas_price
+    BLOCK_LAG.set(backlog)
+    LAST_PROCESSED_BLOCK.set(last_processed_block)
+    REWARDER_BALANCE.set(from_wei(balance_wei, 'ether'))
+    with DBSession.begin() as dbsession:
+        counts = dict(
+            dbsession.query(Reward.status, func.count(Reward.id)).filter(
+                Reward.status.in_(UNFINISHED_REWARD_STATUSES)
+            ).group_by(Reward.status)
+        )
+        dbsession.merge(RewarderStatus(
+            account_address=config.account.address.lower(),
+            rbtc_balance_wei=balance_wei,
+            gas_price_wei=gas_price_wei,
+            head_block=current_block,
+            last_processed_block=last_processed_block,
+            backlog_blocks=backlog,
+            queued_rewards=counts.get(RewardStatus.queued, 0),
+            sending_rewards=counts.get(RewardStatus.sending, 0),
+            sent_rewards=counts.get(RewardStatus.sent, 0),
+            round_seconds=round_seconds,
+            updated_at=utcnow(),
+        ))
+    for status in UNFINISHED_REWARD_STATUSES:
+        REWARDS.labels(status=status.value).set(counts.get(status, 0))
+    return counts
 
 
 def get_bridge_contract(*, bridge_address: Union[str, AnyAddress], web3: Web3) -> Contract:
@@ -127,8 +339,22 @@ def get_bridge_contract(*, bridge_address: Union[str, AnyAddress], web3: Web3) -
     )
 
 
-def get_start_block(dbsession: Session, default: int) -> int:
-    last_processed_block = dbsession.query(BlockInfo.block_number).filter_by(key='last_processed_block').scalar()
+def get_bridge_contract_event(web3: Web3) -> Type[ContractEvent]:
+    """
+    Get the AcceptedCrossTransfer event, not bound to any bridge address
+    """
+    return web3.eth.contract(abi=BRIDGE_ABI).events.AcceptedCrossTransfer
+
+
+def get_start_block(dbsession: Session, default: int, *, for_update: bool = False) -> int:
+    """
+    Get the next block to process. With for_update, the row is locked until the end of the transaction (in
+    PostgreSQL -- SQLite has a single writer), so that it can be updated based on its value
+    """
+    query = dbsession.query(BlockInfo.block_number).filter_by(key='last_processed_block')
+    if for_update:
+        query = query.with_for_update()
+    last_processed_block = query.scalar()
     if not last_processed_block:
         return default
     else:
@@ -145,15 +371,3 @@ def update_last_processed_block(dbsession: Session, block_number: int):
             block_number=block_number,
         )
         dbsession.add(block_info)
-
-
-def init_sqlalchemy(db_url: str, *, create_models: bool = True) -> sessionmaker:
-    logger.info('Connecting to database %s', db_url)
-    engine = sqlalchemy.create_engine(db_url, echo=False)
-    Session = sessionmaker(bind=engine)
-    if create_models:
-        try:
-            Base.metadata.create_all(engine)
-        except Exception:
-            pass
-    return Session
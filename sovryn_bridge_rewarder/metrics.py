@@ -0,0 +1,70 @@
+"""
+Prometheus metrics for the rewarder pipeline
+"""
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+STAGE_SECONDS = Histogram(
+    'rewarder_stage_seconds',
+    'Time spent in each stage of the reward pipeline',
+    ['stage'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+BLOCK_LAG = Gauge(
+    'rewarder_block_lag',
+    'Number of confirmed blocks not yet processed',
+)
+LAST_PROCESSED_BLOCK = Gauge(
+    'rewarder_last_processed_block',
+    'Last block processed by the rewarder',
+)
+REWARDS = Gauge(
+    'rewarder_rewards',
+    'Number of rewards in an unfinished status',
+    ['status'],
+)
+REWARDER_BALANCE = Gauge(
+    'rewarder_balance_rbtc',
+    'RBTC balance of the rewarder account',
+)
+RPC_ERRORS = Counter(
+    'rewarder_rpc_errors_total',
+    'Errors raised by retryable calls (mostly RPC calls)',
+    ['function'],
+)
+RETRIES = Counter(
+    'rewarder_retries_total',
+    'Retries of retryable calls',
+    ['function'],
+)
+RPC_SECONDS = Histogram(
+    'rewarder_rpc_seconds',
+    'Latency of JSON-RPC calls by method',
+    ['method'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+RPC_PAYLOAD_BYTES = Counter(
+    'rewarder_rpc_payload_bytes_total',
+    'Size of the HTTP bodies of JSON-RPC requests and responses by method',
+    ['method', 'direction'],
+)
+RPC_CALL_ERRORS = Counter(
+    'rewarder_rpc_call_errors_total',
+    'JSON-RPC calls that raised or returned an error, by method',
+    ['method'],
+)
+
+
+def time_stage(stage: str):
+    """
+    Decorator/context manager that observes the time spent in a pipeline stage
+    """
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+
+def start_metrics_server(*, host: str = '0.0.0.0', port: int):
+    logger.info('Serving metrics at http://%s:%s/metrics', host, port)
+    start_http_server(port, addr=host)
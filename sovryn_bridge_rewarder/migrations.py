@@ -0,0 +1,229 @@
+"""
+Versioned schema migrations
+
+The applied versions are stored in the schema_version table. A new database is created with the current models
+and stamped with the latest version. A database created before versioning is considered to be at version 1.
+
+Migrations only need to change existing tables -- tables that are missing are created from the models after
+migrating.
+"""
+from dataclasses import dataclass
+import logging
+from typing import Callable, List
+
+from sqlalchemy import Column, DateTime, Enum, Index, Integer, MetaData, Table, Text, func, inspect, select, text
+from sqlalchemy.engine import Connection, Engine
+
+from .models import Base, RewardStatistic, RewardStatus, SchemaVersion, WeiAmount
+from .statistics import rebuild_reward_statistics
+
+logger = logging.getLogger(__name__)
+COPY_BATCH_SIZE = 1000
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    upgrade: Callable[[Connection], None]
+
+
+def _migrate_v2(connection: Connection):
+    """
+    Reward amounts as numbers, status as an enum, and indexes for the queries by status and creation time.
+    The reward table is rebuilt, as SQLite cannot alter column types.
+    """
+    old_reward = Table('reward', MetaData(), autoload_with=connection)
+    unknown_statuses = connection.execute(
+        select(old_reward.c.status).distinct().where(old_reward.c.status.notin_([s.value for s in RewardStatus]))
+    ).scalars().all()
+    if unknown_statuses:
+        raise ValueError(f'cannot migrate rewards with unknown statuses: {unknown_statuses}')
+
+    for index in old_reward.indexes:
+        index.drop(connection)
+    connection.execute(text('ALTER TABLE reward RENAME TO reward_v1'))
+    old_reward = Table('reward_v1', MetaData(), autoload_with=connection)
+    new_reward = _get_reward_table_v2(MetaData())
+    new_reward.create(connection)
+
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(old_reward).where(old_reward.c.id > last_id).order_by(old_reward.c.id).limit(COPY_BATCH_SIZE)
+        ).mappings().all()
+        if not rows:
+            break
+        connection.execute(new_reward.insert(), [
+            dict(
+                row,
+                status=RewardStatus(row['status']),
+                reward_rbtc_wei=int(row['reward_rbtc_wei']),
+                deposit_amount_minus_fees_wei=int(row['deposit_amount_minus_fees_wei']),
+            )
+            for row in rows
+        ])
+        last_id = rows[-1]['id']
+    old_reward.drop(connection)
+    if connection.dialect.name == 'postgresql':
+        # The ids were inserted explicitly, so the sequence has to be moved past them
+        connection.exec_driver_sql(
+            "SELECT setval(pg_get_serial_sequence('reward', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM reward"
+        )
+
+
+def _get_reward_table_v2(metadata: MetaData) -> Table:
+    return Table(
+        'reward',
+        metadata,
+        Column('id', Integer, primary_key=True),
+        Column(
+            'status',
+            Enum(RewardStatus, name='reward_status', native_enum=False, length=32, validate_strings=True),
+            nullable=False,
+        ),
+        Column('reward_rbtc_wei', WeiAmount, nullable=False),
+        Column('user_address', Text, nullable=False, index=True),
+        Column('deposit_side_token_address', Text, nullable=False),
+        Column('deposit_side_token_symbol', Text, nullable=False),
+        Column('deposit_main_token_address', Text, nullable=False),
+        Column('deposit_amount_minus_fees_wei', WeiAmount, nullable=False),
+        Column('deposit_log_index', Integer, nullable=False),
+        Column('deposit_block_hash', Text, nullable=False),
+        Column('deposit_transaction_hash', Text, nullable=False, index=True),
+        Column('deposit_contract_address', Text, nullable=False),
+        Column('reward_transaction_hash', Text, nullable=True),
+        Column('reward_transaction_nonce', Integer, nullable=True),
+        Column('created_at', DateTime(timezone=True), nullable=False),
+        Column('sent_at', DateTime(timezone=True), nullable=True),
+        Index('ix_reward_status_id', 'status', 'id'),
+        Index('ix_reward_created_at', 'created_at'),
+    )
+
+
+def _migrate_v3(connection: Connection):
+    """
+    Unique index on the deposit of each (non-orphaned) reward
+    """
+    duplicates = connection.execute(text(
+        "SELECT deposit_transaction_hash, deposit_log_index, deposit_contract_address, COUNT(*) FROM reward "
+        "WHERE status != 'orphaned' "
+        "GROUP BY deposit_transaction_hash, deposit_log_index, deposit_contract_address HAVING COUNT(*) > 1"
+    )).all()
+    if duplicates:
+        raise ValueError(f'cannot migrate: multiple rewards for the same deposits: {duplicates}')
+    reward = Table('reward', MetaData(), autoload_with=connection)
+    Index(
+        'uq_reward_deposit',
+        reward.c.deposit_transaction_hash,
+        reward.c.deposit_log_index,
+        reward.c.deposit_contract_address,
+        unique=True,
+        sqlite_where=text("status != 'orphaned'"),
+        postgresql_where=text("status != 'orphaned'"),
+    ).create(connection)
+
+
+def _migrate_v4(connection: Connection):
+    """
+    Last update time of rewards. Existing rewards get the time they were sent, or created
+    """
+    connection.execute(text('ALTER TABLE reward ADD COLUMN updated_at TIMESTAMP WITH TIME ZONE'))
+    connection.execute(text('UPDATE reward SET updated_at = COALESCE(sent_at, created_at)'))
+    reward = Table('reward', MetaData(), autoload_with=connection)
+    Index('ix_reward_updated_at', reward.c.updated_at).create(connection)
+
+
+def _migrate_v5(connection: Connection):
+    """
+    Reward statistics table, computed from the existing rewards
+    """
+    RewardStatistic.__table__.create(connection, checkfirst=True)
+    rebuild_reward_statistics(connection)
+
+
+def _migrate_v6(connection: Connection):
+    """
+    Block number of the deposit of each reward, for finding the rewards affected by a reorg. It's left empty for
+    the existing rewards, as it would have to be fetched from the node
+    """
+    connection.execute(text('ALTER TABLE reward ADD COLUMN deposit_block_number INTEGER'))
+    reward = Table('reward', MetaData(), autoload_with=connection)
+    Index('ix_reward_deposit_block_number', reward.c.deposit_block_number).create(connection)
+
+
+def _migrate_v7(connection: Connection):
+    """
+    Unique index on the user of each (non-orphaned) reward
+    """
+    duplicates = connection.execute(text(
+        "SELECT lower(user_address), COUNT(*) FROM reward WHERE status != 'orphaned' "
+        "GROUP BY lower(user_address) HAVING COUNT(*) > 1"
+    )).all()
+    if duplicates:
+        raise ValueError(f'cannot migrate: multiple rewards for the same users: {duplicates}')
+    reward = Table('reward', MetaData(), autoload_with=connection)
+    Index(
+        'uq_reward_user_address',
+        func.lower(reward.c.user_address),
+        unique=True,
+        sqlite_where=text("status != 'orphaned'"),
+        postgresql_where=text("status != 'orphaned'"),
+    ).create(connection)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(2, 'numeric amounts, enum status and indexes for reward', _migrate_v2),
+    Migration(3, 'unique deposit of reward', _migrate_v3),
+    Migration(4, 'updated_at of reward', _migrate_v4),
+    Migration(5, 'reward statistics', _migrate_v5),
+    Migration(6, 'deposit block number of reward', _migrate_v6),
+    Migration(7, 'unique user of reward', _migrate_v7),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(connection: Connection) -> int:
+    """
+    Get the version of the database schema, or 0 if the database is empty
+    """
+    table_names = inspect(connection).get_table_names()
+    if SchemaVersion.__tablename__ in table_names:
+        version = connection.execute(select(SchemaVersion.version).order_by(SchemaVersion.version.desc())).scalar()
+        if version:
+            return version
+    if 'reward' in table_names:
+        return 1
+    return 0
+
+
+def migrate(engine: Engine):
+    """
+    Bring the database schema up to date, creating it if the database is empty
+    """
+    with engine.begin() as connection:
+        version = get_schema_version(connection)
+        if version == 0:
+            logger.info('Creating database schema version %s', LATEST_VERSION)
+            Base.metadata.create_all(connection)
+            _stamp(connection, LATEST_VERSION)
+            return
+        if version == 1 and SchemaVersion.__tablename__ not in inspect(connection).get_table_names():
+            SchemaVersion.__table__.create(connection)
+            _stamp(connection, 1)
+
+    # Each migration is applied in its own transaction
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        logger.info('Migrating database to version %s: %s', migration.version, migration.description)
+        with engine.begin() as connection:
+            migration.upgrade(connection)
+            _stamp(connection, migration.version)
+
+    with engine.begin() as connection:
+        Base.metadata.create_all(connection)
+
+
+def _stamp(connection: Connection, version: int):
+    connection.execute(SchemaVersion.__table__.insert().values(version=version))
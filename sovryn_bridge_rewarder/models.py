@@ -1,11 +1,52 @@
-from sqlalchemy import Column, Text, Integer, BigInteger, DateTime, Enum, Numeric
+import enum
+
+from sqlalchemy import Column, Text, Integer, BigInteger, Date, DateTime, Enum, Float, Index, Numeric, func, text
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.types import TypeDecorator
 from .utils import utcnow
 
 
 Base = declarative_base()
 
 
+class WeiAmount(TypeDecorator):
+    """
+    Integer amount in wei (up to uint256). Numeric(78, 0) where supported, Text in SQLite, which only has 64-bit
+    integers
+    """
+    impl = Numeric(78, 0)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'sqlite':
+            return dialect.type_descriptor(Text())
+        return dialect.type_descriptor(Numeric(78, 0))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == 'sqlite':
+            return str(int(value))
+        return int(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return int(value)
+
+
+class SchemaVersion(Base):
+    """
+    Applied schema migrations, see migrations.py
+    """
+    __tablename__ = 'schema_version'
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<SchemaVersion({self.version})>'
+
+
 class BlockInfo(Base):
     __tablename__ = 'block_info'
     key = Column(Text, primary_key=True)
@@ -15,22 +56,63 @@ class BlockInfo(Base):
         return f'<LastProcessedBlock({self.block_number})>'
 
 
-class RewardStatus(Enum):
+class ScannedWindow(Base):
+    """
+    Block range processed in one round, with the hash of its last block for detecting reorgs
+    """
+    __tablename__ = 'scanned_window'
+    to_block = Column(Integer, primary_key=True)
+    from_block = Column(Integer, nullable=False)
+    to_block_hash = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return f'<ScannedWindow({self.from_block}-{self.to_block})>'
+
+
+class RewarderStatus(Base):
+    """
+    Snapshot of the state of the rewarder, written at the end of each round, so that the UI and health checks
+    can show it without RPC calls of their own
+    """
+    __tablename__ = 'rewarder_status'
+    account_address = Column(Text, primary_key=True)
+    rbtc_balance_wei = Column(WeiAmount, nullable=False)
+    gas_price_wei = Column(WeiAmount, nullable=False)
+    head_block = Column(Integer, nullable=False)
+    last_processed_block = Column(Integer, nullable=False)
+    backlog_blocks = Column(Integer, nullable=False)
+    queued_rewards = Column(Integer, nullable=False)
+    sending_rewards = Column(Integer, nullable=False)
+    sent_rewards = Column(Integer, nullable=False)
+    round_seconds = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=utcnow, onupdate=utcnow)
+
+    def __repr__(self):
+        return f'<RewarderStatus({self.account_address} at block {self.last_processed_block})>'
+
+
+class RewardStatus(str, enum.Enum):
     queued = 'queued'
     sending = 'sending'
     sent = 'sent'
     confirmed = 'confirmed'
     error_sending = 'error_sending'
     error_confirming = 'error_confirming'
+    orphaned = 'orphaned'  # the deposit was removed from the chain by a reorg before the reward was sent
 
 
 class Reward(Base):
     __tablename__ = 'reward'
 
     id = Column(Integer, primary_key=True)
-    status = Column(Text, nullable=False)  # could be enum
+    # Not a native enum, so that adding statuses doesn't need ALTER TYPE in PostgreSQL
+    status = Column(
+        Enum(RewardStatus, name='reward_status', native_enum=False, length=32, validate_strings=True),
+        nullable=False,
+    )
 
-    _reward_rbtc_wei = Column('reward_rbtc_wei', Text, nullable=False)  # Text for sqlite support...
+    reward_rbtc_wei = Column(WeiAmount, nullable=False)
 
     user_address = Column(Text, nullable=False, index=True)
 
@@ -38,8 +120,10 @@ class Reward(Base):
     deposit_side_token_address = Column(Text, nullable=False)
     deposit_side_token_symbol = Column(Text, nullable=False)
     deposit_main_token_address = Column(Text, nullable=False)
-    _deposit_amount_minus_fees_wei = Column('deposit_amount_minus_fees_wei', Text, nullable=False)  # Text for sqlite
+    deposit_amount_minus_fees_wei = Column(WeiAmount, nullable=False)
     deposit_log_index = Column(Integer, nullable=False)
+    # Used for finding the rewards affected by a reorg. Not known for rewards queued before it was added
+    deposit_block_number = Column(Integer, nullable=True, index=True)
     deposit_block_hash = Column(Text, nullable=False)
     deposit_transaction_hash = Column(Text, nullable=False, index=True)
     deposit_contract_address = Column(Text, nullable=False)
@@ -52,22 +136,56 @@ class Reward(Base):
 
     created_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
     sent_at = Column(DateTime(timezone=True), nullable=True)
+    # Changed on every ORM update, e.g. of the status. Used by the UI for detecting changes
+    updated_at = Column(DateTime(timezone=True), nullable=True, default=utcnow, onupdate=utcnow)
+
+    __table_args__ = (
+        # For the queries by status, which are ordered by id
+        Index('ix_reward_status_id', 'status', 'id'),
+        Index('ix_reward_created_at', 'created_at'),
+        Index('ix_reward_updated_at', 'updated_at'),
+        # A deposit is rewarded at most once. Orphaned rewards are excluded, as the deposit can be included again
+        # in another block after a reorg
+        Index(
+            'uq_reward_deposit',
+            'deposit_transaction_hash',
+            'deposit_log_index',
+            'deposit_contract_address',
+            unique=True,
+            sqlite_where=text("status != 'orphaned'"),
+            postgresql_where=text("status != 'orphaned'"),
+        ),
+        # A user is rewarded at most once, also if rewards are queued by several processes (e.g. a backfill
+        # alongside the rewarder)
+        Index(
+            'uq_reward_user_address',
+            func.lower(user_address),
+            unique=True,
+            sqlite_where=text("status != 'orphaned'"),
+            postgresql_where=text("status != 'orphaned'"),
+        ),
+    )
 
-    @property
-    def reward_rbtc_wei(self) -> int:
-        return int(self._reward_rbtc_wei)
-
-    @reward_rbtc_wei.setter
-    def reward_rbtc_wei(self, value: int):
-        self._reward_rbtc_wei = str(value)
+    def __repr__(self):
+        return f'<Reward(to={self.user_address})>'
 
-    @property
-    def deposit_amount_minus_fees_wei(self) -> int:
-        return int(self._deposit_amount_minus_fees_wei)
 
-    @deposit_amount_minus_fees_wei.setter
-    def deposit_amount_minus_fees_wei(self, value: int):
-        self._deposit_amount_minus_fees_wei = str(value)
+class RewardStatistic(Base):
+    """
+    Number and sums of the amounts of rewards by the day they were created, status and side token. Kept up to
+    date when rewards are added or changed (see statistics.py), so that statistics don't need to scan the reward
+    table
+    """
+    __tablename__ = 'reward_statistic'
+    day = Column(Date, primary_key=True)
+    status = Column(
+        Enum(RewardStatus, name='reward_status', native_enum=False, length=32, validate_strings=True),
+        primary_key=True,
+    )
+    deposit_side_token_symbol = Column(Text, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    reward_rbtc_wei = Column(WeiAmount, nullable=False, default=0)
+    deposit_amount_minus_fees_wei = Column(WeiAmount, nullable=False, default=0)
 
     def __repr__(self):
-        return f'<Reward(to={self.user_address})>'
+        return f'<RewardStatistic({self.day} {self.status.value} {self.deposit_side_token_symbol}: {self.count})>'
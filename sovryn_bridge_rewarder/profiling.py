@@ -0,0 +1,150 @@
+"""
+On-demand CPU and memory profiling of rewarder rounds
+
+The profiler is armed for a number of rounds, at startup (run --profile N) or by sending SIGUSR1 to the process.
+Each profiled round writes to the output directory:
+
+round-<round number>-<timestamp>.prof          cProfile stats, for `python -m pstats` or snakeviz
+round-<round number>-<timestamp>.cpu.txt       the top functions by cumulative time
+round-<round number>-<timestamp>.tracemalloc   tracemalloc snapshot at the end of the round (tracemalloc.Snapshot.load)
+round-<round number>-<timestamp>.memory.txt    the top allocation sites, and the growth during the round
+
+cProfile only profiles the thread that runs the rounds, which is where the work is done. Profiling slows the round
+down, so the timings are relative.
+"""
+import contextlib
+import cProfile
+from datetime import datetime, timezone
+import io
+import logging
+import os
+import pstats
+import signal
+import tracemalloc
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+TOP_ENTRIES = 40
+TRACEMALLOC_FRAMES = 10
+
+
+class RoundProfiler:
+    """
+    Profiles the next N rounds when armed. Rounds are counted from 1
+    """
+    def __init__(self, *, output_dir: str, memory: bool = True):
+        self.output_dir = output_dir
+        self.memory = memory
+        self.round_number = 0
+        self._rounds_left = 0
+        self._started_tracemalloc = False
+
+    def arm(self, num_rounds: int):
+        """
+        Profile the next num_rounds rounds. This only sets a counter, so it's safe to call from a signal handler
+        """
+        self._rounds_left = max(self._rounds_left, num_rounds)
+
+    @contextlib.contextmanager
+    def profile_round(self) -> Iterator[None]:
+        """
+        Profile the round run in the with block, if armed
+        """
+        self.round_number += 1
+        if self._rounds_left <= 0:
+            yield
+            return
+        self._rounds_left -= 1
+        logger.info('Profiling round %s (%s more after this)', self.round_number, self._rounds_left)
+
+        start_snapshot = None
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._started_tracemalloc = True
+            start_snapshot = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            end_snapshot = None
+            memory_report = None
+            if self.memory:
+                end_snapshot = tracemalloc.take_snapshot()
+                memory_report = format_memory_report(start_snapshot, end_snapshot)
+                if self._started_tracemalloc and not self._rounds_left:
+                    # Tracing slows everything down, so it's only kept on for consecutive profiled rounds
+                    tracemalloc.stop()
+                    self._started_tracemalloc = False
+            try:
+                self._dump(profile, end_snapshot, memory_report)
+            except Exception:
+                logger.exception('Error writing the profile of round %s', self.round_number)
+
+    def _dump(
+        self,
+        profile: cProfile.Profile,
+        end_snapshot: Optional[tracemalloc.Snapshot],
+        memory_report: Optional[str],
+    ):
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        base_path = os.path.join(self.output_dir, f'round-{self.round_number:06d}-{timestamp}')
+
+        profile.dump_stats(base_path + '.prof')
+        with open(base_path + '.cpu.txt', 'w') as f:
+            stats = pstats.Stats(profile, stream=f)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_ENTRIES)
+
+        if end_snapshot is not None:
+            end_snapshot.dump(base_path + '.tracemalloc')
+            with open(base_path + '.memory.txt', 'w') as f:
+                f.write(memory_report)
+        logger.info('Wrote the profile of round %s to %s.*', self.round_number, base_path)
+
+
+def format_memory_report(start_snapshot: tracemalloc.Snapshot, end_snapshot: tracemalloc.Snapshot) -> str:
+    """
+    Format the top allocation sites at the end of a round and the growth since its start. Must be called while
+    tracemalloc is tracing
+    """
+    # Leave out the memory used by tracemalloc itself
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    start_snapshot = start_snapshot.filter_traces(filters)
+    end_snapshot = end_snapshot.filter_traces(filters)
+    out = io.StringIO()
+    traced_current, traced_peak = tracemalloc.get_traced_memory()
+    out.write(f'Traced memory: current {traced_current / 2**20:.1f} MiB, peak {traced_peak / 2**20:.1f} MiB\n\n')
+    out.write(f'Top {TOP_ENTRIES} allocation sites at the end of the round:\n')
+    for stat in end_snapshot.statistics('lineno')[:TOP_ENTRIES]:
+        out.write(f'{stat}\n')
+    out.write(f'\nTop {TOP_ENTRIES} allocation sites by growth during the round:\n')
+    for stat in end_snapshot.compare_to(start_snapshot, 'lineno')[:TOP_ENTRIES]:
+        out.write(f'{stat}\n')
+    return out.getvalue()
+
+
+def install_signal_handler(profiler: RoundProfiler, *, num_rounds: int, signum: Optional[int] = None) -> bool:
+    """
+    Arm the profiler for num_rounds rounds when the process gets the signal (SIGUSR1 by default).
+    Returns False if the handler could not be installed
+    """
+    if signum is None:
+        signum = getattr(signal, 'SIGUSR1', None)
+        if signum is None:
+            return False
+
+    def handle_signal(received_signum, frame):
+        profiler.arm(num_rounds)
+
+    try:
+        signal.signal(signum, handle_signal)
+    except ValueError:
+        # Signal handlers can only be set in the main thread
+        logger.warning('Cannot install the profiling signal handler outside the main thread')
+        return False
+    logger.info('Send signal %s to profile the next %s rounds (pid %s)', signum, num_rounds, os.getpid())
+    return True
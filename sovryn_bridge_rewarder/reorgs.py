@@ -0,0 +1,130 @@
+"""
+Detection of chain reorganizations that affect already processed blocks, and rolling back after them
+"""
+import logging
+from typing import Dict, Optional
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from web3 import Web3
+from web3.exceptions import BlockNotFound
+
+from .models import Reward, RewardStatus, ScannedWindow
+
+logger = logging.getLogger(__name__)
+MAX_SCANNED_WINDOWS = 128  # how many windows we keep for finding the common ancestor
+
+
+def record_scanned_window(dbsession: Session, *, from_block: int, to_block: int, to_block_hash: str):
+    """
+    Record the block range processed in a round, and prune the oldest records
+    """
+    dbsession.add(ScannedWindow(
+        from_block=from_block,
+        to_block=to_block,
+        to_block_hash=to_block_hash.lower(),
+    ))
+    dbsession.flush()
+    oldest_kept = dbsession.query(ScannedWindow.to_block).order_by(
+        ScannedWindow.to_block.desc()
+    ).offset(MAX_SCANNED_WINDOWS - 1).limit(1).scalar()
+    if oldest_kept:
+        dbsession.query(ScannedWindow).filter(
+            ScannedWindow.to_block < oldest_kept
+        ).delete(synchronize_session=False)
+
+
+def get_block_hash(web3: Web3, block_number: int) -> Optional[str]:
+    """
+    Get the hash of the canonical block with the given number, or None if the chain is not that long
+    """
+    try:
+        block = web3.eth.get_block(block_number)
+    except BlockNotFound:
+        return None
+    return block.hash.hex().lower()
+
+
+def rollback_reorganized_windows(*, web3: Web3, dbsession: Session) -> Optional[int]:
+    """
+    Verify that the latest scanned window still ends in a canonical block.
+
+    If it doesn't, delete the windows that were reorganized away, mark the queued rewards for deposits in the rolled
+    back blocks that are no longer in the chain as orphaned, and return the last block that can still be considered
+    processed. Deposits that were only moved to another block will be queued again when the range is processed again.
+    Rewards that were already sent cannot be undone, and are only logged -- send_reward checks the deposit block
+    before signing to avoid that.
+
+    Returns None if there was no reorg.
+    """
+    windows = dbsession.query(ScannedWindow).order_by(ScannedWindow.to_block.desc())
+    latest_window = windows.first()
+    if not latest_window or get_block_hash(web3, latest_window.to_block) == latest_window.to_block_hash:
+        return None
+
+    logger.warning('Chain reorganization detected: block %s is no longer in the chain', latest_window.to_block_hash)
+    common_ancestor = None
+    orphaned_windows = []
+    for window in windows:
+        if get_block_hash(web3, window.to_block) == window.to_block_hash:
+            common_ancestor = window
+            break
+        orphaned_windows.append(window)
+
+    if common_ancestor:
+        last_valid_block = common_ancestor.to_block
+    else:
+        last_valid_block = orphaned_windows[-1].from_block - 1
+        logger.error(
+            'Reorg is deeper than the %s recorded windows, rolling back to block %s',
+            len(orphaned_windows),
+            last_valid_block,
+        )
+    for window in orphaned_windows:
+        dbsession.delete(window)
+
+    # Only the deposits in the rolled back blocks can have been removed from the chain
+    in_rolled_back_range = Reward.deposit_block_number > last_valid_block
+    if common_ancestor:
+        # Rewards queued before the block number was recorded
+        in_rolled_back_range = or_(in_rolled_back_range, and_(
+            Reward.deposit_block_number.is_(None),
+            Reward.created_at >= common_ancestor.created_at,
+        ))
+    canonical_block_hashes: Dict[str, bool] = {}
+    for reward in dbsession.query(Reward).filter(in_rolled_back_range, Reward.status != RewardStatus.orphaned):
+        if is_canonical_block_hash(web3, reward.deposit_block_hash, cache=canonical_block_hashes):
+            continue
+        if reward.status == RewardStatus.queued:
+            logger.warning('Deposit for reward %s was removed from the chain, marking orphaned', reward)
+            reward.status = RewardStatus.orphaned
+        else:
+            logger.error(
+                'Deposit for reward %s (status %s) was removed from the chain, but the reward was already sent',
+                reward,
+                reward.status,
+            )
+
+    logger.info('Rolled back to block %s', last_valid_block)
+    dbsession.flush()
+    return last_valid_block
+
+
+def is_canonical_block_hash(web3: Web3, block_hash: str, *, cache: Optional[Dict[str, bool]] = None) -> bool:
+    """
+    Check if the block with the given hash is in the main chain. The results can be cached in a dict for the
+    duration of a round
+    """
+    block_hash = block_hash.lower()
+    if cache is not None and block_hash in cache:
+        return cache[block_hash]
+    try:
+        block = web3.eth.get_block(block_hash)
+    except BlockNotFound:
+        canonical = False
+    else:
+        # Nodes can also return blocks that are not in the main chain by hash
+        canonical = get_block_hash(web3, block.number) == block_hash
+    if cache is not None:
+        cache[block_hash] = canonical
+    return canonical
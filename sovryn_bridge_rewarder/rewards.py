@@ -4,24 +4,34 @@ Handles both DB and Web3 related logic.
 """
 from decimal import Decimal
 import logging
-from typing import List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from eth_account.signers.base import BaseAccount
 from eth_utils import from_wei
 from hexbytes import HexBytes
 from sqlalchemy import func
+from sqlalchemy.engine import Dialect
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.session import Session, sessionmaker
 from web3 import Web3
 
 from .config import RewardThresholdMap
 from .deposits import Deposit
+from .metrics import time_stage
 from .models import Reward, RewardStatus
-from .utils import address, retryable, utcnow
+from .reorgs import is_canonical_block_hash
+from .statistics import TRACKED_ATTRIBUTES, RewardValues, apply_reward_changes
+from .tracing import deposit_ids, span
+from .utils import address, canonical_address, lower_address, retryable, utcnow
 
 logger = logging.getLogger(__name__)
 MAX_PENDING_TRANSACTIONS = 4  # RSK limit
+BULK_BATCH_SIZE = 500  # rows per statement, well below the SQLite variable limit
+# The unique deposit of a reward (see the uq_reward_deposit index)
+DEPOSIT_KEY_COLUMNS = (Reward.deposit_transaction_hash, Reward.deposit_log_index, Reward.deposit_contract_address)
 
 
+@time_stage('queue_reward')
 def queue_reward(
     *,
     deposit: Deposit,
@@ -30,44 +40,192 @@ def queue_reward(
     reward_amount_rbtc: Decimal,
     deposit_thresholds: RewardThresholdMap,
 ):
-    threshold = deposit_thresholds.get(deposit.side_token_symbol)
-    if not threshold:
-        # TODO: maybe these should be added somewhere for post processing?
-        logger.warning('Threshold not found for deposit %s -- cannot process', deposit)
-        return
-    if deposit.amount_decimal < threshold:
-        logger.info('Threshold %s not met for deposit %s -- not rewarding', threshold, deposit)
+    if not _meets_threshold(deposit, deposit_thresholds):
         return
 
     existing_reward = dbsession.query(Reward).filter(
-        func.lower(Reward.user_address) == deposit.user_address.lower()
+        func.lower(Reward.user_address) == lower_address(deposit.user_address),
+        Reward.status != RewardStatus.orphaned,
     ).first()
     if existing_reward:
         logger.info('User %s has already been rewarded.', deposit.user_address)
         return
 
+    if not _is_new_user(web3, deposit.user_address):
+        return
+
+    logger.info('Rewarding user %s with %s RBTC', deposit.user_address, str(reward_amount_rbtc))
+
+    reward = Reward(**_get_reward_values(deposit, reward_amount_rbtc))
+    dbsession.add(reward)
+    dbsession.flush()
+    return reward
+
+
+@time_stage('queue_rewards')
+def queue_rewards(
+    *,
+    deposits: List[Deposit],
+    dbsession: Session,
+    web3: Web3,
+    reward_amount_rbtc: Decimal,
+    deposit_thresholds: RewardThresholdMap,
+    at_deposit_block: bool = False,
+) -> int:
+    """
+    Queue rewards for the deposits like queue_reward, but check the existing rewards with one query and insert
+    the new rewards in bulk. Deposits that already have a reward are skipped by the database, so processing the same
+    deposits again is safe.
+
+    With at_deposit_block, the balance and transaction count of each user are checked at the block of their
+    deposit instead of the latest block, for replaying historical deposits.
+
+    Returns the number of rewards queued.
+    """
+    candidates = {}
+    for deposit in deposits:
+        if not _meets_threshold(deposit, deposit_thresholds):
+            continue
+        user_address = lower_address(deposit.user_address)
+        if user_address in candidates:
+            logger.info('User %s has already been rewarded.', deposit.user_address)
+            continue
+        candidates[user_address] = deposit
+    if not candidates:
+        return 0
+
+    rewarded_users = set()
+    user_addresses = list(candidates.keys())
+    for i in range(0, len(user_addresses), BULK_BATCH_SIZE):
+        rewarded_users.update(
+            user_address for (user_address,) in dbsession.query(func.lower(Reward.user_address)).filter(
+                func.lower(Reward.user_address).in_(user_addresses[i:i + BULK_BATCH_SIZE]),
+                Reward.status != RewardStatus.orphaned,
+            )
+        )
+
+    values = []
+    created_at = utcnow()  # set here, as the statistics of the bulk inserts are computed from the values
+    with span('rewards.check_eligibility', deposit_ids=deposit_ids(list(candidates.values()))) as eligibility_span:
+        eligible_deposits = []
+        for user_address, deposit in candidates.items():
+            if user_address in rewarded_users:
+                logger.info('User %s has already been rewarded.', deposit.user_address)
+                continue
+            block_identifier = deposit.block_number if at_deposit_block else None
+            if not _is_new_user(web3, deposit.user_address, block_identifier=block_identifier):
+                continue
+            logger.info('Rewarding user %s with %s RBTC', deposit.user_address, str(reward_amount_rbtc))
+            values.append(dict(_get_reward_values(deposit, reward_amount_rbtc), created_at=created_at))
+            eligible_deposits.append(deposit)
+        eligibility_span.set_data('eligible_deposit_ids', deposit_ids(eligible_deposits))
+
+    num_queued = 0
+    for i in range(0, len(values), BULK_BATCH_SIZE):
+        num_queued += _insert_rewards_ignoring_duplicates(dbsession, values[i:i + BULK_BATCH_SIZE])
+    if num_queued < len(values):
+        logger.warning('%s rewards were already queued for the same deposits', len(values) - num_queued)
+    return num_queued
+
+
+def _insert_rewards_ignoring_duplicates(dbsession: Session, values: List[Dict[str, Any]]) -> int:
+    """
+    Insert rewards, skipping the ones for deposits that already have a reward, and count the inserted rewards in
+    the statistics. Returns the number of rewards inserted
+    """
+    dialect = dbsession.get_bind().dialect
+    if dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return _insert_rewards_one_by_one(dbsession, values)
+    statement = insert(Reward).values(values).on_conflict_do_nothing()
+    if _supports_insert_returning(dialect):
+        inserted_deposits = set(dbsession.execute(statement.returning(*DEPOSIT_KEY_COLUMNS)))
+    else:
+        # SQLite with SQLAlchemy < 2.0, which cannot compile RETURNING for it. Other writers are locked out during
+        # the statement, so the rows it inserted got consecutive rowids, up to the last one inserted
+        result = dbsession.execute(statement)
+        if result.rowcount == len(values):
+            inserted_deposits = None
+        else:
+            inserted_deposits = set(dbsession.query(*DEPOSIT_KEY_COLUMNS).filter(
+                Reward.id > result.lastrowid - result.rowcount,
+                Reward.id <= result.lastrowid,
+            )) if result.rowcount else set()
+    if inserted_deposits is not None:
+        values = [v for v in values if _get_deposit_key(v) in inserted_deposits]
+    # The statistics are only updated automatically for ORM changes
+    apply_reward_changes(dbsession.connection(), added=[
+        RewardValues(*[v[name] for name in TRACKED_ATTRIBUTES])
+        for v in values
+    ])
+    return len(values)
+
+
+def _insert_rewards_one_by_one(dbsession: Session, values: List[Dict[str, Any]]) -> int:
+    """
+    Insert rewards with the ORM, each in a savepoint so that a duplicate doesn't abort the transaction. For
+    databases without INSERT ... ON CONFLICT
+    """
+    num_inserted = 0
+    for v in values:
+        try:
+            with dbsession.begin_nested():
+                dbsession.add(Reward(**v))
+        except IntegrityError:
+            continue
+        num_inserted += 1
+    return num_inserted
+
+
+def _supports_insert_returning(dialect: Dialect) -> bool:
+    # insert_returning is from SQLAlchemy 2.0 (also true for SQLite >= 3.35), full_returning from 1.4
+    return getattr(dialect, 'insert_returning', getattr(dialect, 'full_returning', False))
+
+
+def _get_deposit_key(values: Dict[str, Any]) -> Tuple[str, int, str]:
+    return values['deposit_transaction_hash'], values['deposit_log_index'], values['deposit_contract_address']
+
+
+def _meets_threshold(deposit: Deposit, deposit_thresholds: RewardThresholdMap) -> bool:
+    threshold = deposit_thresholds.get(deposit.side_token_symbol)
+    if not threshold:
+        # TODO: maybe these should be added somewhere for post processing?
+        logger.warning('Threshold not found for deposit %s -- cannot process', deposit)
+        return False
+    if deposit.amount_decimal < threshold:
+        logger.info('Threshold %s not met for deposit %s -- not rewarding', threshold, deposit)
+        return False
+    return True
+
+
+def _is_new_user(web3: Web3, user_address: str, *, block_identifier: Optional[int] = None) -> bool:
     [balance, transaction_count] = _get_user_balance_and_transaction_count(
         web3=web3,
-        user_address=deposit.user_address.lower(),
+        user_address=user_address,
+        block_identifier=block_identifier,
     )
     if balance > 0:
         logger.info(
             'User %s has an existing balance of %s RBTC - not rewarding',
-            deposit.user_address,
+            user_address,
             from_wei(balance, 'ether')
         )
-        return
+        return False
     if transaction_count > 0:
         logger.info(
             'User %s already has %s transactions in RSK - not rewarding',
-            deposit.user_address,
+            user_address,
             transaction_count
         )
-        return
+        return False
+    return True
 
-    logger.info('Rewarding user %s with %s RBTC', deposit.user_address, str(reward_amount_rbtc))
 
-    reward = Reward(
+def _get_reward_values(deposit: Deposit, reward_amount_rbtc: Decimal) -> Dict[str, Any]:
+    return dict(
         status=RewardStatus.queued,
         reward_rbtc_wei=int(reward_amount_rbtc * 10**18),
         user_address=deposit.user_address,
@@ -76,22 +234,30 @@ def queue_reward(
         deposit_main_token_address=deposit.main_token_address,
         deposit_amount_minus_fees_wei=deposit.amount_minus_fees_wei,
         deposit_log_index=deposit.log_index,
+        deposit_block_number=deposit.block_number,
         deposit_block_hash=deposit.block_hash,
         deposit_transaction_hash=deposit.transaction_hash,
         deposit_contract_address=deposit.contract_address,
     )
-    dbsession.add(reward)
-    dbsession.flush()
-    return reward
 
 
-def _get_user_balance_and_transaction_count(web3: Web3, user_address: str) -> Tuple[int, int]:
+def _get_user_balance_and_transaction_count(
+    web3: Web3,
+    user_address: str,
+    *,
+    block_identifier: Optional[int] = None,
+) -> Tuple[int, int]:
+    """
+    Get the balance and transaction count of the user at the block (default: the latest block)
+    """
+    user_address = address(user_address)
+
     @retryable(max_attempts=5)
-    def get_data():
-        balance = web3.eth.get_balance(address(user_address))
-        transaction_count = web3.eth.get_transaction_count(address(user_address))
+    def get_balance_and_transaction_count():
+        balance = web3.eth.get_balance(user_address, block_identifier=block_identifier)
+        transaction_count = web3.eth.get_transaction_count(user_address, block_identifier=block_identifier)
         return [balance, transaction_count]
-    return get_data()
+    return get_balance_and_transaction_count()
 
 
 def get_queued_reward_ids(dbsession: Session):
@@ -137,6 +303,7 @@ def send_queued_rewards(
         block_identifier='pending'
     )
     pending_transactions = []
+    canonical_block_hashes: Dict[str, bool] = {}
     for reward_id in reward_ids:
         transaction_hash = send_reward(
             reward_id=reward_id,
@@ -144,6 +311,7 @@ def send_queued_rewards(
             DBSession=DBSession,
             from_account=from_account,
             nonce=nonce,
+            canonical_block_hashes=canonical_block_hashes,
         )
         if not transaction_hash:
             # It will return None if it didn't send a transaction
@@ -168,6 +336,7 @@ def send_queued_rewards(
     logger.info('Sent and confirmed %s rewards', len(reward_ids))
 
 
+@time_stage('send_reward')
 def send_reward(
     *,
     web3: Web3,
@@ -175,14 +344,20 @@ def send_reward(
     from_account: BaseAccount,
     reward_id: int,
     nonce: int,
+    canonical_block_hashes: Optional[Dict[str, bool]] = None,
 ) -> Optional[HexBytes]:
+    """
+    Sign and broadcast the transaction of a queued reward. The reward is not sent, but marked orphaned, if its
+    deposit was removed from the chain by a reorg that the main loop hasn't rolled back yet.
+    canonical_block_hashes caches the checked deposit blocks between calls
+    """
     gas_price = web3.eth.gas_price
     if gas_price > 10 * 10**9:  # greater than 10 GWei
         raise ValueError(f'gas price {gas_price} dangerously high, makes no sense')
     gas_limit = 21000
     gas_costs = gas_price * gas_limit * 2
-    from_address = from_account.address.lower()
-    sender_rbtc_balance = web3.eth.get_balance(address(from_address))
+    from_address = canonical_address(from_account.address)
+    sender_rbtc_balance = web3.eth.get_balance(from_address.checksummed)
 
     with DBSession.begin() as dbsession:
         reward = dbsession.query(Reward).filter_by(id=reward_id).one()
@@ -194,11 +369,16 @@ def send_reward(
             )
             return
 
+        if not is_canonical_block_hash(web3, reward.deposit_block_hash, cache=canonical_block_hashes):
+            logger.warning('Deposit for reward %s is no longer in the chain, marking orphaned', reward)
+            reward.status = RewardStatus.orphaned
+            return
+
         transaction_cost = reward.reward_rbtc_wei + gas_costs
         if sender_rbtc_balance < transaction_cost:
             logger.warning(
                 'account %s balance %s is lower than tx cost %s -- not sending reward %s',
-                from_address,
+                from_address.lower,
                 sender_rbtc_balance,
                 transaction_cost,
                 reward_id,
@@ -207,14 +387,15 @@ def send_reward(
 
         user_address = reward.user_address
         amount_wei = reward.reward_rbtc_wei
-        signed_transaction = from_account.sign_transaction({
-            'from': address(from_address),
-            'to': address(user_address),
-            'value': amount_wei,
-            'nonce': nonce,
-            'gasPrice': gas_price,
-            'gas': gas_limit,
-        })
+        with span('reward.sign', reward_id=reward_id, nonce=nonce):
+            signed_transaction = from_account.sign_transaction({
+                'from': from_address.checksummed,
+                'to': address(user_address),
+                'value': amount_wei,
+                'nonce': nonce,
+                'gasPrice': gas_price,
+                'gas': gas_limit,
+            })
 
         reward.status = RewardStatus.sending
         reward.reward_transaction_nonce = nonce
@@ -226,7 +407,9 @@ def send_reward(
         return HexBytes(tx_hash)
 
     try:
-        transaction_hash = submit_transaction()
+        with span('reward.broadcast', reward_id=reward_id, nonce=nonce) as broadcast_span:
+            transaction_hash = submit_transaction()
+            broadcast_span.set_data('transaction_hash', transaction_hash.hex())
     except Exception as e:
         with DBSession.begin() as dbsession:
             reward = dbsession.query(Reward).filter_by(id=reward_id).one()
@@ -244,6 +427,7 @@ def send_reward(
     return transaction_hash
 
 
+@time_stage('confirm_rewards')
 def confirm_rewards(
     web3: Web3,
     transaction_hashes: List[HexBytes],
@@ -253,18 +437,21 @@ def confirm_rewards(
     Wait (sequentially) for all given transactions and confirm in DB
     """
     for transaction_hash in transaction_hashes:
-        logger.info('Waiting for transaction %s...', transaction_hash.hex())
-        receipt = web3.eth.wait_for_transaction_receipt(transaction_hash, timeout=256, poll_latency=1)
-        with DBSession.begin() as dbsession:
-            reward = dbsession.query(Reward).filter_by(reward_transaction_hash=transaction_hash.hex()).one_or_none()
-            if not reward:
-                logger.error('Reward with tx hash %s not found', transaction_hash.hex())
-                continue
-            if reward.status != RewardStatus.sent:
-                logger.warning('Invalid status for reward %s, expected sent', reward)
-            if receipt.status:
-                logger.info('Confirmed reward %s', reward)
-                reward.status = RewardStatus.confirmed
-            else:
-                logger.info('Reward transaction failed! %s %s', transaction_hash.hex(), reward)
-                reward.status = RewardStatus.error_confirming
+        with span('reward.confirm', transaction_hash=transaction_hash.hex()) as confirm_span:
+            logger.info('Waiting for transaction %s...', transaction_hash.hex())
+            with span('reward.wait_for_receipt'):
+                receipt = web3.eth.wait_for_transaction_receipt(transaction_hash, timeout=256, poll_latency=1)
+            with DBSession.begin() as dbsession:
+                reward = dbsession.query(Reward).filter_by(reward_transaction_hash=transaction_hash.hex()).one_or_none()
+                if not reward:
+                    logger.error('Reward with tx hash %s not found', transaction_hash.hex())
+                    continue
+                confirm_span.set_data('reward_id', reward.id)
+                if reward.status != RewardStatus.sent:
+                    logger.warning('Invalid status for reward %s, expected sent', reward)
+                if receipt.status:
+                    logger.info('Confirmed reward %s', reward)
+                    reward.status = RewardStatus.confirmed
+                else:
+                    logger.info('Reward transaction failed! %s %s', transaction_hash.hex(), reward)
+                    reward.status = RewardStatus.error_confirming
@@ -0,0 +1,183 @@
+"""
+Web3 setup and instrumentation of the JSON-RPC calls made through it
+"""
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+import logging
+import threading
+from time import monotonic, perf_counter
+from typing import Any, Deque, Dict, List, Optional
+
+from web3 import HTTPProvider, Web3
+from web3._utils.request import make_post_request
+from web3.types import RPCEndpoint, RPCResponse
+
+from .metrics import RPC_CALL_ERRORS, RPC_PAYLOAD_BYTES, RPC_SECONDS
+
+logger = logging.getLogger(__name__)
+MAX_LATENCY_SAMPLES = 1000  # per method, for the percentiles in snapshots
+
+
+@dataclass
+class MethodStats:
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    request_bytes: int = 0
+    response_bytes: int = 0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=MAX_LATENCY_SAMPLES))
+
+    def record(self, *, seconds: float, error: bool):
+        self.calls += 1
+        self.errors += int(error)
+        self.total_seconds += seconds
+        self.latencies.append(seconds)
+
+    def record_payload(self, *, request_bytes: int, response_bytes: int):
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+
+    def as_dict(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'error_rate': self.errors / self.calls if self.calls else 0.0,
+            'total_seconds': self.total_seconds,
+            'p50_seconds': _percentile(latencies, 0.5),
+            'p95_seconds': _percentile(latencies, 0.95),
+            'max_seconds': latencies[-1] if latencies else None,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+        }
+
+
+class RPCStats:
+    """
+    Per-method statistics of JSON-RPC calls, both since the start of the process and for the current round
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._total: Dict[str, MethodStats] = defaultdict(MethodStats)
+        self._round: Dict[str, MethodStats] = defaultdict(MethodStats)
+        self.consecutive_errors = 0
+        self.last_success_at: Optional[float] = None  # time.monotonic()
+
+    def record(self, method: str, *, seconds: float, error: bool):
+        with self._lock:
+            if error:
+                self.consecutive_errors += 1
+            else:
+                self.consecutive_errors = 0
+                self.last_success_at = monotonic()
+            for stats in (self._total[method], self._round[method]):
+                stats.record(seconds=seconds, error=error)
+        RPC_SECONDS.labels(method=method).observe(seconds)
+        if error:
+            RPC_CALL_ERRORS.labels(method=method).inc()
+
+    def record_payload(self, method: str, *, request_bytes: int, response_bytes: int):
+        """
+        Record the sizes of the HTTP bodies of a call (see MeasuredHTTPProvider)
+        """
+        with self._lock:
+            for stats in (self._total[method], self._round[method]):
+                stats.record_payload(request_bytes=request_bytes, response_bytes=response_bytes)
+        RPC_PAYLOAD_BYTES.labels(method=method, direction='request').inc(request_bytes)
+        RPC_PAYLOAD_BYTES.labels(method=method, direction='response').inc(response_bytes)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the statistics of all calls since the start, by method
+        """
+        with self._lock:
+            return {method: stats.as_dict() for (method, stats) in sorted(self._total.items())}
+
+    def end_round(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Get the statistics of the calls made in the current round, by method, and start a new round
+        """
+        with self._lock:
+            round_stats = {method: stats.as_dict() for (method, stats) in sorted(self._round.items())}
+            self._round = defaultdict(MethodStats)
+        return round_stats
+
+    def log_round_summary(self, level: int = logging.INFO):
+        _log_summary(self.end_round(), 'this round', level=level)
+
+    def log_summary(self, level: int = logging.INFO):
+        """
+        Log the statistics of all calls since the start, e.g. at the end of a command
+        """
+        _log_summary(self.snapshot(), 'in total', level=level)
+
+
+def _log_summary(stats_by_method: Dict[str, Dict[str, Any]], period: str, *, level: int):
+    if not stats_by_method:
+        logger.log(level, 'No RPC calls %s', period)
+        return
+    logger.log(
+        level,
+        'RPC calls %s: %s',
+        period,
+        ', '.join(
+            f'{method}: {s["calls"]} ({s["total_seconds"]:.3f} s, {s["errors"]} errors)'
+            for (method, s) in stats_by_method.items()
+        )
+    )
+
+
+def rpc_stats_middleware(stats: RPCStats):
+    """
+    Create a web3 middleware that records the call count, latency and errors of each RPC method. The payload sizes
+    are recorded by the provider, see MeasuredHTTPProvider
+    """
+    def middleware(make_request, web3):
+        def record_request(method, params):
+            start = perf_counter()
+            try:
+                response = make_request(method, params)
+            except Exception:
+                stats.record(method, seconds=perf_counter() - start, error=True)
+                raise
+            stats.record(method, seconds=perf_counter() - start, error='error' in response)
+            return response
+        return record_request
+    return middleware
+
+
+class MeasuredHTTPProvider(HTTPProvider):
+    """
+    HTTP provider that records the sizes of the request and response bodies of each call, as sent and received,
+    so that they don't need to be serialized again for measuring them
+    """
+    def __init__(self, endpoint_uri: Optional[str] = None, *, stats: RPCStats, **kwargs: Any):
+        super().__init__(endpoint_uri, **kwargs)
+        self.stats = stats
+
+    def make_request(self, method: RPCEndpoint, params: Any) -> RPCResponse:
+        # Like HTTPProvider.make_request, which doesn't expose the raw bodies
+        request_data = self.encode_rpc_request(method, params)
+        try:
+            raw_response = make_post_request(self.endpoint_uri, request_data, **self.get_request_kwargs())
+        except Exception:
+            self.stats.record_payload(method, request_bytes=len(request_data), response_bytes=0)
+            raise
+        self.stats.record_payload(method, request_bytes=len(request_data), response_bytes=len(raw_response))
+        return self.decode_rpc_response(raw_response)
+
+
+def init_web3(rpc_url: str, *, stats: Optional[RPCStats] = None) -> Web3:
+    if stats is None:
+        return Web3(Web3.HTTPProvider(rpc_url))
+    web3 = Web3(MeasuredHTTPProvider(rpc_url, stats=stats))
+    # Innermost layer, so that only the requests that actually reach the node are recorded
+    web3.middleware_onion.inject(rpc_stats_middleware(stats), name='rpc_stats', layer=0)
+    return web3
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
@@ -0,0 +1,88 @@
+"""
+Scheduling of rewarder rounds based on the scan backlog and the observed block interval
+"""
+import logging
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RoundScheduler:
+    """
+    Decides how long to sleep between rewarder rounds.
+
+    While the rewarder is behind the chain by more than `backlog_threshold` blocks, rounds are run back to back.
+    When it's caught up, the polls are aligned to the observed block interval, so that the next block is picked
+    up soon after it's seen by the node. `max_sleep_seconds` is always the upper bound.
+
+    After errors, the sleep time backs off exponentially up to `max_error_sleep_seconds`.
+    """
+    # Weight of the latest observation in the block interval moving average
+    BLOCK_INTERVAL_SMOOTHING = 0.2
+
+    def __init__(
+        self,
+        *,
+        max_sleep_seconds: float,
+        min_sleep_seconds: float = 2,
+        backlog_threshold: int = 0,
+        max_error_sleep_seconds: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_sleep_seconds = max_sleep_seconds
+        self.min_sleep_seconds = min(min_sleep_seconds, max_sleep_seconds)
+        self.backlog_threshold = backlog_threshold
+        self.max_error_sleep_seconds = max_error_sleep_seconds
+        self.block_interval: Optional[float] = None
+        self._clock = clock
+        self._last_head: Optional[int] = None
+        self._last_head_seen_at: Optional[float] = None
+        self._consecutive_errors = 0
+
+    def observe_head(self, block_number: int):
+        """
+        Record the current head block number. Should be called once per round.
+        """
+        now = self._clock()
+        if self._last_head is None or block_number < self._last_head:
+            # First observation, or the node went backwards (e.g. a new node behind a load balancer)
+            self._last_head = block_number
+            self._last_head_seen_at = now
+            return
+        if block_number == self._last_head:
+            return
+
+        interval = (now - self._last_head_seen_at) / (block_number - self._last_head)
+        if self.block_interval is None:
+            self.block_interval = interval
+        else:
+            self.block_interval = (
+                self.BLOCK_INTERVAL_SMOOTHING * interval
+                + (1 - self.BLOCK_INTERVAL_SMOOTHING) * self.block_interval
+            )
+        self._last_head = block_number
+        self._last_head_seen_at = now
+
+    def get_sleep_seconds(self, *, backlog: int) -> float:
+        """
+        Get the time to sleep after a successful round, with `backlog` blocks still left to process
+        """
+        self._consecutive_errors = 0
+        if backlog > self.backlog_threshold:
+            return 0
+        if self.block_interval is None:
+            return self.max_sleep_seconds
+
+        next_block_expected_at = self._last_head_seen_at + self.block_interval
+        sleep_seconds = next_block_expected_at - self._clock()
+        # If the next block is overdue, we just poll again after the minimum sleep
+        return min(max(sleep_seconds, self.min_sleep_seconds), self.max_sleep_seconds)
+
+    def get_error_sleep_seconds(self) -> float:
+        """
+        Get the time to sleep after a failed round
+        """
+        sleep_seconds = min(2 ** self._consecutive_errors, self.max_error_sleep_seconds)
+        self._consecutive_errors += 1
+        return sleep_seconds
@@ -0,0 +1,120 @@
+"""
+Dry-run simulation of the reward decisions over a historical block range
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from decimal import Decimal
+import logging
+from time import perf_counter
+from typing import Dict, List, Optional
+
+from eth_utils import from_wei
+from web3 import Web3
+from web3.contract import Contract
+
+from .backfill import scan_chunks, split_range
+from .config import Config
+from .database import init_sqlalchemy
+from .log_archive import LogArchive
+from .models import Reward
+from .rewards import queue_rewards
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SimulatedReward:
+    user_address: str
+    reward_rbtc_wei: int
+    deposit_side_token_symbol: str
+    deposit_amount_minus_fees_wei: int
+    deposit_transaction_hash: str
+    deposit_log_index: int
+
+
+@dataclass
+class SimulationResult:
+    from_block: int
+    to_block: int
+    num_deposits: int = 0
+    rewards: List[SimulatedReward] = field(default_factory=list)
+    deposits_by_token: Dict[str, int] = field(default_factory=Counter)
+    seconds: float = 0.0
+
+    @property
+    def rewards_by_token(self) -> Dict[str, int]:
+        return Counter(r.deposit_side_token_symbol for r in self.rewards)
+
+    @property
+    def total_reward_rbtc(self) -> Decimal:
+        return from_wei(sum(r.reward_rbtc_wei for r in self.rewards), 'ether')
+
+    @property
+    def blocks_per_second(self) -> Optional[float]:
+        return (self.to_block - self.from_block + 1) / self.seconds if self.seconds else None
+
+    @property
+    def deposits_per_second(self) -> Optional[float]:
+        return self.num_deposits / self.seconds if self.seconds else None
+
+
+def simulate(
+    *,
+    web3: Web3,
+    bridge_contracts: Dict[str, Contract],
+    config: Config,
+    from_block: int,
+    to_block: int,
+    chunk_size: int = 10000,
+    workers: int = 1,
+    archive: Optional[LogArchive] = None,
+) -> SimulationResult:
+    """
+    Parse the deposits in the block range and run the reward decisions for them against an empty in-memory
+    database, returning the rewards that would be queued. Nothing is signed, sent or written to the configured
+    database.
+
+    The balance and transaction count of each user are checked at the block of their deposit, as they were when
+    the rewarder would have seen the deposit, so the node must serve historical state (an archive node). Use a
+    CassetteProvider for web3 to replay recorded RPC responses.
+    """
+    result = SimulationResult(from_block=from_block, to_block=to_block)
+    DBSession = init_sqlalchemy('sqlite://', create_models=True)
+    start = perf_counter()
+    num_queued = 0
+    with DBSession() as dbsession:
+        for (chunk_from_block, chunk_to_block), deposits in scan_chunks(
+            web3=web3,
+            bridge_contracts=bridge_contracts,
+            config=config,
+            chunks=split_range(from_block, to_block, chunk_size),
+            workers=workers,
+            archive=archive,
+        ):
+            result.num_deposits += len(deposits)
+            result.deposits_by_token.update(deposit.side_token_symbol for deposit in deposits)
+            num_queued += queue_rewards(
+                deposits=deposits,
+                dbsession=dbsession,
+                web3=web3,
+                reward_amount_rbtc=config.reward_rbtc,
+                deposit_thresholds=config.reward_thresholds,
+                at_deposit_block=True,
+            )
+            logger.info(
+                'Simulated chunk %s-%s: %s deposits, %s rewards so far',
+                chunk_from_block, chunk_to_block, len(deposits), num_queued,
+            )
+        result.rewards = [
+            SimulatedReward(
+                user_address=reward.user_address,
+                reward_rbtc_wei=reward.reward_rbtc_wei,
+                deposit_side_token_symbol=reward.deposit_side_token_symbol,
+                deposit_amount_minus_fees_wei=reward.deposit_amount_minus_fees_wei,
+                deposit_transaction_hash=reward.deposit_transaction_hash,
+                deposit_log_index=reward.deposit_log_index,
+            )
+            for reward in dbsession.query(Reward).order_by(Reward.id)
+        ]
+    result.seconds = perf_counter() - start
+    return result
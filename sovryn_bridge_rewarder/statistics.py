@@ -0,0 +1,248 @@
+"""
+Incrementally maintained reward statistics (the reward_statistic table)
+
+Changes to rewards made through the ORM are applied to the statistics in the same transaction, by a session event
+registered on import of this module. Rewards inserted with Core statements (the bulk insert of queue_rewards) have to
+be passed to apply_reward_changes explicitly. Bulk updates and deletes bypass the session event too; after those,
+the statistics have to be rebuilt with rebuild_reward_statistics (the `rebuild-statistics` command).
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+import logging
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session, attributes
+
+from .models import Reward, RewardStatistic, RewardStatus
+
+logger = logging.getLogger(__name__)
+
+# Attributes of Reward that affect the statistics
+TRACKED_ATTRIBUTES = (
+    'created_at',
+    'status',
+    'deposit_side_token_symbol',
+    'reward_rbtc_wei',
+    'deposit_amount_minus_fees_wei',
+)
+
+
+class StatisticKey(NamedTuple):
+    day: date
+    status: RewardStatus
+    deposit_side_token_symbol: str
+
+
+class StatisticDelta(NamedTuple):
+    count: int
+    reward_rbtc_wei: int
+    deposit_amount_minus_fees_wei: int
+
+
+class RewardValues(NamedTuple):
+    """
+    The values of a reward that are counted in the statistics, in the order of TRACKED_ATTRIBUTES
+    """
+    created_at: datetime
+    status: RewardStatus
+    deposit_side_token_symbol: str
+    reward_rbtc_wei: int
+    deposit_amount_minus_fees_wei: int
+
+    @property
+    def key(self) -> StatisticKey:
+        return StatisticKey(
+            day=self.created_at.date(),
+            status=RewardStatus(self.status),
+            deposit_side_token_symbol=self.deposit_side_token_symbol,
+        )
+
+
+@dataclass
+class TokenStatistics:
+    deposit_side_token_symbol: str
+    rewards_paid: int = 0
+    rbtc_paid_wei: int = 0
+    deposit_amount_minus_fees_wei: int = 0  # of the deposits of the paid rewards
+
+    @property
+    def average_deposit_wei(self) -> Optional[int]:
+        if not self.rewards_paid:
+            return None
+        return self.deposit_amount_minus_fees_wei // self.rewards_paid
+
+
+PAID_STATUSES = (RewardStatus.sent, RewardStatus.confirmed)
+
+
+def get_daily_statistics(
+    dbsession: Session,
+    *,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    token_symbol: Optional[str] = None,
+) -> List[RewardStatistic]:
+    """
+    Get the statistics rows between the days since and until (inclusive), ordered by day
+    """
+    query = dbsession.query(RewardStatistic).filter(RewardStatistic.count != 0)
+    if since is not None:
+        query = query.filter(RewardStatistic.day >= since)
+    if until is not None:
+        query = query.filter(RewardStatistic.day <= until)
+    if token_symbol:
+        query = query.filter(RewardStatistic.deposit_side_token_symbol == token_symbol)
+    return query.order_by(
+        RewardStatistic.day, RewardStatistic.deposit_side_token_symbol, RewardStatistic.status,
+    ).all()
+
+
+def get_token_statistics(
+    dbsession: Session,
+    *,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+) -> List[TokenStatistics]:
+    """
+    Get the number and amounts of the paid (sent or confirmed) rewards by side token
+    """
+    by_token: Dict[str, TokenStatistics] = {}
+    for row in get_daily_statistics(dbsession, since=since, until=until):
+        token_statistics = by_token.setdefault(
+            row.deposit_side_token_symbol,
+            TokenStatistics(deposit_side_token_symbol=row.deposit_side_token_symbol),
+        )
+        if row.status in PAID_STATUSES:
+            token_statistics.rewards_paid += row.count
+            token_statistics.rbtc_paid_wei += row.reward_rbtc_wei
+            token_statistics.deposit_amount_minus_fees_wei += row.deposit_amount_minus_fees_wei
+    return sorted(by_token.values(), key=lambda t: t.deposit_side_token_symbol)
+
+
+def apply_reward_changes(
+    connection: Connection,
+    *,
+    added: Iterable[RewardValues] = (),
+    removed: Iterable[RewardValues] = (),
+):
+    """
+    Update the statistics for added and removed rewards. A changed reward is removed with its old values and added
+    with the new ones.
+    """
+    deltas: Dict[StatisticKey, List[int]] = defaultdict(lambda: [0, 0, 0])
+    for values, sign in [(v, 1) for v in added] + [(v, -1) for v in removed]:
+        delta = deltas[values.key]
+        delta[0] += sign
+        delta[1] += sign * int(values.reward_rbtc_wei)
+        delta[2] += sign * int(values.deposit_amount_minus_fees_wei)
+    _apply_deltas(connection, {
+        key: StatisticDelta(*delta)
+        for key, delta in deltas.items()
+        if any(delta)
+    })
+
+
+def rebuild_reward_statistics(connection: Connection):
+    """
+    Recompute the statistics from all rewards. This is a full scan of the reward table, and only needed if the
+    rewards were changed without the ORM (or apply_reward_changes). Bulk updates and deletes, like
+    `dbsession.query(Reward).update(...)` or Core statements, don't go through the after_flush hook and leave the
+    statistics stale. Run with the `rebuild-statistics` command.
+    """
+    logger.info('Rebuilding reward statistics')
+    connection.execute(RewardStatistic.__table__.delete())
+    reward = Reward.__table__
+    rows = connection.execution_options(stream_results=True).execute(
+        select(*[reward.c[name] for name in TRACKED_ATTRIBUTES])
+    )
+    while True:
+        chunk = rows.fetchmany(10000)
+        if not chunk:
+            break
+        apply_reward_changes(connection, added=[RewardValues(*row) for row in chunk])
+
+
+def _apply_deltas(connection: Connection, deltas: Dict[StatisticKey, StatisticDelta]):
+    if not deltas:
+        return
+    table = RewardStatistic.__table__
+    if connection.dialect.name == 'postgresql':
+        # Atomic upserts. Numeric addition is exact in PostgreSQL
+        from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.day, table.c.status, table.c.deposit_side_token_symbol],
+            set_={
+                name: table.c[name] + statement.excluded[name]
+                for name in StatisticDelta._fields
+            },
+        )
+        connection.execute(statement, [
+            dict(key._asdict(), **delta._asdict())
+            for key, delta in deltas.items()
+        ])
+        return
+
+    # The amounts are text in SQLite, so they're added here rather than in SQL, which would lose precision. The count
+    # is added in SQL first: the update takes the write lock of the database, or fails if another transaction has
+    # written since this one started reading (SQLITE_BUSY_SNAPSHOT in WAL mode, which busy_timeout doesn't retry).
+    # The lock is held until the commit, so the amounts read after the update can't be changed concurrently.
+    for key, delta in deltas.items():
+        condition = (
+            (table.c.day == key.day)
+            & (table.c.status == key.status)
+            & (table.c.deposit_side_token_symbol == key.deposit_side_token_symbol)
+        )
+        result = connection.execute(table.update().where(condition).values(count=table.c.count + delta.count))
+        if not result.rowcount:
+            connection.execute(table.insert().values(**key._asdict(), **delta._asdict()))
+            continue
+        reward_rbtc_wei, deposit_amount_minus_fees_wei = connection.execute(
+            select(table.c.reward_rbtc_wei, table.c.deposit_amount_minus_fees_wei).where(condition)
+        ).one()
+        connection.execute(table.update().where(condition).values(
+            reward_rbtc_wei=reward_rbtc_wei + delta.reward_rbtc_wei,
+            deposit_amount_minus_fees_wei=deposit_amount_minus_fees_wei + delta.deposit_amount_minus_fees_wei,
+        ))
+
+
+def _get_reward_values(reward: Reward, *, old: bool = False) -> Optional[RewardValues]:
+    values = []
+    for name in TRACKED_ATTRIBUTES:
+        value = getattr(reward, name)
+        if old:
+            history = attributes.get_history(reward, name)
+            if history.deleted:
+                value = history.deleted[0]
+        values.append(value)
+    if any(value is None for value in values):
+        return None
+    return RewardValues(*values)
+
+
+@event.listens_for(Session, 'after_flush')
+def _update_statistics_after_flush(session: Session, flush_context: Any):
+    # The session still has the state from before the flush (new, dirty and deleted objects and attribute
+    # history), but the objects have their generated values, like created_at
+    added = []
+    removed = []
+    for obj in session.new:
+        if isinstance(obj, Reward):
+            added.append(_get_reward_values(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Reward) and session.is_modified(obj):
+            old_values = _get_reward_values(obj, old=True)
+            new_values = _get_reward_values(obj)
+            if old_values != new_values:
+                removed.append(old_values)
+                added.append(new_values)
+    for obj in session.deleted:
+        if isinstance(obj, Reward):
+            removed.append(_get_reward_values(obj, old=True))
+    added = [values for values in added if values is not None]
+    removed = [values for values in removed if values is not None]
+    if added or removed:
+        apply_reward_changes(session.connection(), added=added, removed=removed)
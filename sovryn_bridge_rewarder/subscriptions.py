@@ -0,0 +1,195 @@
+"""
+Push-based discovery of bridge logs through a websocket `eth_subscribe` subscription
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+LogKey = Tuple[str, str, int]  # (block hash, transaction hash, log index)
+
+
+class LogSubscription:
+    """
+    Keeps websocket subscriptions to the logs of the given addresses and to new block headers open
+    in a background thread, and buffers the received logs until they are processed.
+
+    The subscription only covers blocks mined after it was (re)established. `get_logs` returns None for
+    ranges it doesn't cover, in which case the caller should fall back to polling with eth_getLogs.
+    """
+    def __init__(
+        self,
+        *,
+        ws_url: str,
+        addresses: List[str],
+        topics: List[str],
+        reconnect_seconds: float = 5,
+    ):
+        self.ws_url = ws_url
+        self.addresses = [a.lower() for a in addresses]
+        self.topics = topics
+        self.reconnect_seconds = reconnect_seconds
+        self.head: Optional[int] = None
+        self._covered_from_block: Optional[int] = None
+        self._logs: Dict[LogKey, Dict[str, Any]] = {}
+        self._condition = threading.Condition()
+        self._request_ids = itertools.count(1)
+        self._subscription_ids: Dict[str, str] = {}
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._covered_from_block is not None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-subscription', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._loop and self._task:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def get_logs(self, *, from_block: int, to_block: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get buffered raw logs from `from_block` to `to_block` (inclusive), sorted in chain order,
+        or None if the subscription does not cover the range. Blocks after the last received header are not
+        covered, as their logs may not have been received yet
+        """
+        with self._condition:
+            if self._covered_from_block is None or from_block < self._covered_from_block:
+                return None
+            if self.head is None or to_block > self.head:
+                return None
+            logs = [
+                log for log in self._logs.values()
+                if from_block <= int(log['blockNumber'], 16) <= to_block
+            ]
+        return sorted(logs, key=lambda log: (int(log['blockNumber'], 16), int(log['logIndex'], 16)))
+
+    def discard_logs(self, *, up_to_block: int):
+        """
+        Discard buffered logs up to `up_to_block` (inclusive), after they have been processed.
+        The range is no longer covered after this, so that it's polled again if it needs to be reprocessed.
+        """
+        with self._condition:
+            if self._covered_from_block is not None:
+                self._covered_from_block = max(self._covered_from_block, up_to_block + 1)
+            self._logs = {
+                key: log for (key, log) in self._logs.items()
+                if int(log['blockNumber'], 16) > up_to_block
+            }
+
+    def wait_for_block(self, block_number: int, *, timeout: float) -> bool:
+        """
+        Wait until a block header with at least `block_number` is received, or until `timeout` seconds pass.
+        Returns True if the block was received.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.head is not None and self.head >= block_number,
+                timeout=timeout,
+            )
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._task = self._loop.create_task(self._run_forever())
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    async def _run_forever(self):
+        while not self._stopped.is_set():
+            try:
+                await self._run_connection()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Log subscription to %s disconnected: %s', self.ws_url, e)
+            self._on_disconnect()
+            if not self._stopped.is_set():
+                await asyncio.sleep(self.reconnect_seconds)
+
+    async def _run_connection(self):
+        async with websockets.connect(self.ws_url) as ws:
+            self._subscription_ids = {}
+            logs_subscription_id = await self._request(ws, 'eth_subscribe', [
+                'logs',
+                {
+                    'address': self.addresses,
+                    'topics': [self.topics],
+                },
+            ])
+            self._subscription_ids[logs_subscription_id] = 'logs'
+            heads_subscription_id = await self._request(ws, 'eth_subscribe', ['newHeads'])
+            self._subscription_ids[heads_subscription_id] = 'newHeads'
+            # Blocks after this one are guaranteed to be pushed to us
+            block_number = int(await self._request(ws, 'eth_blockNumber', []), 16)
+            self._on_connect(block_number)
+
+            async for message in ws:
+                self._handle_message(json.loads(message))
+
+    async def _request(self, ws, method: str, params: List[Any]) -> Any:
+        request_id = next(self._request_ids)
+        await ws.send(json.dumps({
+            'jsonrpc': '2.0',
+            'id': request_id,
+            'method': method,
+            'params': params,
+        }))
+        async for message in ws:
+            data = json.loads(message)
+            if data.get('id') != request_id:
+                self._handle_message(data)
+                continue
+            if 'error' in data:
+                raise ValueError(f'{method} failed: {data["error"]}')
+            return data['result']
+        raise ConnectionError(f'connection closed while waiting for {method} response')
+
+    def _handle_message(self, data: Dict[str, Any]):
+        if data.get('method') != 'eth_subscription':
+            return
+        params = data['params']
+        subscription_type = self._subscription_ids.get(params['subscription'])
+        result = params['result']
+        with self._condition:
+            if subscription_type == 'logs':
+                key = (result['blockHash'], result['transactionHash'], int(result['logIndex'], 16))
+                if result.get('removed'):
+                    logger.info('Log %s removed by chain reorganization', key)
+                    self._logs.pop(key, None)
+                else:
+                    self._logs[key] = result
+            elif subscription_type == 'newHeads':
+                self.head = int(result['number'], 16)
+                self._condition.notify_all()
+
+    def _on_connect(self, block_number: int):
+        logger.info('Subscribed to bridge logs at %s from block %s', self.ws_url, block_number + 1)
+        with self._condition:
+            self._covered_from_block = block_number + 1
+            if self.head is None or self.head < block_number:
+                self.head = block_number
+            self._condition.notify_all()
+
+    def _on_disconnect(self):
+        with self._condition:
+            self._covered_from_block = None
+            self.head = None
+            self._logs = {}
@@ -0,0 +1,145 @@
+"""
+Tracing of the rewarder rounds
+
+Each round is a transaction (the root span), with child spans for the stages of the pipeline: fetching the logs of a
+block window, resolving side tokens, checking the eligibility of a batch of deposits, database commits, and signing,
+broadcasting and confirming each reward. The spans carry the ids of the deposits and rewards they handle.
+
+The spans are sent to Sentry if it's initialized (sentryDsn), and to OpenTelemetry if the opentelemetry-api package
+is installed. Without an OpenTelemetry SDK, the OpenTelemetry spans are no-ops -- the easiest way to configure the
+SDK and an exporter is to run the rewarder with `opentelemetry-instrument` and the standard OTEL_* environment
+variables (pip install -e '.[opentelemetry]').
+"""
+import contextlib
+import logging
+from typing import Any, Iterator, List, Optional
+
+import sentry_sdk
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+# Limit for the number of ids recorded on a single span
+MAX_IDS_PER_SPAN = 100
+_COMMIT_SPANS_KEY = 'tracing_commit_spans'
+
+
+def _get_tracer():
+    if otel_trace is None:
+        return None
+    return otel_trace.get_tracer(__name__)
+
+
+class TraceSpan:
+    """
+    A Sentry span and an OpenTelemetry span (either can be None) that are started and finished together
+    """
+    def __init__(self, sentry_span: Any = None, otel_span: Any = None):
+        self.sentry_span = sentry_span
+        self.otel_span = otel_span
+
+    def set_data(self, key: str, value: Any):
+        if value is None:
+            return
+        if isinstance(value, (list, tuple)) and len(value) > MAX_IDS_PER_SPAN:
+            self.set_data(f'{key}_count', len(value))
+            value = list(value[:MAX_IDS_PER_SPAN])
+        if self.sentry_span is not None:
+            self.sentry_span.set_data(key, value)
+        if self.otel_span is not None:
+            self.otel_span.set_attribute(key, value)
+
+    def finish(self, *, error: bool = False):
+        if self.sentry_span is not None:
+            if error:
+                self.sentry_span.set_status('internal_error')
+            self.sentry_span.finish()
+        if self.otel_span is not None:
+            if error:
+                self.otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR))
+            self.otel_span.end()
+
+
+@contextlib.contextmanager
+def trace_round(**data: Any) -> Iterator[TraceSpan]:
+    """
+    Start a new trace for a rewarder round. Spans started inside the block are its children
+    """
+    with contextlib.ExitStack() as stack:
+        sentry_transaction = stack.enter_context(
+            sentry_sdk.start_transaction(op='rewarder.round', name='rewarder round')
+        )
+        tracer = _get_tracer()
+        otel_span = None
+        if tracer is not None:
+            # A new root span, not a child of whatever is current
+            otel_span = stack.enter_context(tracer.start_as_current_span(
+                'rewarder.round',
+                context=otel_trace.set_span_in_context(otel_trace.INVALID_SPAN),
+            ))
+        trace_span = TraceSpan(sentry_transaction, otel_span)
+        for key, value in data.items():
+            trace_span.set_data(key, value)
+        yield trace_span
+
+
+@contextlib.contextmanager
+def span(op: str, description: Optional[str] = None, **data: Any) -> Iterator[TraceSpan]:
+    """
+    Start a child span of the current span. The keyword arguments are added to it as data (Sentry) or attributes
+    (OpenTelemetry)
+    """
+    with contextlib.ExitStack() as stack:
+        sentry_span = stack.enter_context(sentry_sdk.start_span(op=op, description=description))
+        tracer = _get_tracer()
+        otel_span = None
+        if tracer is not None:
+            otel_span = stack.enter_context(tracer.start_as_current_span(op))
+            if description:
+                otel_span.set_attribute('description', description)
+        trace_span = TraceSpan(sentry_span, otel_span)
+        for key, value in data.items():
+            trace_span.set_data(key, value)
+        yield trace_span
+
+
+def deposit_ids(deposits: List[Any]) -> List[str]:
+    """
+    Get ids for the deposits, for span data. A deposit is identified by its transaction hash and log index
+    """
+    return [f'{deposit.transaction_hash}:{deposit.log_index}' for deposit in deposits]
+
+
+def _start_commit_span(session: Session):
+    sentry_span = sentry_sdk.start_span(op='db.commit')
+    tracer = _get_tracer()
+    otel_span = tracer.start_span('db.commit') if tracer is not None else None
+    session.info.setdefault(_COMMIT_SPANS_KEY, []).append(TraceSpan(sentry_span, otel_span))
+
+
+def _finish_commit_span(session: Session, *, error: bool = False):
+    spans = session.info.get(_COMMIT_SPANS_KEY)
+    if spans:
+        spans.pop().finish(error=error)
+
+
+@event.listens_for(Session, 'before_commit')
+def _trace_before_commit(session: Session):
+    _start_commit_span(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _trace_after_commit(session: Session):
+    _finish_commit_span(session)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _trace_after_rollback(session: Session):
+    # A failed commit is rolled back
+    _finish_commit_span(session, error=True)
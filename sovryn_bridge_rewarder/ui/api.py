@@ -0,0 +1,408 @@
+"""
+Read-only JSON API served by the UI server, for monitoring and support tools
+
+GET /api/rewards          rewards, latest first. Filters: status (repeatable), user, token. Paginated with
+                          limit and cursor (the nextCursor of the previous page)
+GET /api/rewards/summary  number of rewards and total RBTC by status
+GET /api/statistics       daily reward statistics by status and token, and the paid rewards by token.
+                          Filters: since, until (YYYY-MM-DD, inclusive), token
+GET /api/status           the status snapshot of the rewarder: last processed block, lag, balance, queue...
+
+Responses have an ETag and are cached for a few seconds, up to MAX_CACHED_RESPONSES of the most recently used. A
+request with a matching If-None-Match gets an empty 304 response.
+"""
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from datetime import date
+from functools import partial
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from eth_utils import from_wei, is_hex_address
+from sqlalchemy.orm import sessionmaker
+
+from ..config import Config
+from ..models import BlockInfo, Reward, RewarderStatus, RewardStatus
+from ..statistics import get_daily_statistics, get_token_statistics
+from ..utils import lower_address
+from .data import BlockingCallRunner
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# The responses are keyed by the query string, which clients control, so the cache is bounded
+MAX_CACHED_RESPONSES = 1000
+REWARD_COLUMNS = (
+    Reward.id,
+    Reward.status,
+    Reward.created_at,
+    Reward.sent_at,
+    Reward.user_address,
+    Reward.reward_rbtc_wei,
+    Reward.reward_transaction_hash,
+    Reward.deposit_side_token_symbol,
+    Reward.deposit_amount_minus_fees_wei,
+    Reward.deposit_transaction_hash,
+    Reward.deposit_log_index,
+    Reward.deposit_contract_address,
+)
+
+QueryParams = Sequence[Tuple[str, str]]
+
+
+class APIError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class APIResponse:
+    status: int
+    body: bytes = b''
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+def get_rewards_page(
+    Session: sessionmaker,
+    *,
+    statuses: Sequence[RewardStatus] = (),
+    user_address: Optional[str] = None,
+    token_symbol: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+) -> Dict[str, Any]:
+    """
+    Get a page of rewards, latest first. The pages are keyset-paginated by id, so each page is an index scan
+    regardless of how deep it is.
+    """
+    with Session() as dbsession:
+        query = dbsession.query(*REWARD_COLUMNS)
+        if statuses:
+            query = query.filter(Reward.status.in_(statuses))
+        if user_address:
+            # The addresses are stored lowercase, so this uses the index on user_address
+            query = query.filter(Reward.user_address == lower_address(user_address))
+        if token_symbol:
+            query = query.filter(Reward.deposit_side_token_symbol == token_symbol)
+        if cursor is not None:
+            query = query.filter(Reward.id < cursor)
+        # One extra row tells if there is a next page
+        rows = query.order_by(Reward.id.desc()).limit(limit + 1).all()
+    has_next_page = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'rewards': [_serialize_reward(row) for row in rows],
+        'nextCursor': rows[-1].id if has_next_page else None,
+    }
+
+
+def get_reward_summary(Session: sessionmaker) -> Dict[str, Any]:
+    counts = defaultdict(int)
+    rbtc_wei_by_status = defaultdict(int)
+    with Session() as dbsession:
+        for row in get_daily_statistics(dbsession):
+            counts[row.status] += row.count
+            rbtc_wei_by_status[row.status] += row.reward_rbtc_wei
+    return {
+        'statuses': {
+            status.value: {
+                'count': counts.get(status, 0),
+                'totalRbtc': str(from_wei(rbtc_wei_by_status.get(status, 0), 'ether')),
+            }
+            for status in RewardStatus
+        },
+        'total': sum(counts.values()),
+    }
+
+
+def get_statistics(
+    Session: sessionmaker,
+    *,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    token_symbol: Optional[str] = None,
+) -> Dict[str, Any]:
+    with Session() as dbsession:
+        daily_statistics = get_daily_statistics(dbsession, since=since, until=until, token_symbol=token_symbol)
+        token_statistics = get_token_statistics(dbsession, since=since, until=until)
+    if token_symbol:
+        token_statistics = [t for t in token_statistics if t.deposit_side_token_symbol == token_symbol]
+    return {
+        'days': [
+            {
+                'day': row.day.isoformat(),
+                'status': row.status.value,
+                'token': row.deposit_side_token_symbol,
+                'count': row.count,
+                'rewardRbtc': str(from_wei(row.reward_rbtc_wei, 'ether')),
+                'depositAmountMinusFeesWei': str(row.deposit_amount_minus_fees_wei),
+            }
+            for row in daily_statistics
+        ],
+        'tokens': [
+            {
+                'token': t.deposit_side_token_symbol,
+                'rewardsPaid': t.rewards_paid,
+                'rbtcPaid': str(from_wei(t.rbtc_paid_wei, 'ether')),
+                'averageDepositWei': str(t.average_deposit_wei) if t.average_deposit_wei is not None else None,
+            }
+            for t in token_statistics
+        ],
+    }
+
+
+def get_rewarder_status(Session: sessionmaker, account_address: str) -> Dict[str, Any]:
+    """
+    Get the status snapshot published by the rewarder. Before the first round is complete, only the last
+    processed block is known.
+    """
+    with Session() as dbsession:
+        status = dbsession.query(RewarderStatus).filter_by(account_address=account_address.lower()).one_or_none()
+        if status is None:
+            last_processed_block = dbsession.query(BlockInfo.block_number).filter_by(
+                key='last_processed_block'
+            ).scalar()
+            return {
+                'accountAddress': account_address.lower(),
+                'lastProcessedBlock': last_processed_block,
+                'updatedAt': None,
+            }
+        return {
+            'accountAddress': status.account_address,
+            'lastProcessedBlock': status.last_processed_block,
+            'headBlock': status.head_block,
+            'backlogBlocks': status.backlog_blocks,
+            'rbtcBalance': str(from_wei(status.rbtc_balance_wei, 'ether')),
+            'gasPriceWei': str(status.gas_price_wei),
+            'queuedRewards': status.queued_rewards,
+            'sendingRewards': status.sending_rewards,
+            'sentRewards': status.sent_rewards,
+            'roundSeconds': status.round_seconds,
+            'updatedAt': status.updated_at.isoformat(),
+        }
+
+
+class RewarderAPI:
+    """
+    Handlers of the API, independent of the web framework. The blocking database calls are run with the
+    BlockingCallRunner of the UI.
+    """
+    def __init__(
+        self,
+        *,
+        Session: sessionmaker,
+        config: Config,
+        runner: BlockingCallRunner,
+        timeout: float = 10,
+        cache_seconds: float = 5,
+        max_cached_responses: int = MAX_CACHED_RESPONSES,
+    ):
+        self.Session = Session
+        self.config = config
+        self.runner = runner
+        self.timeout = timeout
+        self.cache_seconds = cache_seconds
+        self.max_cached_responses = max_cached_responses
+        # LRU: the most recently used responses are at the end
+        self._cache: 'OrderedDict[str, Tuple[float, APIResponse]]' = OrderedDict()
+        # Each handler parses the query parameters and returns a blocking function that loads the data
+        self._handlers: Dict[str, Callable[[QueryParams], Callable[[], Any]]] = {
+            '/api/rewards': self._rewards,
+            '/api/rewards/summary': self._reward_summary,
+            '/api/statistics': self._statistics,
+            '/api/status': self._status,
+        }
+
+    @property
+    def paths(self) -> List[str]:
+        return list(self._handlers)
+
+    async def handle(self, path: str, query_params: QueryParams, *, if_none_match: Optional[str] = None) -> APIResponse:
+        handler = self._handlers.get(path)
+        if handler is None:
+            return _error_response(404, 'not found')
+        # Encoded, so that a value containing & or = can't make the key of another query
+        cache_key = path + '?' + urlencode(sorted(query_params))
+
+        now = time.monotonic()
+        cached = self._get_cached(cache_key, now)
+        if cached is not None:
+            response = cached
+        else:
+            try:
+                load = handler(query_params)
+                data = await self.runner.call(cache_key, load, timeout=self.timeout)
+            except APIError as e:
+                return _error_response(e.status, str(e))
+            except Exception as e:
+                logger.warning('Error handling API request %s: %r', cache_key, e)
+                return _error_response(503, 'temporarily unavailable')
+            response = _json_response(data, cache_seconds=self.cache_seconds)
+            self._set_cached(cache_key, response, now)
+
+        if if_none_match is not None and _etag_matches(response.headers['ETag'], if_none_match):
+            return APIResponse(status=304, headers=response.headers)
+        return response
+
+    def _rewards(self, query_params: QueryParams):
+        statuses = []
+        for status in _get_params(query_params, 'status'):
+            try:
+                statuses.append(RewardStatus(status))
+            except ValueError:
+                raise APIError(400, f'invalid status {status!r}') from None
+        user_address = _get_param(query_params, 'user')
+        if user_address and not is_hex_address(user_address):
+            raise APIError(400, f'invalid user address {user_address!r}')
+        limit = _get_int_param(query_params, 'limit', DEFAULT_PAGE_SIZE)
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise APIError(400, f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        cursor = _get_int_param(query_params, 'cursor', None)
+
+        return partial(
+            get_rewards_page,
+            self.Session,
+            statuses=statuses,
+            user_address=user_address,
+            token_symbol=_get_param(query_params, 'token'),
+            cursor=cursor,
+            limit=limit,
+        )
+
+    def _reward_summary(self, query_params: QueryParams):
+        return partial(get_reward_summary, self.Session)
+
+    def _statistics(self, query_params: QueryParams):
+        return partial(
+            get_statistics,
+            self.Session,
+            since=_get_date_param(query_params, 'since'),
+            until=_get_date_param(query_params, 'until'),
+            token_symbol=_get_param(query_params, 'token'),
+        )
+
+    def _status(self, query_params: QueryParams):
+        return partial(get_rewarder_status, self.Session, str(self.config.account.address))
+
+    def _get_cached(self, cache_key: str, now: float) -> Optional[APIResponse]:
+        cached = self._cache.get(cache_key)
+        if cached is None:
+            return None
+        expires_at, response = cached
+        if expires_at <= now:
+            del self._cache[cache_key]
+            return None
+        self._cache.move_to_end(cache_key)
+        return response
+
+    def _set_cached(self, cache_key: str, response: APIResponse, now: float):
+        self._cache[cache_key] = (now + self.cache_seconds, response)
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > self.max_cached_responses:
+            self._cache.popitem(last=False)
+
+
+def add_api_routes(app, api: RewarderAPI):
+    """
+    Add the routes of the API to the Starlette app (of justpy)
+    """
+    from starlette.responses import Response
+    from starlette.routing import Route
+
+    async def endpoint(request):
+        response = await api.handle(
+            request.url.path,
+            request.query_params.multi_items(),
+            if_none_match=request.headers.get('if-none-match'),
+        )
+        return Response(
+            response.body,
+            status_code=response.status,
+            headers=response.headers,
+            media_type='application/json' if response.body else None,
+        )
+
+    # Before the catch-all route of justpy
+    for path in reversed(api.paths):
+        app.router.routes.insert(0, Route(path, endpoint, methods=['GET']))
+
+
+def _serialize_reward(row) -> Dict[str, Any]:
+    return {
+        'id': row.id,
+        'status': row.status.value,
+        'createdAt': row.created_at.isoformat() if row.created_at else None,
+        'sentAt': row.sent_at.isoformat() if row.sent_at else None,
+        'userAddress': row.user_address,
+        # Wei amounts as strings, as they don't fit in JSON numbers
+        'rewardRbtcWei': str(row.reward_rbtc_wei),
+        'rewardTransactionHash': row.reward_transaction_hash,
+        'depositTokenSymbol': row.deposit_side_token_symbol,
+        'depositAmountMinusFeesWei': str(row.deposit_amount_minus_fees_wei),
+        'depositTransactionHash': row.deposit_transaction_hash,
+        'depositLogIndex': row.deposit_log_index,
+        'depositContractAddress': row.deposit_contract_address,
+    }
+
+
+def _json_response(data: Any, *, cache_seconds: float) -> APIResponse:
+    body = json.dumps(data, separators=(',', ':')).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    return APIResponse(
+        status=200,
+        body=body,
+        headers={
+            'ETag': etag,
+            'Cache-Control': f'max-age={int(cache_seconds)}',
+        },
+    )
+
+
+def _error_response(status: int, message: str) -> APIResponse:
+    return APIResponse(status=status, body=json.dumps({'error': message}).encode())
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        # Weak comparison is fine for GET
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in ('*', etag):
+            return True
+    return False
+
+
+def _get_params(query_params: QueryParams, name: str) -> List[str]:
+    return [value for (key, value) in query_params if key == name]
+
+
+def _get_param(query_params: QueryParams, name: str) -> Optional[str]:
+    values = _get_params(query_params, name)
+    return values[-1] if values else None
+
+
+def _get_int_param(query_params: QueryParams, name: str, default: Optional[int]) -> Optional[int]:
+    value = _get_param(query_params, name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIError(400, f'invalid {name} {value!r}') from None
+
+
+def _get_date_param(query_params: QueryParams, name: str) -> Optional[date]:
+    value = _get_param(query_params, name)
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise APIError(400, f'invalid {name} {value!r}, expected YYYY-MM-DD') from None
@@ -0,0 +1,136 @@
+"""
+Data loading for the UI. The database calls are blocking, so they're run in a bounded thread pool, with
+timeouts, to keep the event loop (and the websockets of all viewers) responsive.
+
+The UI makes no RPC calls -- the state of the rewarder comes from the RewarderStatus snapshot it publishes.
+"""
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+import logging
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import sessionmaker
+
+from ..models import Reward, RewarderStatus
+from ..statistics import TokenStatistics, get_token_statistics
+
+logger = logging.getLogger(__name__)
+
+REWARD_COLUMNS = (
+    Reward.id,
+    Reward.created_at,
+    Reward.user_address,
+    Reward.deposit_amount_minus_fees_wei,
+    Reward.deposit_side_token_symbol,
+    Reward.reward_rbtc_wei,
+    Reward.status,
+    Reward.reward_transaction_hash,
+)
+
+
+class PageFingerprint(NamedTuple):
+    """
+    Cheap summary of the data shown on the page. The page only needs to be reloaded when this changes
+    """
+    status_updated_at: Optional[datetime]
+    max_reward_id: Optional[int]
+    last_reward_update: Optional[datetime]
+
+    def rewards_equal(self, other: 'PageFingerprint') -> bool:
+        return (self.max_reward_id, self.last_reward_update) == (other.max_reward_id, other.last_reward_update)
+
+
+def load_page_fingerprint(Session: sessionmaker, account_address: str) -> PageFingerprint:
+    with Session() as dbsession:
+        status_updated_at = dbsession.query(RewarderStatus.updated_at).filter_by(
+            account_address=account_address.lower()
+        ).scalar()
+        # Both use an index
+        max_reward_id = dbsession.query(func.max(Reward.id)).scalar()
+        last_reward_update = dbsession.query(func.max(Reward.updated_at)).scalar()
+    return PageFingerprint(
+        status_updated_at=status_updated_at,
+        max_reward_id=max_reward_id,
+        last_reward_update=last_reward_update,
+    )
+
+
+def load_rewarder_status(Session: sessionmaker, account_address: str) -> Optional[Row]:
+    """
+    Get the status snapshot published by the rewarder, or None if it hasn't completed a round yet
+    """
+    with Session() as dbsession:
+        return dbsession.query(*RewarderStatus.__table__.columns).filter_by(
+            account_address=account_address.lower()
+        ).one_or_none()
+
+
+def load_latest_rewards(Session: sessionmaker, *, num_rewards: int = 50) -> List[Row]:
+    # Plain rows instead of ORM objects, so that they can be used after the session is closed
+    with Session() as dbsession:
+        return dbsession.query(*REWARD_COLUMNS).order_by(
+            Reward.created_at.desc()
+        ).limit(num_rewards).all()
+
+
+def load_token_statistics(Session: sessionmaker) -> List[TokenStatistics]:
+    with Session() as dbsession:
+        return get_token_statistics(dbsession)
+
+
+def diff_rewards(
+    old_rewards: Dict[int, Row],
+    new_rewards: Iterable[Row],
+) -> Tuple[List[Row], List[Row], List[int]]:
+    """
+    Compare the shown rewards (by id) to the new ones. Returns the added rewards, the changed rewards and the ids
+    of the removed rewards.
+    """
+    added = []
+    changed = []
+    new_ids = set()
+    for reward in new_rewards:
+        new_ids.add(reward.id)
+        old_reward = old_rewards.get(reward.id)
+        if old_reward is None:
+            added.append(reward)
+        elif old_reward != reward:
+            changed.append(reward)
+    removed = [reward_id for reward_id in old_rewards if reward_id not in new_ids]
+    return added, changed, removed
+
+
+class BlockingCallRunner:
+    """
+    Runs blocking calls in a bounded thread pool and awaits them with a timeout.
+
+    A call that times out keeps running in its thread (threads cannot be interrupted). Until it finishes, further
+    calls with the same key wait for it instead of starting new ones, so that a slow database or RPC node cannot
+    fill the pool with duplicate calls.
+    """
+    def __init__(self, *, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ui-data')
+        self._pending: Dict[str, Future] = {}
+
+    async def call(self, key: str, func: Callable[..., Any], *args, timeout: float) -> Any:
+        """
+        Call func(*args) in the thread pool and return the result. Raises asyncio.TimeoutError if it takes longer
+        than timeout seconds.
+        """
+        future = self._pending.get(key)
+        if future is None or future.done():
+            future = self._executor.submit(func, *args)
+            self._pending[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # Shield, so that the timeout doesn't cancel the future shared by later calls
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+
+    def _forget(self, key: str, future: Future):
+        if self._pending.get(key) is future:
+            del self._pending[key]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -1,23 +1,33 @@
 from typing import List
+import logging
 
 import justpy as jp
 import time
 import asyncio
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from eth_utils import from_wei
-from web3 import Web3
 
 from ..config import Config
-from ..models import BlockInfo, Reward
+from ..database import init_read_sqlalchemy
+from .api import RewarderAPI, add_api_routes
+from .data import (
+    BlockingCallRunner,
+    diff_rewards,
+    load_latest_rewards,
+    load_page_fingerprint,
+    load_rewarder_status,
+    load_token_statistics,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def run_ui(config: Config):
-    engine = create_engine(config.db_url)
-    Session = sessionmaker(bind=engine)
-    web3 = Web3(Web3.HTTPProvider(config.rpc_url))
+    Session = init_read_sqlalchemy(config.db_url, db_read_url=config.db_read_url, profile=config.db_profile)
+    account_address = str(config.account.address).lower()
 
-    rbtc_balance = ''
+    ui_config = config.ui or {}
+    db_timeout = ui_config.get('dbTimeoutSeconds', 10)
+    runner = BlockingCallRunner(max_workers=ui_config.get('maxWorkers', 2))
 
     page = jp.WebPage(
         title="Sovryn Bridge Rewarder",
@@ -37,6 +47,25 @@ def run_ui(config: Config):
         a=main_content,
     )
 
+    jp.H2(
+        text="Paid rewards by token",
+        classes='text-2xl my-2 font-extrabold text-gray-900 tracking-tight',
+        a=main_content,
+    )
+    statistics_table = jp.parse_html("""
+    <table class="table-auto text-left w-full">
+        <thead>
+            <tr>
+                <th>token</th>
+                <th>rewards paid</th>
+                <th>RBTC paid</th>
+                <th>average deposit (-fees)</th>
+            </tr>
+        </thead>
+    </table>
+    """, a=main_content)
+    statistics_tbody = jp.Tbody(a=statistics_table)
+
     jp.H2(
         text="Latest given rewards",
         classes='text-2xl my-2 font-extrabold text-gray-900 tracking-tight',
@@ -58,112 +87,195 @@ def run_ui(config: Config):
     """, a=main_content)
     reward_tbody = jp.Tbody(a=reward_table)
 
+    # The static parts of the info panel are rendered once, the values are updated when they change
+    column1 = jp.parse_html(
+        f"""
+        <div class="column">
+            <div class="item">
+                <div class="key">Last processed block</div>
+                <div class="value" name="last_processed_block"></div>
+            </div>
+            <div class="item">
+                <div class="key">Chain head</div>
+                <div class="value" name="head_block"></div>
+            </div>
+            <div class="item">
+                <div class="key">Blocks behind</div>
+                <div class="value" name="backlog_blocks"></div>
+            </div>
+            <div class="item">
+                <div class="key">Rewarder account</div>
+                <div class="value">
+                    <a href="{config.explorer_url}/address/{account_address}" target="_blank">
+                        {account_address}
+                    </a>
+                </div>
+            </div>
+            <div class="item">
+                <div class="key">Rewarder balance</div>
+                <div class="value" name="rbtc_balance"></div>
+            </div>
+            <div class="item">
+                <div class="key">Gas price</div>
+                <div class="value" name="gas_price"></div>
+            </div>
+            <div class="item">
+                <div class="key">Rewards queued / sending / sent</div>
+                <div class="value" name="unfinished_rewards"></div>
+            </div>
+            <div class="item">
+                <div class="key">Last round</div>
+                <div class="value" name="last_round"></div>
+            </div>
+            <div class="item">
+                <div class="key">RPC Url</div>
+                <div class="value">
+                    {config.rpc_url}
+                </div>
+            </div>
+        </div>
+        """,
+        a=meta_info
+    )
+    status_values = column1.name_dict
+    for bridge_key, bridge_address in config.bridge_addresses.items():
+        jp.parse_html(f"""
+            <div class="item">
+                <div class="key">Bridge address ({bridge_key})</div>
+                <div class="value">
+                    <a href="{config.explorer_url}/address/{bridge_address}" target="_blank">
+                        {bridge_address}
+                    </a>
+                </div>
+            </div>
+        """, a=column1)
+    column2 = jp.Div(classes="column", a=meta_info)
+    for symbol, threshold in config.reward_thresholds.items():
+        item = jp.Div(classes="item", a=column2)
+        jp.Div(
+            text=f'{symbol} threshold',
+            classes="key",
+            a=item
+        )
+        jp.Div(
+            text=str(threshold),
+            classes="value",
+            a=item
+        )
+
+    page_fingerprint = None
+    shown_rewards = {}  # reward id -> row
+    reward_rows = {}  # reward id -> tr component
+
     async def update_page():
-        nonlocal rbtc_balance
+        nonlocal page_fingerprint
         try:
-            rbtc_balance_wei = web3.eth.get_balance(config.account.address)
-            rbtc_balance = from_wei(rbtc_balance_wei, 'ether')
-        except Exception:
-            pass
-        with Session.begin() as dbsession:
-            # TODO: the DB/Web3 calls should be async
-            last_processed_block = dbsession.query(BlockInfo.block_number).filter_by(
-                key='last_processed_block'
-            ).scalar()
-            latest_rewards = dbsession.query(Reward).order_by(
-                Reward.created_at.desc()
-            ).limit(50).all()
-
-            meta_info.delete_components()
-            column1 = jp.parse_html(
-                f"""
-                <div class="column">
-                    <div class="item">
-                        <div class="key">Last processed block</div>
-                        <div class="value">{last_processed_block}</div>
-                    </div>
-                    <div class="item">
-                        <div class="key">Rewarder account</div>
-                        <div class="value">
-                            <a href="{config.explorer_url}/address/{str(config.account.address).lower()}" target="_blank">
-                                {str(config.account.address).lower()}
-                            </a>
-                        </div>
-                    </div>
-                    <div class="item">
-                        <div class="key">Rewarder balance</div>
-                        <div class="value">
-                            {rbtc_balance} RBTC
-                        </div>
-                    </div>
-                    <div class="item">
-                        <div class="key">RPC Url</div>
-                        <div class="value">
-                            {config.rpc_url}
-                        </div>
-                    </div>
-                </div>
-                """,
-                a=meta_info
+            fingerprint = await runner.call(
+                'fingerprint', load_page_fingerprint, Session, account_address, timeout=db_timeout,
             )
-            for bridge_key, bridge_address in config.bridge_addresses.items():
-                jp.parse_html(f"""
-                    <div class="item">
-                        <div class="key">Bridge address ({bridge_key})</div>
-                        <div class="value">
-                            <a href="{config.explorer_url}/address/{bridge_address}" target="_blank">
-                                {bridge_address}
-                            </a>
-                        </div>
-                    </div>
-                """, a=column1)
-            column2 = jp.Div(classes="column", a=meta_info)
-            for symbol, threshold in config.reward_thresholds.items():
-                item = jp.Div(classes="item", a=column2)
-                jp.Div(
-                    text=f'{symbol} threshold',
-                    classes="key",
-                    a=item
+        except Exception as e:
+            logger.warning('Error loading the page fingerprint: %r', e)
+            return
+        if fingerprint == page_fingerprint:
+            return
+
+        changed = False
+        try:
+            if page_fingerprint is None or fingerprint.status_updated_at != page_fingerprint.status_updated_at:
+                status = await runner.call(
+                    'status', load_rewarder_status, Session, account_address, timeout=db_timeout,
                 )
-                jp.Div(
-                    text=str(threshold),
-                    classes="value",
-                    a=item
+                render_status(status)
+                changed = True
+            if page_fingerprint is None or not fingerprint.rewards_equal(page_fingerprint):
+                latest_rewards = await runner.call('rewards', load_latest_rewards, Session, timeout=db_timeout)
+                render_rewards(latest_rewards)
+                token_statistics = await runner.call(
+                    'statistics', load_token_statistics, Session, timeout=db_timeout,
                 )
+                render_statistics(token_statistics)
+                changed = True
+        except Exception as e:
+            # Keep showing the previous data, and try again next time
+            logger.warning('Error loading the page data: %r', e)
+        else:
+            page_fingerprint = fingerprint
+        if changed:
+            jp.run_task(page.update())
 
-            reward_tbody.delete_components()
-            for reward in latest_rewards:
-                rbtc_decimal = from_wei(reward.reward_rbtc_wei, 'ether')
-                # TODO: store this in the model (without fees)
-                deposit_amount_decimal = from_wei(reward.deposit_amount_minus_fees_wei, 'ether')
-
-                status_html = str(reward.status)
-                if reward.reward_transaction_hash:
-                    status_html = (
-                        f'<a target="_blank" href="{config.explorer_url}/tx/{reward.reward_transaction_hash}">'
-                        f'{status_html}</a>'
-                    )
-
-                user_address_html = (
-                    f'<a target="_blank" href="{config.explorer_url}/address/{reward.user_address}">'
-                    f'{reward.user_address}</a>'
-                )
+    def render_status(status):
+        if status is None:
+            for value in status_values.values():
+                value.text = '-'
+            return
+        status_values['last_processed_block'].text = str(status.last_processed_block)
+        status_values['head_block'].text = str(status.head_block)
+        status_values['backlog_blocks'].text = str(status.backlog_blocks)
+        status_values['rbtc_balance'].text = f'{from_wei(status.rbtc_balance_wei, "ether")} RBTC'
+        status_values['gas_price'].text = f'{from_wei(status.gas_price_wei, "gwei")} GWei'
+        status_values['unfinished_rewards'].text = (
+            f'{status.queued_rewards} / {status.sending_rewards} / {status.sent_rewards}'
+        )
+        status_values['last_round'].text = f'{status.updated_at} ({status.round_seconds:.1f} s)'
 
-                jp.parse_html(
-                    f"""
-                    <tr>
-                        <td>{reward.id}</td>
-                        <td>{reward.created_at}</td>
-                        <td>{user_address_html}</td>
-                        <td>{str(deposit_amount_decimal)} {reward.deposit_side_token_symbol}</td>
-                        <td>{str(rbtc_decimal)} RBTC</td>
-                        <td>{status_html}</td>
-                    </tr>
-                    """,
-                    a=reward_tbody
-                )
+    def render_statistics(token_statistics):
+        statistics_tbody.delete_components()
+        for t in token_statistics:
+            average_deposit = '-'
+            if t.average_deposit_wei is not None:
+                average_deposit = f'{from_wei(t.average_deposit_wei, "ether")} {t.deposit_side_token_symbol}'
+            jp.parse_html(
+                f"""
+                <tr>
+                    <td>{t.deposit_side_token_symbol}</td>
+                    <td>{t.rewards_paid}</td>
+                    <td>{from_wei(t.rbtc_paid_wei, "ether")} RBTC</td>
+                    <td>{average_deposit}</td>
+                </tr>
+                """,
+                a=statistics_tbody
+            )
 
-        jp.run_task(page.update())
+    def render_rewards(latest_rewards):
+        added, changed, removed = diff_rewards(shown_rewards, latest_rewards)
+        for reward_id in removed:
+            del shown_rewards[reward_id]
+            del reward_rows[reward_id]
+        for reward in added + changed:
+            shown_rewards[reward.id] = reward
+            reward_rows[reward.id] = render_reward_row(reward)
+        if added or changed or removed:
+            reward_tbody.components = [reward_rows[reward.id] for reward in latest_rewards]
+
+    def render_reward_row(reward):
+        rbtc_decimal = from_wei(reward.reward_rbtc_wei, 'ether')
+        # TODO: store this in the model (without fees)
+        deposit_amount_decimal = from_wei(reward.deposit_amount_minus_fees_wei, 'ether')
+
+        status_html = reward.status.value
+        if reward.reward_transaction_hash:
+            status_html = (
+                f'<a target="_blank" href="{config.explorer_url}/tx/{reward.reward_transaction_hash}">'
+                f'{status_html}</a>'
+            )
+
+        user_address_html = (
+            f'<a target="_blank" href="{config.explorer_url}/address/{reward.user_address}">'
+            f'{reward.user_address}</a>'
+        )
+
+        return jp.parse_html(
+            f"""
+            <tr>
+                <td>{reward.id}</td>
+                <td>{reward.created_at}</td>
+                <td>{user_address_html}</td>
+                <td>{str(deposit_amount_decimal)} {reward.deposit_side_token_symbol}</td>
+                <td>{str(rbtc_decimal)} RBTC</td>
+                <td>{status_html}</td>
+            </tr>
+            """
+        )
 
     async def startup():
         async def updater():
@@ -176,7 +288,15 @@ def run_ui(config: Config):
     async def app():
         return page
 
-    ui_config = config.ui or {}
+    api = RewarderAPI(
+        Session=Session,
+        config=config,
+        runner=runner,
+        timeout=db_timeout,
+        cache_seconds=ui_config.get('apiCacheSeconds', 5),
+    )
+    add_api_routes(jp.app, api)
+
     host = ui_config.get('host', "0.0.0.0")
     port = ui_config.get('port', 8000)
     jp.justpy(app, startup=startup, host=host, port=port)
@@ -4,17 +4,21 @@ import json
 import logging
 import os
 from time import sleep
-from typing import Dict, Any, Union
+from typing import Dict, Any, Iterable, List, NamedTuple, Union
 
 from eth_abi import decode_single
 from eth_abi.exceptions import DecodingError
-from eth_typing import AnyAddress
-from eth_utils import to_checksum_address, to_hex
+from eth_typing import AnyAddress, ChecksumAddress
+from eth_utils import event_abi_to_log_topic, to_checksum_address, to_hex
 from web3 import Web3
+from web3._utils.method_formatters import log_entry_formatter
 from web3.contract import Contract, ContractEvent
 
+from .metrics import RETRIES, RPC_ERRORS, time_stage
+
 THIS_DIR = os.path.dirname(__file__)
 logger = logging.getLogger(__name__)
+ADDRESS_CACHE_SIZE = 4096  # the rewarder deals with a few addresses over and over, plus one or two per deposit
 
 
 def utcnow() -> datetime:
@@ -26,11 +30,39 @@ def load_abi(name: str) -> Dict[str, Any]:
         return json.load(f)
 
 
+class CanonicalAddress(NamedTuple):
+    checksummed: ChecksumAddress  # for web3
+    lower: str  # for the database and comparisons
+
+
+def canonical_address(a: Union[bytes, str]) -> CanonicalAddress:
+    """
+    Get the checksummed and lowercase forms of an address. Checksumming takes a keccak hash, so the results are
+    memoized (by the lowercase address, for strings)
+    """
+    if isinstance(a, str):
+        a = a.lower()
+    return _canonical_address(a)
+
+
+@functools.lru_cache(maxsize=ADDRESS_CACHE_SIZE)
+def _canonical_address(a: Union[bytes, str]) -> CanonicalAddress:
+    checksummed = to_checksum_address(a)
+    return CanonicalAddress(checksummed=checksummed, lower=checksummed.lower())
+
+
 def address(a: Union[bytes, str]) -> AnyAddress:
     # Web3.py expects checksummed addresses, but has no support for EIP-1191,
     # so RSK-checksummed addresses are broken
     # Should instead fix web3, but meanwhile this wrapper will help us
-    return to_checksum_address(a)
+    return canonical_address(a).checksummed
+
+
+def lower_address(a: Union[bytes, str]) -> str:
+    """
+    Get the lowercase hex form of an address, as stored in the database
+    """
+    return canonical_address(a).lower
 
 
 # Alias, better name...
@@ -48,6 +80,7 @@ def get_erc20_contract(*, token_address: Union[str, AnyAddress], web3: Web3) ->
 ERC20_ABI = load_abi('IERC20.json')
 
 
+@time_stage('get_events')
 def get_events(
     *,
     event: ContractEvent,
@@ -56,19 +89,10 @@ def get_events(
     batch_size: int = 100
 ):
     """Load events in batches"""
-    if to_block < from_block:
-        raise ValueError(f'to_block {to_block} is smaller than from_block {from_block}')
-
     logger.info('fetching events from %s to %s with batch size %s', from_block, to_block, batch_size)
     ret = []
-    batch_from_block = from_block
-    while batch_from_block <= to_block:
-        batch_to_block = min(batch_from_block + batch_size, to_block)
+    for batch_from_block, batch_to_block in _get_batches(from_block, to_block, batch_size):
         logger.info('fetching batch from %s to %s (up to %s)', batch_from_block, batch_to_block, to_block)
-        event_filter = event.createFilter(
-            fromBlock=batch_from_block,
-            toBlock=batch_to_block,
-        )
         events = get_event_batch_with_retries(
             event=event,
             from_block=batch_from_block,
@@ -77,24 +101,85 @@ def get_events(
         if len(events) > 0:
             logger.info(f'found %s events in batch', len(events))
         ret.extend(events)
-        batch_from_block = batch_to_block + 1
     return ret
 
 
+@time_stage('get_events')
+def get_raw_logs(
+    *,
+    web3: Web3,
+    event: ContractEvent,
+    contract_address: str,
+    from_block: int,
+    to_block: int,
+    batch_size: int = 100
+) -> List[Dict[str, Any]]:
+    """Load the logs of the event emitted by the contract in batches, without decoding them"""
+    logger.info('fetching logs from %s to %s with batch size %s', from_block, to_block, batch_size)
+    topic = get_event_topic(event)
+    ret = []
+    for batch_from_block, batch_to_block in _get_batches(from_block, to_block, batch_size):
+        logger.info('fetching batch from %s to %s (up to %s)', batch_from_block, batch_to_block, to_block)
+        logs = _get_logs_with_retries(
+            lambda: web3.eth.get_logs({
+                'address': to_address(contract_address),
+                'topics': [topic],
+                'fromBlock': batch_from_block,
+                'toBlock': batch_to_block,
+            })
+        )
+        if len(logs) > 0:
+            logger.info(f'found %s logs in batch', len(logs))
+        ret.extend(logs)
+    return ret
+
+
+def _get_batches(from_block: int, to_block: int, batch_size: int):
+    if to_block < from_block:
+        raise ValueError(f'to_block {to_block} is smaller than from_block {from_block}')
+    batch_from_block = from_block
+    while batch_from_block <= to_block:
+        batch_to_block = min(batch_from_block + batch_size, to_block)
+        yield batch_from_block, batch_to_block
+        batch_from_block = batch_to_block + 1
+
+
 def get_event_batch_with_retries(event, from_block, to_block, *, retries=3):
+    return _get_logs_with_retries(
+        lambda: event.getLogs(
+            fromBlock=from_block,
+            toBlock=to_block,
+        ),
+        retries=retries,
+    )
+
+
+def _get_logs_with_retries(get_logs, *, retries=3):
     while True:
         try:
-            return event.getLogs(
-                fromBlock=from_block,
-                toBlock=to_block,
-            )
+            return get_logs()
         except ValueError as e:
+            RPC_ERRORS.labels(function='getLogs').inc()
             if retries <= 0:
                 raise e
             logger.warning('error in get_all_entries: %s, retrying (%s)', e, retries)
+            RETRIES.labels(function='getLogs').inc()
             retries -= 1
 
 
+def get_event_topic(event: ContractEvent) -> str:
+    """Get the topic (signature hash) of the event as a hex string"""
+    return to_hex(event_abi_to_log_topic(event._get_event_abi()))
+
+
+def decode_logs(*, event: ContractEvent, raw_logs: Iterable[Dict[str, Any]]):
+    """Decode raw JSON-RPC logs into events, like the ones returned by getLogs"""
+    return [
+        event().processLog(log_entry_formatter(raw_log))
+        for raw_log in raw_logs
+    ]
+
+
 def exponential_sleep(attempt, max_sleep_time=256.0):
     sleep_time = min(2 ** attempt, max_sleep_time)
     sleep(sleep_time)
@@ -109,6 +194,7 @@ def retryable(*, max_attempts: int = 10):
                 try:
                     return func(*args, **kwargs)
                 except Exception as e:
+                    RPC_ERRORS.labels(function=func.__name__).inc()
                     if attempt >= max_attempts:
                         logger.warning('max attempts (%s) exchusted for error: %s', max_attempts, e)
                         raise
@@ -119,6 +205,7 @@ def retryable(*, max_attempts: int = 10):
                         e,
                     )
                     exponential_sleep(attempt)
+                    RETRIES.labels(function=func.__name__).inc()
                     attempt += 1
         return wrapped
     return decorator
@@ -0,0 +1,165 @@
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from eth_account import Account
+from web3 import Web3
+
+from benchmarks.fake_chain import FakeChain, FakeChainProvider, make_address
+from sovryn_bridge_rewarder import backfill as backfill_module
+from sovryn_bridge_rewarder.backfill import backfill, split_range
+from sovryn_bridge_rewarder.config import Config, RewardThresholdMap
+from sovryn_bridge_rewarder.database import init_sqlalchemy
+from sovryn_bridge_rewarder.deposits import get_side_token
+from sovryn_bridge_rewarder.main import (
+    get_bridge_contract,
+    get_start_block,
+    process_new_deposits,
+    update_last_processed_block,
+)
+from sovryn_bridge_rewarder.models import Reward, ScannedWindow
+from sovryn_bridge_rewarder.utils import is_contract
+
+BRIDGE_ADDRESS = make_address('bridge')
+MAIN_TOKEN_ADDRESS = make_address('main token')
+
+
+@pytest.fixture
+def chain() -> FakeChain:
+    get_side_token.cache_clear()
+    is_contract.cache_clear()
+    chain = FakeChain()
+    chain.add_side_token(
+        bridge_address=BRIDGE_ADDRESS,
+        main_token_address=MAIN_TOKEN_ADDRESS,
+        side_token_address=make_address('side token'),
+        symbol='DAIbs',
+    )
+    for i in range(50):
+        chain.mine_block()
+        chain.add_deposit(
+            bridge_address=BRIDGE_ADDRESS,
+            main_token_address=MAIN_TOKEN_ADDRESS,
+            to=make_address(f'user {i % 40}'),  # some users deposit twice
+            amount_wei=100 * 10**18,
+            block_number=chain.head,
+        )
+    return chain
+
+
+@pytest.fixture
+def config() -> Config:
+    return Config(
+        bridge_addresses={'DAI': BRIDGE_ADDRESS},
+        rpc_url='http://localhost:4444',
+        db_url='sqlite://',
+        default_start_block=1,
+        required_block_confirmations=2,
+        reward_rbtc=Decimal('0.0001'),
+        reward_thresholds=RewardThresholdMap({'DAIbs': Decimal('1')}),
+        account=Account.create(),
+    )
+
+
+def _backfill(chain, config, database, **kwargs):
+    web3 = Web3(FakeChainProvider(chain))
+    return backfill(
+        web3=web3,
+        bridge_contracts={'DAI': get_bridge_contract(bridge_address=BRIDGE_ADDRESS, web3=web3)},
+        DBSession=database,
+        config=config,
+        **kwargs,
+    )
+
+
+def test_split_range():
+    assert split_range(1, 10, 4) == [(1, 4), (5, 8), (9, 10)]
+    assert split_range(5, 5, 100) == [(5, 5)]
+    with pytest.raises(ValueError):
+        split_range(1, 10, 0)
+
+
+def test_backfill_queues_rewards_and_moves_checkpoint(chain, config, database):
+    result = _backfill(chain, config, database, from_block=1, to_block=50, chunk_size=7, workers=3)
+    assert result.num_deposits == 50
+    assert result.num_queued == 40
+    assert result.checkpoint_updated
+    with database.begin() as dbsession:
+        assert dbsession.query(Reward).count() == 40
+        assert get_start_block(dbsession, config.default_start_block) == 51
+        assert dbsession.query(ScannedWindow.to_block).scalar() == 50
+
+
+def test_backfill_is_idempotent(chain, config, database):
+    _backfill(chain, config, database, from_block=1, to_block=30, chunk_size=7)
+    result = _backfill(chain, config, database, from_block=1, to_block=50, chunk_size=5)
+    assert result.num_queued == 10
+    with database.begin() as dbsession:
+        assert dbsession.query(Reward).count() == 40
+
+
+def test_backfill_dry_run(chain, config, database):
+    result = _backfill(chain, config, database, from_block=1, to_block=50, chunk_size=7, dry_run=True)
+    assert result.num_queued == 40
+    assert not result.checkpoint_updated
+    with database.begin() as dbsession:
+        assert dbsession.query(Reward).count() == 0
+        assert get_start_block(dbsession, config.default_start_block) == 1
+
+
+def test_backfill_dry_run_does_not_lock_the_database(chain, config, tmp_path):
+    # Rewards already in the database are taken into account, and the database stays writable during the dry run
+    # (the chunks are scanned in a worker thread, with another connection)
+    database = init_sqlalchemy(f'sqlite:///{tmp_path / "db.sqlite3"}', create_models=True)
+    _backfill(chain, config, database, from_block=1, to_block=20)
+    web3 = Web3(FakeChainProvider(chain))
+    original_get_deposits = backfill_module.get_deposits
+
+    def get_deposits(**kwargs):
+        with database.begin() as dbsession:
+            update_last_processed_block(dbsession, kwargs['to_block'])
+        return original_get_deposits(**kwargs)
+
+    with mock.patch.object(backfill_module, 'get_deposits', get_deposits):
+        result = backfill(
+            web3=web3,
+            bridge_contracts={'DAI': get_bridge_contract(bridge_address=BRIDGE_ADDRESS, web3=web3)},
+            DBSession=database,
+            config=config,
+            from_block=1,
+            to_block=50,
+            chunk_size=7,
+            workers=1,
+            dry_run=True,
+        )
+    assert result.num_queued == 20
+    with database.begin() as dbsession:
+        assert dbsession.query(Reward).count() == 20
+
+
+def test_backfill_does_not_leave_gaps(chain, config, database):
+    with database.begin() as dbsession:
+        update_last_processed_block(dbsession, 10)
+    result = _backfill(chain, config, database, from_block=20, to_block=50)
+    assert result.num_queued == 31
+    assert not result.checkpoint_updated
+    with database.begin() as dbsession:
+        assert get_start_block(dbsession, config.default_start_block) == 11
+
+
+def test_backfill_alongside_rewarder(chain, config, database):
+    # The rewarder round starts from block 1, and a backfill of the same blocks finishes before it
+    web3 = Web3(FakeChainProvider(chain))
+    _backfill(chain, config, database, from_block=1, to_block=48)
+    start_block = process_new_deposits(
+        web3=web3,
+        bridge_contracts={'DAI': get_bridge_contract(bridge_address=BRIDGE_ADDRESS, web3=web3)},
+        DBSession=database,
+        config=config,
+        start_block=1,
+    )
+    assert start_block == 49
+    with database.begin() as dbsession:
+        # Each user is rewarded once, and the last processed block is not moved back
+        assert dbsession.query(Reward).count() == 40
+        assert get_start_block(dbsession, config.default_start_block) == 49
@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import text
+
+from sovryn_bridge_rewarder.database import (
+    STORAGE_PROFILES,
+    create_db_engine,
+    get_engine_options,
+    get_storage_profile,
+    init_read_sqlalchemy,
+    init_sqlalchemy,
+)
+from sovryn_bridge_rewarder.models import BlockInfo, Reward
+
+
+def test_sqlite_pragmas(tmp_path):
+    engine = create_db_engine(f'sqlite:///{tmp_path}/test.sqlite3')
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert connection.execute(text('PRAGMA synchronous')).scalar() == 1  # normal
+        assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 10_000
+
+
+def test_sqlite_in_memory():
+    DBSession = init_sqlalchemy('sqlite://')
+    with DBSession.begin() as dbsession:
+        assert dbsession.query(Reward).count() == 0
+        assert dbsession.execute(text('PRAGMA journal_mode')).scalar() == 'memory'
+
+
+def test_legacy_profile(tmp_path):
+    engine = create_db_engine(f'sqlite:///{tmp_path}/test.sqlite3', profile='legacy')
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'delete'
+
+
+def test_postgresql_options():
+    options = get_engine_options('postgresql://user@localhost/rewarder', STORAGE_PROFILES['default'])
+    assert options['pool_size'] == 5
+    assert options['pool_pre_ping'] is True
+    assert options['connect_args'] == {'options': '-c statement_timeout=60000'}
+    assert 'execution_options' not in options
+
+    options = get_engine_options('postgresql+psycopg2://user@localhost/rewarder', STORAGE_PROFILES['reporting'])
+    assert options['execution_options'] == {'stream_results': True}
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        get_storage_profile('turbo')
+
+
+def test_read_session_uses_read_url(tmp_path):
+    primary_url = f'sqlite:///{tmp_path}/primary.sqlite3'
+    replica_url = f'sqlite:///{tmp_path}/replica.sqlite3'
+    init_sqlalchemy(primary_url)
+    init_sqlalchemy(replica_url)
+    ReadSession = init_read_sqlalchemy(primary_url, db_read_url=replica_url)
+    assert str(ReadSession.kw['bind'].url) == replica_url
+
+    ReadSession = init_read_sqlalchemy(primary_url, db_read_url='')
+    assert str(ReadSession.kw['bind'].url) == primary_url
+
+
+def test_read_session_prevents_writes(tmp_path):
+    db_url = f'sqlite:///{tmp_path}/test.sqlite3'
+    init_sqlalchemy(db_url)
+    ReadSession = init_read_sqlalchemy(db_url)
+    with ReadSession() as dbsession:
+        assert dbsession.query(BlockInfo).count() == 0
+        dbsession.add(BlockInfo(key='last_processed_block', block_number=1))
+        with pytest.raises(RuntimeError):
+            dbsession.flush()
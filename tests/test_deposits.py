@@ -0,0 +1,60 @@
+from decimal import Decimal
+
+import pytest
+from hexbytes import HexBytes
+
+from sovryn_bridge_rewarder.deposits import Deposit, intern_deposit_token
+from .test_rewards import DAIBS_TOKEN, EXAMPLE_DEPOSIT
+
+
+def test_deposit_is_compact():
+    assert not hasattr(EXAMPLE_DEPOSIT, '__dict__')
+    with pytest.raises(AttributeError):
+        EXAMPLE_DEPOSIT.event = None
+
+
+def test_deposit_values_are_hex_strings():
+    deposit = EXAMPLE_DEPOSIT.replace(
+        user_address='0xCa478e11953FE327B46Dd71DD9fd31C92DC9A9Ae',
+        transaction_hash=HexBytes(EXAMPLE_DEPOSIT.transaction_hash),
+    )
+    assert deposit == EXAMPLE_DEPOSIT
+    assert deposit.user_address == '0xca478e11953fe327b46dd71dd9fd31c92dc9a9ae'
+    assert deposit.transaction_hash == '0x05f16236ee5ca06311f4a014b9fcaa40a32389c6c95b86267ab0bfcbc5616972'
+    assert deposit.side_token_symbol == 'DAIbs'
+    assert deposit.contract_address == DAIBS_TOKEN.contract_address
+    assert deposit.amount_decimal == Decimal('30')
+    assert deposit.as_dict()['block_hash'] == EXAMPLE_DEPOSIT.block_hash
+    assert repr(deposit).startswith("Deposit(user_address='0xca478e11953fe327b46dd71dd9fd31c92dc9a9ae', ")
+
+
+def test_deposit_changes():
+    assert EXAMPLE_DEPOSIT.replace(log_index=4) != EXAMPLE_DEPOSIT
+    with pytest.raises(ValueError):
+        EXAMPLE_DEPOSIT.replace(block_hash='0x1234')
+
+
+def test_deposit_tokens_are_interned():
+    values = dict(
+        side_token_address=DAIBS_TOKEN.side_token_address,
+        side_token_symbol=DAIBS_TOKEN.side_token_symbol,
+        main_token_address=DAIBS_TOKEN.main_token_address,
+        contract_address=DAIBS_TOKEN.contract_address,
+        fee_percentage=DAIBS_TOKEN.fee_percentage,
+    )
+    token = intern_deposit_token(**values)
+    assert token == DAIBS_TOKEN
+    assert intern_deposit_token(**values) is token
+    assert intern_deposit_token(**dict(values, decimals=6)) is not token
+    deposits = [
+        Deposit(
+            token=intern_deposit_token(**values),
+            user_address=EXAMPLE_DEPOSIT.user_address,
+            amount_minus_fees_wei=EXAMPLE_DEPOSIT.amount_minus_fees_wei,
+            block_hash=EXAMPLE_DEPOSIT.block_hash,
+            transaction_hash=EXAMPLE_DEPOSIT.transaction_hash,
+            log_index=log_index,
+        )
+        for log_index in range(3)
+    ]
+    assert all(deposit.token is token for deposit in deposits)
@@ -0,0 +1,113 @@
+import csv
+from datetime import datetime, timezone
+import gzip
+
+import pytest
+
+from sovryn_bridge_rewarder.export import EXPORT_COLUMN_NAMES, export_rewards, get_export_format
+from sovryn_bridge_rewarder.models import Reward, RewardStatus
+
+
+def _add_rewards(database):
+    with database.begin() as dbsession:
+        for i, (status, symbol, day) in enumerate([
+            (RewardStatus.confirmed, 'DAIbs', 1),
+            (RewardStatus.confirmed, 'ETHbs', 2),
+            (RewardStatus.sent, 'DAIbs', 3),
+            (RewardStatus.queued, 'DAIbs', 31),
+        ], start=1):
+            dbsession.add(Reward(
+                status=status,
+                reward_rbtc_wei=100000000000000,
+                user_address=f'0x{i:040x}',
+                deposit_side_token_address='0x081d4aa03ac5cdaf2b758306a259e1bd0896c0ca',
+                deposit_side_token_symbol=symbol,
+                deposit_main_token_address='0x83241490517384cb28382bdd4d1534ee54d9350f',
+                deposit_amount_minus_fees_wei=123 * 10**24 + i,
+                deposit_log_index=i,
+                deposit_block_number=100 + i,
+                deposit_block_hash='0x' + '11' * 32,
+                deposit_transaction_hash='0x' + f'{i:064x}',
+                deposit_contract_address='0x8e7199d5f496ea862492f4f983a1627d723328fd',
+                created_at=datetime(2021, 5, day, tzinfo=timezone.utc),
+            ))
+
+
+def test_export_csv(database, tmp_path):
+    _add_rewards(database)
+    path = str(tmp_path / 'rewards.csv')
+    assert export_rewards(DBSession=database, path=path, chunk_size=3) == 4
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        assert next(reader) == EXPORT_COLUMN_NAMES
+    assert EXPORT_COLUMN_NAMES == [
+        'id',
+        'status',
+        'created_at',
+        'sent_at',
+        'updated_at',
+        'user_address',
+        'reward_rbtc_wei',
+        'reward_transaction_hash',
+        'reward_transaction_nonce',
+        'deposit_side_token_symbol',
+        'deposit_side_token_address',
+        'deposit_main_token_address',
+        'deposit_amount_minus_fees_wei',
+        'deposit_transaction_hash',
+        'deposit_log_index',
+        'deposit_block_number',
+        'deposit_block_hash',
+        'deposit_contract_address',
+    ]
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['id'] for row in rows] == ['1', '2', '3', '4']
+    assert rows[0]['status'] == 'confirmed'
+    assert rows[0]['deposit_block_number'] == '101'
+    assert rows[0]['updated_at']
+    assert rows[0]['deposit_amount_minus_fees_wei'] == str(123 * 10**24 + 1)
+
+
+def test_export_csv_gz_with_filters(database, tmp_path):
+    _add_rewards(database)
+    path = str(tmp_path / 'rewards.csv.gz')
+    num_rows = export_rewards(
+        DBSession=database,
+        path=path,
+        statuses=[RewardStatus.confirmed, RewardStatus.sent],
+        token_symbols=['DAIbs'],
+        created_since=datetime(2021, 5, 1, tzinfo=timezone.utc),
+        created_before=datetime(2021, 6, 1, tzinfo=timezone.utc),
+    )
+    assert num_rows == 2
+    with gzip.open(path, 'rt', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['id'], row['status']) for row in rows] == [('1', 'confirmed'), ('3', 'sent')]
+
+    num_rows = export_rewards(
+        DBSession=database,
+        path=path,
+        created_since=datetime(2021, 5, 2, tzinfo=timezone.utc),
+        created_before=datetime(2021, 5, 31, tzinfo=timezone.utc),
+    )
+    assert num_rows == 2
+
+
+def test_export_format():
+    assert get_export_format('rewards.csv') == 'csv'
+    assert get_export_format('rewards.csv.gz') == 'csv.gz'
+    assert get_export_format('rewards.parquet') == 'parquet'
+    with pytest.raises(ValueError):
+        get_export_format('rewards.xlsx')
+
+
+def test_export_parquet(database, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    _add_rewards(database)
+    path = str(tmp_path / 'rewards.parquet')
+    assert export_rewards(DBSession=database, path=path, chunk_size=3) == 4
+    table = parquet.read_table(path)
+    assert table.column_names == EXPORT_COLUMN_NAMES
+    assert table.column('id').to_pylist() == [1, 2, 3, 4]
+    assert table.column('deposit_amount_minus_fees_wei').to_pylist()[0] == str(123 * 10**24 + 1)
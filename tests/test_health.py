@@ -0,0 +1,131 @@
+import json
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from sovryn_bridge_rewarder.health import HealthMonitor, HealthThresholds, start_health_server
+from sovryn_bridge_rewarder.models import RewardStatus
+from sovryn_bridge_rewarder.rpc import RPCStats
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def rpc_stats() -> RPCStats:
+    return RPCStats()
+
+
+@pytest.fixture
+def monitor(clock, rpc_stats) -> HealthMonitor:
+    return HealthMonitor(
+        thresholds=HealthThresholds(liveness_max_seconds=60, readiness_max_seconds=30, max_backlog_blocks=10),
+        rpc_stats=rpc_stats,
+        clock=clock,
+    )
+
+
+def _succeed(monitor, *, backlog=0, reward_counts=None):
+    monitor.round_succeeded(current_block=100, backlog=backlog, reward_counts=reward_counts or {})
+
+
+def test_thresholds_from_monitoring_config():
+    thresholds = HealthThresholds.from_monitoring_config({'port': 9100, 'maxBacklogBlocks': 5, 'maxSentRewards': 3})
+    assert thresholds.max_backlog_blocks == 5
+    assert thresholds.max_sent_rewards == 3
+    assert thresholds.liveness_max_seconds == HealthThresholds.liveness_max_seconds
+
+
+def test_not_ready_before_first_round(monitor, clock):
+    assert monitor.check_liveness().ok
+    assert not monitor.check_readiness().ok
+    clock.now += 61
+    assert not monitor.check_liveness().ok
+
+
+def test_ready_after_successful_round(monitor, clock):
+    _succeed(monitor, backlog=3, reward_counts={RewardStatus.queued: 2})
+    report = monitor.check_readiness()
+    assert report.ok
+    assert report.details['backlog_blocks'] == 3
+    assert report.details['rewards'] == {'queued': 2, 'sending': 0, 'sent': 0}
+
+
+def test_failed_rounds_are_live_but_not_ready(monitor, clock):
+    _succeed(monitor)
+    clock.now += 31
+    monitor.round_failed(ValueError('node down'))
+    assert monitor.check_liveness().ok
+    report = monitor.check_readiness()
+    assert not report.ok
+    assert report.checks['round_succeeded'] is False
+    assert report.details['last_error'] == "ValueError('node down')"
+
+
+def test_stuck_loop_is_not_live(monitor, clock):
+    _succeed(monitor)
+    clock.now += 61
+    report = monitor.check_liveness()
+    assert not report.ok
+    assert report.details['seconds_since_last_round'] == 61
+
+
+@pytest.mark.parametrize('backlog, reward_counts, failed_check', [
+    (11, {}, 'backlog'),
+    (0, {RewardStatus.queued: 101}, 'queued_rewards'),
+    (0, {RewardStatus.sending: 1}, 'sending_rewards'),
+    (0, {RewardStatus.sent: 51}, 'sent_rewards'),
+])
+def test_readiness_thresholds(monitor, backlog, reward_counts, failed_check):
+    _succeed(monitor, backlog=backlog, reward_counts=reward_counts)
+    report = monitor.check_readiness()
+    assert not report.ok
+    assert [name for name, ok in report.checks.items() if not ok] == [failed_check]
+
+
+def test_readiness_checks_rpc_errors(monitor, rpc_stats):
+    _succeed(monitor)
+    for _ in range(5):
+        rpc_stats.record('eth_blockNumber', seconds=0.1, error=True)
+    report = monitor.check_readiness()
+    assert not report.checks['rpc']
+    assert report.details['rpc_consecutive_errors'] == 5
+
+    rpc_stats.record('eth_blockNumber', seconds=0.1, error=False)
+    assert monitor.check_readiness().ok
+
+
+def test_health_server(monitor):
+    server = start_health_server(monitor, host='127.0.0.1', port=0)
+    base_url = 'http://127.0.0.1:%s' % server.server_address[1]
+    try:
+        with urlopen(base_url + '/healthz') as response:
+            assert response.status == 200
+            assert json.load(response)['ok'] is True
+
+        with pytest.raises(HTTPError) as exc_info:
+            urlopen(base_url + '/readyz')
+        assert exc_info.value.code == 503
+        assert json.load(exc_info.value)['checks']['round_succeeded'] is False
+
+        _succeed(monitor)
+        with urlopen(base_url + '/readyz') as response:
+            assert response.status == 200
+
+        with pytest.raises(HTTPError) as exc_info:
+            urlopen(base_url + '/metrics')
+        assert exc_info.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,199 @@
+from decimal import Decimal
+import gzip
+import json
+import multiprocessing
+import os
+
+import pytest
+from web3 import Web3
+
+from benchmarks.fake_chain import FakeChain, FakeChainProvider, make_address
+from sovryn_bridge_rewarder.deposits import get_deposits, get_side_token
+from sovryn_bridge_rewarder import log_archive
+from sovryn_bridge_rewarder.log_archive import LogArchive
+from sovryn_bridge_rewarder.main import get_bridge_contract
+from sovryn_bridge_rewarder.rpc import RPCStats, rpc_stats_middleware
+from sovryn_bridge_rewarder.utils import is_contract
+from .test_subscriptions import BRIDGE_ADDRESS, make_raw_log
+
+
+@pytest.fixture
+def archive(tmp_path) -> LogArchive:
+    return LogArchive(str(tmp_path), segment_blocks=100)
+
+
+def test_add_and_get_logs(archive):
+    logs = [make_raw_log(block_number=n, log_index=0) for n in (10, 150, 250)]
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=300, logs=logs)
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=300) == logs
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=100, to_block=200) == [logs[1]]
+    assert archive.get_logs(address=BRIDGE_ADDRESS.upper(), from_block=251, to_block=300) == []
+
+
+def test_missing_ranges(archive):
+    assert archive.get_missing_ranges(address=BRIDGE_ADDRESS, from_block=1, to_block=100) == [(1, 100)]
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=10, to_block=20, logs=[])
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=21, to_block=30, logs=[])
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=50, to_block=60, logs=[])
+    assert archive.get_missing_ranges(address=BRIDGE_ADDRESS, from_block=1, to_block=100) == [
+        (1, 9), (31, 49), (61, 100),
+    ]
+    assert archive.get_missing_ranges(address=BRIDGE_ADDRESS, from_block=15, to_block=55) == [(31, 49)]
+    assert archive.is_covered(address=BRIDGE_ADDRESS, from_block=10, to_block=30)
+    assert not archive.is_covered(address=make_address('other'), from_block=10, to_block=30)
+
+
+def test_persists_and_deduplicates(tmp_path, archive):
+    log = make_raw_log(block_number=10, log_index=1)
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=20, logs=[log])
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=20, logs=[log])
+
+    reopened = LogArchive(str(tmp_path), segment_blocks=100)
+    assert reopened.is_covered(address=BRIDGE_ADDRESS, from_block=1, to_block=20)
+    assert reopened.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=20) == [log]
+
+
+def test_rejects_logs_outside_range(archive):
+    with pytest.raises(ValueError):
+        archive.add_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=5, logs=[make_raw_log(block_number=10)])
+
+
+def test_truncate(archive):
+    logs = [make_raw_log(block_number=n, log_index=0) for n in (10, 110, 120)]
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=200, logs=logs)
+    archive.truncate(115)
+    assert archive.get_missing_ranges(address=BRIDGE_ADDRESS, from_block=1, to_block=200) == [(115, 200)]
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=200) == logs[:2]
+    archive.truncate(50)
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=200) == logs[:1]
+
+
+def test_changes_by_other_instances_are_seen(tmp_path, archive):
+    # E.g. a backfill process archiving logs while the rewarder runs
+    other = LogArchive(str(tmp_path), segment_blocks=100)
+    assert not archive.is_covered(address=BRIDGE_ADDRESS, from_block=1, to_block=20)
+    log = make_raw_log(block_number=10, log_index=1)
+    other.add_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=20, logs=[log])
+    assert archive.is_covered(address=BRIDGE_ADDRESS, from_block=1, to_block=20)
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=20) == [log]
+    other.truncate(5)
+    assert not archive.is_covered(address=BRIDGE_ADDRESS, from_block=1, to_block=20)
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=20) == []
+
+
+def _add_logs_in_process(directory, first_block, num_blocks):
+    archive = LogArchive(directory, segment_blocks=100)
+    for n in range(first_block, first_block + num_blocks):
+        archive.add_logs(address=BRIDGE_ADDRESS, from_block=n, to_block=n, logs=[
+            make_raw_log(block_number=n, log_index=0),
+        ])
+
+
+def test_concurrent_writes_from_processes(tmp_path, archive):
+    processes = [
+        multiprocessing.Process(target=_add_logs_in_process, args=(str(tmp_path), first_block, 50))
+        for first_block in (0, 50, 100, 150)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+    assert archive.is_covered(address=BRIDGE_ADDRESS, from_block=0, to_block=199)
+    assert [
+        int(log['blockNumber'], 16) for log in archive.get_logs(address=BRIDGE_ADDRESS, from_block=0, to_block=199)
+    ] == list(range(200))
+
+
+def test_reads_only_members_in_range(archive):
+    for n in range(10, 50, 10):
+        archive.add_logs(address=BRIDGE_ADDRESS, from_block=n, to_block=n + 9, logs=[
+            make_raw_log(block_number=n, log_index=0),
+        ])
+    assert len(archive._read_members(BRIDGE_ADDRESS.lower(), 0, from_block=25, to_block=35)) == 1
+    assert [
+        int(log['blockNumber'], 16) for log in archive.get_logs(address=BRIDGE_ADDRESS, from_block=25, to_block=35)
+    ] == [30]
+
+
+def test_full_segment_is_compacted(tmp_path, monkeypatch):
+    monkeypatch.setattr(log_archive, 'COMPACTED_MEMBERS_PER_SEGMENT', 10)
+    archive = LogArchive(str(tmp_path), segment_blocks=100)
+    logs = [make_raw_log(block_number=n, log_index=0) for n in range(100)]
+    # Block 0 twice, as if a write was interrupted
+    for block_number in [0] + list(range(99)):
+        archive.add_logs(address=BRIDGE_ADDRESS, from_block=block_number, to_block=block_number, logs=[
+            logs[block_number],
+        ])
+    assert len(archive._read_index(BRIDGE_ADDRESS.lower(), 0)) == 100
+
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=99, to_block=99, logs=[logs[99]])
+    assert len(archive._read_index(BRIDGE_ADDRESS.lower(), 0)) == 10
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=0, to_block=99) == logs
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=15, to_block=25) == logs[15:26]
+
+
+def test_reads_segments_without_index(tmp_path, archive):
+    # As archived before the segments were indexed
+    address_directory = tmp_path / BRIDGE_ADDRESS.lower()
+    os.makedirs(address_directory)
+    old_logs = [make_raw_log(block_number=n, log_index=0) for n in (10, 20)]
+    with gzip.open(address_directory / '000000000000.jsonl.gz', 'wt') as f:
+        for log in old_logs:
+            f.write(json.dumps([int(log['blockNumber'], 16), log['blockHash'], log['transactionHash'], 0, 0,
+                                log['topics'], log['data']]) + '\n')
+    with open(address_directory / 'coverage.jsonl', 'w') as f:
+        f.write('[1, 30]\n')
+
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=30) == old_logs
+    new_log = make_raw_log(block_number=40, log_index=0)
+    archive.add_logs(address=BRIDGE_ADDRESS, from_block=31, to_block=50, logs=[new_log])
+    assert archive.get_logs(address=BRIDGE_ADDRESS, from_block=1, to_block=50) == old_logs + [new_log]
+
+
+def test_get_deposits_uses_archive(archive):
+    get_side_token.cache_clear()
+    is_contract.cache_clear()
+    bridge_address = make_address('bridge')
+    main_token_address = make_address('main token')
+    chain = FakeChain()
+    chain.add_side_token(
+        bridge_address=bridge_address,
+        main_token_address=main_token_address,
+        side_token_address=make_address('side token'),
+        symbol='DAIbs',
+    )
+    for i in range(20):
+        chain.mine_block()
+        chain.add_deposit(
+            bridge_address=bridge_address,
+            main_token_address=main_token_address,
+            to=make_address(f'user {i}'),
+            amount_wei=10**18,
+            block_number=chain.head,
+        )
+    stats = RPCStats()
+    web3 = Web3(FakeChainProvider(chain))
+    web3.middleware_onion.inject(rpc_stats_middleware(stats), name='rpc_stats', layer=0)
+    bridge_contract = get_bridge_contract(bridge_address=bridge_address, web3=web3)
+
+    def _get_deposits(from_block, to_block):
+        return get_deposits(
+            bridge_contract=bridge_contract,
+            web3=web3,
+            from_block=from_block,
+            to_block=to_block,
+            fee_percentage=Decimal(0),
+            archive=archive,
+        )
+
+    deposits = _get_deposits(1, 10)
+    assert len(deposits) == 10
+    assert stats.end_round()['eth_getLogs']['calls'] == 1
+
+    assert _get_deposits(1, 10) == deposits
+    assert 'eth_getLogs' not in stats.end_round()
+
+    # Only the missing part is fetched
+    assert len(_get_deposits(5, 20)) == 16
+    assert stats.end_round()['eth_getLogs']['calls'] == 1
@@ -0,0 +1,94 @@
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from prometheus_client import REGISTRY
+
+from sovryn_bridge_rewarder.config import RewardThresholdMap, load_from_json
+from sovryn_bridge_rewarder.main import update_metrics
+from sovryn_bridge_rewarder.models import RewarderStatus, RewardStatus
+from sovryn_bridge_rewarder.rewards import queue_reward
+from sovryn_bridge_rewarder.utils import retryable
+from .test_config import EXAMPLE_CONFIG_JSON
+from .test_rewards import EXAMPLE_DEPOSIT, MockWeb3
+
+
+def _sample(name, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_retryable_counts_errors_and_retries():
+    calls = []
+
+    @retryable(max_attempts=2)
+    def flaky_function():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ValueError('flaky')
+        return 'ok'
+
+    errors_before = _sample('rewarder_rpc_errors_total', function='flaky_function')
+    retries_before = _sample('rewarder_retries_total', function='flaky_function')
+    with mock.patch('sovryn_bridge_rewarder.utils.sleep'):
+        assert flaky_function() == 'ok'
+    assert _sample('rewarder_rpc_errors_total', function='flaky_function') == errors_before + 2
+    assert _sample('rewarder_retries_total', function='flaky_function') == retries_before + 2
+
+
+def test_retryable_counts_final_error():
+    @retryable(max_attempts=0)
+    def failing_function():
+        raise ValueError('fail')
+
+    errors_before = _sample('rewarder_rpc_errors_total', function='failing_function')
+    with pytest.raises(ValueError):
+        failing_function()
+    assert _sample('rewarder_rpc_errors_total', function='failing_function') == errors_before + 1
+    assert _sample('rewarder_retries_total', function='failing_function') == 0
+
+
+def test_queue_reward_stage_is_timed(dbsession):
+    count_before = _sample('rewarder_stage_seconds_count', stage='queue_reward')
+    queue_reward(
+        deposit=EXAMPLE_DEPOSIT,
+        dbsession=dbsession,
+        web3=MockWeb3(),
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('30.00')}),
+    )
+    assert _sample('rewarder_stage_seconds_count', stage='queue_reward') == count_before + 1
+
+
+def test_update_metrics_publishes_status(database):
+    config = load_from_json(EXAMPLE_CONFIG_JSON)
+    web3 = MockWeb3()
+    web3.eth.set_balance(config.account.address, 2 * 10**18)
+    with database.begin() as dbsession:
+        queue_reward(
+            deposit=EXAMPLE_DEPOSIT,
+            dbsession=dbsession,
+            web3=web3,
+            reward_amount_rbtc=Decimal('0.01'),
+            deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('30.00')}),
+        )
+    for round_number in range(2):
+        counts = update_metrics(
+            web3=web3,
+            DBSession=database,
+            config=config,
+            backlog=5,
+            current_block=110 + round_number,
+            last_processed_block=103 + round_number,
+            round_seconds=1.5,
+        )
+
+    assert counts == {RewardStatus.queued: 1}
+    assert _sample('rewarder_balance_rbtc') == 2
+    assert _sample('rewarder_rewards', status='queued') == 1
+    with database.begin() as dbsession:
+        status = dbsession.query(RewarderStatus).one()
+        assert status.account_address == config.account.address.lower()
+        assert status.rbtc_balance_wei == 2 * 10**18
+        assert status.gas_price_wei == web3.eth.gas_price
+        assert (status.head_block, status.last_processed_block, status.backlog_blocks) == (111, 104, 5)
+        assert (status.queued_rewards, status.sending_rewards, status.sent_rewards) == (1, 0, 0)
@@ -0,0 +1,158 @@
+from datetime import date, datetime, timezone
+
+import pytest
+import sqlalchemy
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, Text, inspect, text
+
+from sovryn_bridge_rewarder.main import init_sqlalchemy
+from sovryn_bridge_rewarder.migrations import LATEST_VERSION, get_schema_version, migrate
+from sovryn_bridge_rewarder.models import Reward, RewardStatistic, RewardStatus
+
+
+def _create_v1_database(engine):
+    """
+    Create the reward and block_info tables as they were before schema versioning
+    """
+    metadata = MetaData()
+    reward = Table(
+        'reward',
+        metadata,
+        Column('id', Integer, primary_key=True),
+        Column('status', Text, nullable=False),
+        Column('reward_rbtc_wei', Text, nullable=False),
+        Column('user_address', Text, nullable=False, index=True),
+        Column('deposit_side_token_address', Text, nullable=False),
+        Column('deposit_side_token_symbol', Text, nullable=False),
+        Column('deposit_main_token_address', Text, nullable=False),
+        Column('deposit_amount_minus_fees_wei', Text, nullable=False),
+        Column('deposit_log_index', Integer, nullable=False),
+        Column('deposit_block_hash', Text, nullable=False),
+        Column('deposit_transaction_hash', Text, nullable=False, index=True),
+        Column('deposit_contract_address', Text, nullable=False),
+        Column('reward_transaction_hash', Text, nullable=True),
+        Column('reward_transaction_nonce', Integer, nullable=True),
+        Column('created_at', DateTime(timezone=True), nullable=False),
+        Column('sent_at', DateTime(timezone=True), nullable=True),
+    )
+    Table(
+        'block_info',
+        metadata,
+        Column('key', Text, primary_key=True),
+        Column('block_number', Integer, nullable=False),
+    )
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(reward.insert(), [
+            dict(
+                id=i,
+                status=status,
+                reward_rbtc_wei='100000000000000',
+                user_address=f'0x{i:040x}',
+                deposit_side_token_address='0x081d4aa03ac5cdaf2b758306a259e1bd0896c0ca',
+                deposit_side_token_symbol='DAIbs',
+                deposit_main_token_address='0x83241490517384cb28382bdd4d1534ee54d9350f',
+                deposit_amount_minus_fees_wei=str(123 * 10**24 + i),  # doesn't fit in 64 bits
+                deposit_log_index=i,
+                deposit_block_hash='0x' + '11' * 32,
+                deposit_transaction_hash='0x' + f'{i:064x}',
+                deposit_contract_address='0x8e7199d5f496ea862492f4f983a1627d723328fd',
+                created_at=datetime(2021, 5, 1, tzinfo=timezone.utc),
+            )
+            for (i, status) in enumerate(['confirmed', 'confirmed', 'sent', 'queued'], start=1)
+        ])
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return sqlalchemy.create_engine(f'sqlite:///{tmp_path}/test.sqlite3')
+
+
+def test_new_database_is_created_at_latest_version(engine):
+    migrate(engine)
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == LATEST_VERSION
+        assert {'reward', 'block_info', 'scanned_window', 'schema_version'} <= set(
+            inspect(connection).get_table_names()
+        )
+
+
+def test_migrate_from_v1(engine):
+    _create_v1_database(engine)
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == 1
+
+    migrate(engine)
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == LATEST_VERSION
+        # Not with inspect, which skips the expression indexes of SQLite
+        index_names = set(connection.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'reward'"
+        )).scalars())
+        assert {
+            'ix_reward_status_id', 'ix_reward_created_at', 'ix_reward_updated_at', 'ix_reward_user_address',
+            'uq_reward_deposit', 'ix_reward_deposit_block_number', 'uq_reward_user_address',
+        } <= index_names
+        # Missing tables are created
+        assert 'scanned_window' in inspect(connection).get_table_names()
+
+    DBSession = init_sqlalchemy(str(engine.url))
+    with DBSession.begin() as dbsession:
+        rewards = dbsession.query(Reward).order_by(Reward.id).all()
+        assert [r.status for r in rewards] == [
+            RewardStatus.confirmed, RewardStatus.confirmed, RewardStatus.sent, RewardStatus.queued,
+        ]
+        assert rewards[0].deposit_amount_minus_fees_wei == 123 * 10**24 + 1
+        assert rewards[0].reward_rbtc_wei == 100000000000000
+        assert rewards[0].updated_at == rewards[0].created_at
+        assert rewards[0].deposit_block_number is None
+        assert dbsession.query(Reward.id).filter_by(status=RewardStatus.queued).scalar() == 4
+
+        new_reward = Reward(
+            status=RewardStatus.queued,
+            reward_rbtc_wei=1,
+            user_address='0x' + 'ab' * 20,
+            deposit_side_token_address=rewards[0].deposit_side_token_address,
+            deposit_side_token_symbol='DAIbs',
+            deposit_main_token_address=rewards[0].deposit_main_token_address,
+            deposit_amount_minus_fees_wei=1,
+            deposit_log_index=0,
+            deposit_block_hash=rewards[0].deposit_block_hash,
+            deposit_transaction_hash='0x' + 'ff' * 32,
+            deposit_contract_address=rewards[0].deposit_contract_address,
+        )
+        dbsession.add(new_reward)
+        dbsession.flush()
+        assert new_reward.id == 5
+
+        # Statistics are computed for the existing rewards
+        statistics = {
+            s.status: (s.day, s.count, s.deposit_amount_minus_fees_wei)
+            for s in dbsession.query(RewardStatistic).filter(RewardStatistic.day < date(2021, 6, 1))
+        }
+        assert statistics == {
+            RewardStatus.confirmed: (date(2021, 5, 1), 2, 2 * 123 * 10**24 + 3),
+            RewardStatus.sent: (date(2021, 5, 1), 1, 123 * 10**24 + 3),
+            RewardStatus.queued: (date(2021, 5, 1), 1, 123 * 10**24 + 4),
+        }
+
+
+def test_migrate_is_idempotent(engine):
+    _create_v1_database(engine)
+    migrate(engine)
+    migrate(engine)
+    with engine.connect() as connection:
+        assert get_schema_version(connection) == LATEST_VERSION
+        assert connection.execute(sqlalchemy.text('SELECT COUNT(*) FROM reward')).scalar() == 4
+
+
+def test_migrate_rejects_unknown_statuses(engine):
+    _create_v1_database(engine)
+    with engine.begin() as connection:
+        connection.execute(sqlalchemy.text("UPDATE reward SET status = 'bogus' WHERE id = 1"))
+    with pytest.raises(ValueError):
+        migrate(engine)
+
+
+def test_invalid_status_is_rejected(dbsession):
+    with pytest.raises(sqlalchemy.exc.StatementError):
+        dbsession.query(Reward).filter_by(status='bogus').all()
@@ -0,0 +1,79 @@
+import os
+import pstats
+import signal
+import tracemalloc
+
+import pytest
+
+from sovryn_bridge_rewarder.profiling import RoundProfiler, install_signal_handler
+
+
+def _allocate():
+    return [str(i) * 10 for i in range(10000)]
+
+
+def _run_round(profiler: RoundProfiler):
+    with profiler.profile_round():
+        return _allocate()
+
+
+def _profile_files(output_dir):
+    if not os.path.exists(output_dir):
+        return []
+    return sorted(os.listdir(output_dir))
+
+
+def test_rounds_are_not_profiled_unless_armed(tmp_path):
+    output_dir = str(tmp_path / 'profiles')
+    profiler = RoundProfiler(output_dir=output_dir)
+    _run_round(profiler)
+    assert profiler.round_number == 1
+    assert _profile_files(output_dir) == []
+
+
+def test_profiles_armed_rounds(tmp_path):
+    output_dir = str(tmp_path / 'profiles')
+    profiler = RoundProfiler(output_dir=output_dir)
+    _run_round(profiler)
+    profiler.arm(2)
+    for _ in range(3):
+        _run_round(profiler)
+
+    files = _profile_files(output_dir)
+    assert len(files) == 8
+    assert [f[:12] for f in files[::4]] == ['round-000002', 'round-000003']
+    assert {os.path.splitext(f)[1] for f in files} == {'.prof', '.txt', '.tracemalloc'}
+    assert not tracemalloc.is_tracing()
+
+    prof_path = os.path.join(output_dir, next(f for f in files if f.endswith('.prof')))
+    function_names = {function[2] for function in pstats.Stats(prof_path).stats}
+    assert '_allocate' in function_names
+
+    memory_path = os.path.join(output_dir, next(f for f in files if f.endswith('.memory.txt')))
+    with open(memory_path) as f:
+        memory_report = f.read()
+    assert 'test_profiling.py' in memory_report
+    assert tracemalloc.Snapshot.load(memory_path.replace('.memory.txt', '.tracemalloc')).traces
+
+
+def test_profiles_without_memory(tmp_path):
+    output_dir = str(tmp_path / 'profiles')
+    profiler = RoundProfiler(output_dir=output_dir, memory=False)
+    profiler.arm(1)
+    _run_round(profiler)
+    assert [os.path.splitext(f)[1] for f in _profile_files(output_dir)] == ['.txt', '.prof']
+
+
+@pytest.mark.skipif(not hasattr(signal, 'SIGUSR1'), reason='no SIGUSR1')
+def test_signal_arms_profiler(tmp_path):
+    output_dir = str(tmp_path / 'profiles')
+    profiler = RoundProfiler(output_dir=output_dir, memory=False)
+    previous_handler = signal.getsignal(signal.SIGUSR1)
+    try:
+        assert install_signal_handler(profiler, num_rounds=1)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        _run_round(profiler)
+        _run_round(profiler)
+    finally:
+        signal.signal(signal.SIGUSR1, previous_handler)
+    assert len(_profile_files(output_dir)) == 2
@@ -0,0 +1,231 @@
+from decimal import Decimal
+import logging
+
+from eth_account import Account
+from eth_utils import keccak
+import pytest
+from hexbytes import HexBytes
+from web3.datastructures import AttributeDict
+from web3.exceptions import BlockNotFound
+
+from sovryn_bridge_rewarder.config import RewardThresholdMap
+from sovryn_bridge_rewarder.models import Reward, RewardStatus, ScannedWindow
+from sovryn_bridge_rewarder.reorgs import (
+    MAX_SCANNED_WINDOWS,
+    record_scanned_window,
+    rollback_reorganized_windows,
+)
+from sovryn_bridge_rewarder.rewards import queue_reward, send_queued_rewards
+from .test_rewards import ANOTHER_DEPOSIT_DIFFERENT_USER, EXAMPLE_DEPOSIT, MockWeb3
+
+
+def _block_hash(block_number: int, fork: int = 0) -> str:
+    return '0x' + f'{fork:02x}{block_number:062x}'
+
+
+class MockChainEth:
+    def __init__(self, head: int):
+        self.blocks = {}
+        self.reorganize(from_block=0, head=head, fork=0)
+
+    def reorganize(self, *, from_block: int, head: int, fork: int):
+        self.blocks = {n: h for (n, h) in self.blocks.items() if n < from_block}
+        for n in range(from_block, head + 1):
+            self.blocks[n] = _block_hash(n, fork)
+
+    def get_block(self, block_identifier):
+        if isinstance(block_identifier, int):
+            if block_identifier not in self.blocks:
+                raise BlockNotFound(block_identifier)
+            block_hash = self.blocks[block_identifier]
+            return AttributeDict({'number': block_identifier, 'hash': HexBytes(block_hash)})
+        for (n, h) in self.blocks.items():
+            if h == block_identifier:
+                return AttributeDict({'number': n, 'hash': HexBytes(h)})
+        raise BlockNotFound(block_identifier)
+
+
+class MockChainWeb3(MockWeb3):
+    def __init__(self, head: int):
+        super().__init__()
+        self.eth.chain = MockChainEth(head)
+        self.eth.get_block = self.eth.chain.get_block
+        self.eth.sent_transactions = []
+        self.eth.send_raw_transaction = self._send_raw_transaction
+        self.eth.wait_for_transaction_receipt = lambda transaction_hash, **kwargs: AttributeDict({'status': 1})
+
+    def _send_raw_transaction(self, raw_transaction):
+        self.eth.sent_transactions.append(raw_transaction)
+        return keccak(raw_transaction)
+
+
+@pytest.fixture
+def chain_web3() -> MockChainWeb3:
+    return MockChainWeb3(head=200)
+
+
+def _queue(dbsession, web3, deposit):
+    return queue_reward(
+        deposit=deposit,
+        dbsession=dbsession,
+        web3=web3,
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('30.00')}),
+    )
+
+
+def _record(dbsession, from_block, to_block, fork=0):
+    record_scanned_window(
+        dbsession,
+        from_block=from_block,
+        to_block=to_block,
+        to_block_hash=_block_hash(to_block, fork),
+    )
+
+
+def test_no_windows(dbsession, chain_web3):
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) is None
+
+
+def test_no_reorg(dbsession, chain_web3):
+    _record(dbsession, 100, 110)
+    _record(dbsession, 111, 120)
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) is None
+    assert dbsession.query(ScannedWindow).count() == 2
+
+
+def test_reorg_rolls_back_to_common_ancestor(dbsession, chain_web3):
+    _record(dbsession, 100, 110)
+    _record(dbsession, 111, 120)
+    _record(dbsession, 121, 130)
+    chain_web3.eth.chain.reorganize(from_block=115, head=200, fork=1)
+
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) == 110
+    assert [w.to_block for w in dbsession.query(ScannedWindow)] == [110]
+
+
+def test_reorg_deeper_than_recorded_windows(dbsession, chain_web3):
+    _record(dbsession, 100, 110)
+    _record(dbsession, 111, 120)
+    chain_web3.eth.chain.reorganize(from_block=50, head=200, fork=1)
+
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) == 99
+    assert dbsession.query(ScannedWindow).count() == 0
+
+
+def test_reorg_orphans_queued_rewards_for_removed_deposits(dbsession, chain_web3):
+    _record(dbsession, 100, 110)
+    reward = queue_reward(
+        deposit=EXAMPLE_DEPOSIT,
+        dbsession=dbsession,
+        web3=chain_web3,
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('30.00')}),
+    )
+    _record(dbsession, 111, 120)
+    chain_web3.eth.chain.reorganize(from_block=115, head=200, fork=1)
+
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) == 110
+    assert reward.status == RewardStatus.orphaned
+
+    # The user can be rewarded again if the deposit is found in the new chain
+    requeued_reward = queue_reward(
+        deposit=EXAMPLE_DEPOSIT,
+        dbsession=dbsession,
+        web3=chain_web3,
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('30.00')}),
+    )
+    assert requeued_reward
+    assert dbsession.query(Reward).count() == 2
+
+
+def test_reorg_keeps_rewards_for_canonical_deposits(dbsession, chain_web3):
+    _record(dbsession, 100, 110)
+    chain_web3.eth.chain.blocks[112] = EXAMPLE_DEPOSIT.block_hash
+    reward = queue_reward(
+        deposit=EXAMPLE_DEPOSIT,
+        dbsession=dbsession,
+        web3=chain_web3,
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('30.00')}),
+    )
+    _record(dbsession, 111, 120)
+    chain_web3.eth.chain.reorganize(from_block=115, head=200, fork=1)
+
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) == 110
+    assert reward.status == RewardStatus.queued
+
+
+def test_record_scanned_window_prunes_old_windows(dbsession):
+    for i in range(MAX_SCANNED_WINDOWS + 10):
+        _record(dbsession, i * 10, i * 10 + 9)
+    assert dbsession.query(ScannedWindow).count() == MAX_SCANNED_WINDOWS
+
+
+def test_reorg_only_checks_rewards_for_deposits_in_rolled_back_blocks(dbsession, chain_web3):
+    _record(dbsession, 100, 110)
+    # Not in the chain, but before the common ancestor, so not affected by the reorg
+    old_reward = _queue(dbsession, chain_web3, EXAMPLE_DEPOSIT.replace(block_number=105))
+    _record(dbsession, 111, 120)
+    new_reward = _queue(dbsession, chain_web3, ANOTHER_DEPOSIT_DIFFERENT_USER.replace(
+        block_number=117,
+        amount_minus_fees_wei=EXAMPLE_DEPOSIT.amount_minus_fees_wei,
+    ))
+    chain_web3.eth.chain.reorganize(from_block=115, head=200, fork=1)
+
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) == 110
+    assert old_reward.status == RewardStatus.queued
+    assert new_reward.status == RewardStatus.orphaned
+
+
+def test_reorg_deeper_than_recorded_windows_orphans_rewards_in_rolled_back_blocks(dbsession, chain_web3):
+    _record(dbsession, 100, 110)
+    old_reward = _queue(dbsession, chain_web3, EXAMPLE_DEPOSIT.replace(block_number=60))
+    new_reward = _queue(dbsession, chain_web3, ANOTHER_DEPOSIT_DIFFERENT_USER.replace(
+        block_number=105,
+        amount_minus_fees_wei=EXAMPLE_DEPOSIT.amount_minus_fees_wei,
+    ))
+    _record(dbsession, 111, 120)
+    chain_web3.eth.chain.reorganize(from_block=50, head=200, fork=1)
+
+    assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) == 99
+    assert old_reward.status == RewardStatus.queued
+    assert new_reward.status == RewardStatus.orphaned
+
+
+@pytest.mark.parametrize('status', [RewardStatus.sending, RewardStatus.sent, RewardStatus.confirmed])
+def test_reorg_does_not_orphan_rewards_already_sent(dbsession, chain_web3, caplog, status):
+    _record(dbsession, 100, 110)
+    _record(dbsession, 111, 120)
+    reward = _queue(dbsession, chain_web3, EXAMPLE_DEPOSIT.replace(block_number=117))
+    reward.status = status
+    chain_web3.eth.chain.reorganize(from_block=115, head=200, fork=1)
+
+    with caplog.at_level(logging.ERROR):
+        assert rollback_reorganized_windows(web3=chain_web3, dbsession=dbsession) == 110
+    assert reward.status == status
+    assert 'the reward was already sent' in caplog.text
+
+
+def test_send_queued_rewards_skips_deposits_removed_from_the_chain(database, chain_web3):
+    from_account = Account.create()
+    chain_web3.eth.set_balance(from_account.address, 10**18)
+    chain_web3.eth.chain.blocks[117] = EXAMPLE_DEPOSIT.block_hash
+    with database.begin() as dbsession:
+        orphaned_reward_id = _queue(dbsession, chain_web3, EXAMPLE_DEPOSIT.replace(block_number=117)).id
+        reward_id = _queue(dbsession, chain_web3, ANOTHER_DEPOSIT_DIFFERENT_USER.replace(
+            block_number=150,
+            block_hash=_block_hash(150),
+            amount_minus_fees_wei=EXAMPLE_DEPOSIT.amount_minus_fees_wei,
+        )).id
+    # The reorg happens after the deposits are queued, before the main loop notices it
+    chain_web3.eth.chain.reorganize(from_block=115, head=200, fork=1)
+    chain_web3.eth.chain.blocks[150] = _block_hash(150)
+
+    send_queued_rewards(web3=chain_web3, DBSession=database, from_account=from_account)
+
+    assert len(chain_web3.eth.sent_transactions) == 1
+    with database.begin() as dbsession:
+        assert dbsession.query(Reward).get(orphaned_reward_id).status == RewardStatus.orphaned
+        assert dbsession.query(Reward).get(reward_id).status == RewardStatus.confirmed
@@ -4,53 +4,53 @@ from typing import cast
 
 import pytest
 from hexbytes import HexBytes
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from web3 import Web3
 
 from sovryn_bridge_rewarder.models import Reward, RewardStatus
-from sovryn_bridge_rewarder.deposits import Deposit
+from sovryn_bridge_rewarder.deposits import Deposit, DepositToken
 from sovryn_bridge_rewarder.config import RewardThresholdMap
 from sovryn_bridge_rewarder.rewards import (
+    _get_reward_values,
+    _insert_rewards_ignoring_duplicates,
     queue_reward,
+    queue_rewards,
     get_queued_reward_ids,
 )
+from sovryn_bridge_rewarder.utils import utcnow
 
 
+DAIBS_TOKEN = DepositToken(
+    side_token_address='0x081d4aa03ac5cdaf2b758306a259e1bd0896c0ca',
+    side_token_symbol='DAIbs',
+    main_token_address='0x83241490517384cb28382bdd4d1534ee54d9350f',
+    contract_address='0x8e7199d5f496ea862492f4f983a1627d723328fd',
+    fee_percentage=Decimal('0.002'),
+)
 EXAMPLE_DEPOSIT = Deposit(
-    amount_decimal=Decimal('30'),
+    token=DAIBS_TOKEN,
     amount_minus_fees_wei=29940000000000000000,
     block_hash='0x614b75ba52cbe0a643850b909a0cd29b9032a116059849f148e631e0e5764a52',
     log_index=3,
-    main_token_address='0x83241490517384cb28382bdd4d1534ee54d9350f',
-    side_token_address='0x081d4aa03ac5cdaf2b758306a259e1bd0896c0ca',
-    side_token_symbol='DAIbs',
     transaction_hash='0x05f16236ee5ca06311f4a014b9fcaa40a32389c6c95b86267ab0bfcbc5616972',
     user_address='0xca478e11953fe327b46dd71dd9fd31c92dc9a9ae',
-    contract_address='0x8e7199d5f496ea862492f4f983a1627d723328fd',
 )
 ANOTHER_DEPOSIT_DIFFERENT_USER = Deposit(
-    amount_decimal=Decimal('2.5'),
+    token=DAIBS_TOKEN,
     amount_minus_fees_wei=2495000000000000000,
     block_hash='0x11dcc6cd8198159ae7fdf252a42101ad20fc50c614981d3291e562367f66791a',
     log_index=7,
-    main_token_address='0x83241490517384cb28382bdd4d1534ee54d9350f',
-    side_token_address='0x081d4aa03ac5cdaf2b758306a259e1bd0896c0ca',
-    side_token_symbol='DAIbs',
     transaction_hash='0x0462cb7f734cd277d087a80205b4098ed4e447ec3c7847b68652dd2994a44980',
     user_address='0xf00AF1989184Ae43577Fd33E006baD4bF760F98F',
-    contract_address='0x8e7199d5f496ea862492f4f983a1627d723328fd',
 )
 ANOTHER_DEPOSIT_SAME_USER = Deposit(
-    amount_decimal=Decimal('2.5'),
+    token=DAIBS_TOKEN,
     amount_minus_fees_wei=2495000000000000000,
     block_hash='0x11dcc6cd8198159ae7fdf252a42101ad20fc50c614981d3291e562367f66791a',
     log_index=7,
-    main_token_address='0x83241490517384cb28382bdd4d1534ee54d9350f',
-    side_token_address='0x081d4aa03ac5cdaf2b758306a259e1bd0896c0ca',
-    side_token_symbol='DAIbs',
     transaction_hash='0x0462cb7f734cd277d087a80205b4098ed4e447ec3c7847b68652dd2994a44980',
     user_address='0xca478e11953fe327b46dd71dd9fd31c92dc9a9ae',
-    contract_address='0x8e7199d5f496ea862492f4f983a1627d723328fd',
 )
 
 
@@ -61,14 +61,16 @@ def _normalize_address(a):
 
 
 class MockEth:
+    gas_price = 65_164_000
+
     def __init__(self):
         self._balances = defaultdict(int)
         self._transaction_counts = defaultdict(int)
 
-    def get_balance(self, address) -> int:
+    def get_balance(self, address, block_identifier=None) -> int:
         return self._balances[_normalize_address(address)]
 
-    def get_transaction_count(self, address) -> int:
+    def get_transaction_count(self, address, block_identifier=None) -> int:
         return self._transaction_counts[_normalize_address(address)]
 
     def set_balance(self, address, value: int):
@@ -279,3 +281,84 @@ def test_queue_reward_user_has_existing_transactions(dbsession: Session, mock_we
         })
     )
     assert dbsession.query(Reward).count() == 0
+
+
+def test_queue_rewards(dbsession: Session, mock_web3: MockWeb3):
+    def queue(deposits):
+        return queue_rewards(
+            deposits=deposits,
+            dbsession=dbsession,
+            web3=cast(Web3, mock_web3),
+            reward_amount_rbtc=Decimal('0.01'),
+            deposit_thresholds=RewardThresholdMap({
+                'DAIbs': Decimal('2.00'),
+            })
+        )
+
+    assert queue([EXAMPLE_DEPOSIT, ANOTHER_DEPOSIT_SAME_USER, ANOTHER_DEPOSIT_DIFFERENT_USER]) == 2
+    rewards = dbsession.query(Reward).order_by(Reward.id).all()
+    assert [r.deposit_transaction_hash for r in rewards] == [
+        EXAMPLE_DEPOSIT.transaction_hash,
+        ANOTHER_DEPOSIT_DIFFERENT_USER.transaction_hash,
+    ]
+    assert rewards[0].status == RewardStatus.queued
+    assert rewards[0].reward_rbtc_wei == 10_000_000_000_000_000
+    assert rewards[0].deposit_amount_minus_fees_wei == EXAMPLE_DEPOSIT.amount_minus_fees_wei
+    assert rewards[0].created_at is not None
+
+    # Replaying the same deposits is safe
+    assert queue([EXAMPLE_DEPOSIT, ANOTHER_DEPOSIT_DIFFERENT_USER]) == 0
+    assert dbsession.query(Reward).count() == 2
+
+
+def test_queue_rewards_ignores_duplicate_deposits(dbsession: Session, mock_web3: MockWeb3):
+    queue_reward(
+        deposit=EXAMPLE_DEPOSIT,
+        dbsession=dbsession,
+        web3=cast(Web3, mock_web3),
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('2.00')}),
+    )
+    # Same deposit identity, but a different user, so it's only caught by the unique index
+    same_deposit = EXAMPLE_DEPOSIT.replace(user_address=ANOTHER_DEPOSIT_DIFFERENT_USER.user_address)
+    num_queued = queue_rewards(
+        deposits=[same_deposit],
+        dbsession=dbsession,
+        web3=cast(Web3, mock_web3),
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('2.00')}),
+    )
+    assert num_queued == 0
+    assert dbsession.query(Reward).count() == 1
+
+    # Orphaned rewards don't prevent queueing the deposit again
+    dbsession.query(Reward).update({Reward.status: RewardStatus.orphaned})
+    num_queued = queue_rewards(
+        deposits=[EXAMPLE_DEPOSIT],
+        dbsession=dbsession,
+        web3=cast(Web3, mock_web3),
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('2.00')}),
+    )
+    assert num_queued == 1
+
+
+def test_user_is_rewarded_once_by_concurrent_writers(dbsession: Session, mock_web3):
+    queue_reward(
+        deposit=EXAMPLE_DEPOSIT,
+        dbsession=dbsession,
+        web3=mock_web3,
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('2.00')}),
+    )
+    # As queued by another process that didn't see the first reward. Different deposit, same user
+    values = dict(
+        _get_reward_values(ANOTHER_DEPOSIT_SAME_USER.replace(user_address=EXAMPLE_DEPOSIT.user_address.upper()),
+                           Decimal('0.01')),
+        created_at=utcnow(),
+    )
+    assert _insert_rewards_ignoring_duplicates(dbsession, [values]) == 0
+    with pytest.raises(IntegrityError):
+        with dbsession.begin_nested():
+            dbsession.add(Reward(**values))
+    assert dbsession.query(Reward).count() == 1
@@ -0,0 +1,110 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import threading
+
+import pytest
+
+from sovryn_bridge_rewarder.rpc import RPCStats, init_web3, rpc_stats_middleware
+
+
+def make_request(method, params):
+    if method == 'eth_fail':
+        raise ConnectionError('node down')
+    if method == 'eth_error':
+        return {'jsonrpc': '2.0', 'id': 1, 'error': {'code': -32000, 'message': 'error'}}
+    return {'jsonrpc': '2.0', 'id': 1, 'result': '0x1'}
+
+
+@pytest.fixture
+def stats() -> RPCStats:
+    return RPCStats()
+
+
+@pytest.fixture
+def request_func(stats):
+    return rpc_stats_middleware(stats)(make_request, None)
+
+
+def test_records_calls_by_method(stats, request_func):
+    request_func('eth_getBalance', ['0xca478e11953fe327b46dd71dd9fd31c92dc9a9ae', 'latest'])
+    request_func('eth_getBalance', ['0x8e7199d5f496ea862492f4f983a1627d723328fd', 'latest'])
+    request_func('eth_getCode', [b'\x01' * 20, 'latest'])
+
+    snapshot = stats.snapshot()
+    assert set(snapshot.keys()) == {'eth_getBalance', 'eth_getCode'}
+    assert snapshot['eth_getBalance']['calls'] == 2
+    assert snapshot['eth_getBalance']['errors'] == 0
+    assert snapshot['eth_getBalance']['p50_seconds'] is not None
+    assert snapshot['eth_getCode']['calls'] == 1
+
+
+def test_records_errors(stats, request_func):
+    request_func('eth_error', [])
+    with pytest.raises(ConnectionError):
+        request_func('eth_fail', [])
+    request_func('eth_fail_not', [])
+
+    snapshot = stats.snapshot()
+    assert snapshot['eth_error']['errors'] == 1
+    assert snapshot['eth_error']['error_rate'] == 1.0
+    assert snapshot['eth_fail']['errors'] == 1
+    assert snapshot['eth_fail_not']['errors'] == 0
+
+
+def test_end_round(stats, request_func):
+    request_func('eth_call', [{}, 'latest'])
+    assert stats.end_round()['eth_call']['calls'] == 1
+    assert stats.end_round() == {}
+
+    request_func('eth_call', [{}, 'latest'])
+    assert stats.end_round()['eth_call']['calls'] == 1
+    # Totals are kept over rounds
+    assert stats.snapshot()['eth_call']['calls'] == 2
+
+
+def test_log_summary(stats, request_func, caplog):
+    caplog.set_level(logging.INFO)
+    request_func('eth_call', [{}, 'latest'])
+    stats.log_round_summary()
+    request_func('eth_call', [{}, 'latest'])
+    stats.log_summary()
+    assert 'RPC calls this round: eth_call: 1 (' in caplog.messages[0]
+    assert 'RPC calls in total: eth_call: 2 (' in caplog.messages[1]
+
+
+class _RPCRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': '0x' + 'ab' * 100}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.bodies.append((int(self.headers['Content-Length']), len(body)))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def rpc_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RPCRequestHandler)
+    server.bodies = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_payload_sizes_are_the_http_bodies(stats, rpc_server):
+    web3 = init_web3(f'http://127.0.0.1:{rpc_server.server_address[1]}', stats=stats)
+    web3.manager.request_blocking('eth_getCode', ['0x' + '01' * 20, 'latest'])
+
+    [(request_size, response_size)] = rpc_server.bodies
+    snapshot = stats.snapshot()['eth_getCode']
+    assert snapshot['calls'] == 1
+    assert snapshot['request_bytes'] == request_size
+    assert snapshot['response_bytes'] == response_size
@@ -0,0 +1,93 @@
+import pytest
+
+from sovryn_bridge_rewarder.main import get_backlog
+from sovryn_bridge_rewarder.scheduling import RoundScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
+@pytest.fixture
+def scheduler(clock) -> RoundScheduler:
+    return RoundScheduler(
+        max_sleep_seconds=30,
+        min_sleep_seconds=2,
+        backlog_threshold=0,
+        max_error_sleep_seconds=60,
+        clock=clock,
+    )
+
+
+def test_no_sleep_while_behind(scheduler):
+    scheduler.observe_head(100)
+    assert scheduler.get_sleep_seconds(backlog=5000) == 0
+    assert scheduler.get_sleep_seconds(backlog=1) == 0
+
+
+def test_backlog_threshold(clock):
+    scheduler = RoundScheduler(max_sleep_seconds=30, backlog_threshold=10, clock=clock)
+    scheduler.observe_head(100)
+    assert scheduler.get_sleep_seconds(backlog=11) == 0
+    assert scheduler.get_sleep_seconds(backlog=10) == 30
+
+
+def test_max_sleep_when_block_interval_unknown(scheduler):
+    scheduler.observe_head(100)
+    assert scheduler.block_interval is None
+    assert scheduler.get_sleep_seconds(backlog=0) == 30
+
+
+def test_sleep_aligned_to_block_interval(scheduler, clock):
+    scheduler.observe_head(100)
+    clock.now += 20
+    scheduler.observe_head(101)
+    assert scheduler.block_interval == 20
+    clock.now += 5
+    assert scheduler.get_sleep_seconds(backlog=0) == 15
+
+
+def test_block_interval_over_multiple_blocks(scheduler, clock):
+    scheduler.observe_head(100)
+    clock.now += 40
+    scheduler.observe_head(104)
+    assert scheduler.block_interval == 10
+    clock.now += 20
+    scheduler.observe_head(104)  # no new block, ignored
+    assert scheduler.block_interval == 10
+
+
+def test_overdue_block_polls_after_min_sleep(scheduler, clock):
+    scheduler.observe_head(100)
+    clock.now += 20
+    scheduler.observe_head(101)
+    clock.now += 25
+    assert scheduler.get_sleep_seconds(backlog=0) == 2
+
+
+def test_sleep_capped_by_max_sleep(scheduler, clock):
+    scheduler.observe_head(100)
+    clock.now += 120
+    scheduler.observe_head(101)
+    assert scheduler.get_sleep_seconds(backlog=0) == 30
+
+
+def test_error_sleep_backs_off(scheduler):
+    assert [scheduler.get_error_sleep_seconds() for _ in range(8)] == [1, 2, 4, 8, 16, 32, 60, 60]
+    scheduler.get_sleep_seconds(backlog=0)
+    assert scheduler.get_error_sleep_seconds() == 1
+
+
+def test_get_backlog():
+    assert get_backlog(current_block=110, required_block_confirmations=2, start_block=100) == 9
+    assert get_backlog(current_block=101, required_block_confirmations=2, start_block=100) == 0
+    assert get_backlog(current_block=90, required_block_confirmations=2, start_block=100) == 0
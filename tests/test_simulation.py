@@ -0,0 +1,126 @@
+from decimal import Decimal
+
+import pytest
+from eth_account import Account
+from web3 import Web3
+
+from benchmarks.fake_chain import FakeChain, FakeChainProvider, make_address
+from sovryn_bridge_rewarder.cassette import CassetteMiss, CassetteProvider
+from sovryn_bridge_rewarder.config import Config, RewardThresholdMap
+from sovryn_bridge_rewarder.deposits import get_side_token
+from sovryn_bridge_rewarder.main import get_bridge_contract
+from sovryn_bridge_rewarder.simulation import simulate
+from sovryn_bridge_rewarder.utils import is_contract
+
+BRIDGE_ADDRESS = make_address('bridge')
+MAIN_TOKEN_ADDRESS = make_address('main token')
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    get_side_token.cache_clear()
+    is_contract.cache_clear()
+
+
+def _make_chain() -> FakeChain:
+    chain = FakeChain()
+    chain.add_side_token(
+        bridge_address=BRIDGE_ADDRESS,
+        main_token_address=MAIN_TOKEN_ADDRESS,
+        side_token_address=make_address('side token'),
+        symbol='DAIbs',
+    )
+    return chain
+
+
+@pytest.fixture
+def chain() -> FakeChain:
+    chain = _make_chain()
+    for i in range(30):
+        chain.mine_block()
+        chain.add_deposit(
+            bridge_address=BRIDGE_ADDRESS,
+            main_token_address=MAIN_TOKEN_ADDRESS,
+            to=make_address(f'user {i}'),
+            amount_wei=(i + 1) * 10**18,
+            block_number=chain.head,
+        )
+    return chain
+
+
+def _simulate(web3, *, threshold='1', to_block=30):
+    config = Config(
+        bridge_addresses={'DAI': BRIDGE_ADDRESS},
+        rpc_url='http://localhost:4444',
+        db_url='sqlite://',
+        default_start_block=1,
+        required_block_confirmations=2,
+        reward_rbtc=Decimal('0.0001'),
+        reward_thresholds=RewardThresholdMap({'DAIbs': Decimal(threshold)}),
+        account=Account.create(),
+    )
+    return simulate(
+        web3=web3,
+        bridge_contracts={'DAI': get_bridge_contract(bridge_address=BRIDGE_ADDRESS, web3=web3)},
+        config=config,
+        from_block=1,
+        to_block=to_block,
+        chunk_size=7,
+    )
+
+
+@pytest.mark.parametrize('file_name', ['cassette.jsonl', 'cassette.jsonl.gz'])
+def test_record_and_replay(tmp_path, chain, file_name):
+    path = str(tmp_path / file_name)
+    provider = CassetteProvider(path, upstream=FakeChainProvider(chain))
+    recorded = _simulate(Web3(provider))
+    provider.close()
+    assert recorded.num_deposits == 30
+    assert len(recorded.rewards) == 30
+    assert recorded.total_reward_rbtc == Decimal('0.003')
+    assert provider.misses > 0
+
+    get_side_token.cache_clear()
+    is_contract.cache_clear()
+    provider = CassetteProvider(path)
+    replayed = _simulate(Web3(provider))
+    assert replayed.rewards == recorded.rewards
+    assert provider.misses == 0
+    assert provider.hits > 0
+
+
+def test_threshold_change(chain):
+    result = _simulate(Web3(FakeChainProvider(chain)), threshold='10.5')
+    assert result.num_deposits == 30
+    assert len(result.rewards) == 20
+    assert result.deposits_by_token == {'DAIbs': 30}
+    assert result.rewards_by_token == {'DAIbs': 20}
+
+
+def test_replay_miss(tmp_path):
+    web3 = Web3(CassetteProvider(str(tmp_path / 'empty.jsonl')))
+    with pytest.raises(CassetteMiss):
+        web3.eth.get_block_number()
+
+
+def test_users_are_checked_at_their_deposit_block():
+    chain = _make_chain()
+    chain.mine_block()
+    chain.set_balance(make_address('old user'), 10**18)
+    chain.mine_block()
+    for user in ['old user', 'new user']:
+        chain.add_deposit(
+            bridge_address=BRIDGE_ADDRESS,
+            main_token_address=MAIN_TOKEN_ADDRESS,
+            to=make_address(user),
+            amount_wei=10 * 10**18,
+            block_number=chain.head,
+        )
+    # The new user got a balance later, most likely from the reward itself
+    chain.mine_block()
+    chain.set_balance(make_address('new user'), 10**18)
+    chain.mine_block()
+
+    result = _simulate(Web3(FakeChainProvider(chain)), to_block=chain.head)
+    assert result.num_deposits == 2
+    assert [reward.user_address for reward in result.rewards] == [make_address('new user').lower()]
@@ -0,0 +1,180 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+import json
+import threading
+from typing import cast
+
+from click.testing import CliRunner
+import pytest
+from sqlalchemy.orm import Session
+from web3 import Web3
+
+from sovryn_bridge_rewarder import cli
+from sovryn_bridge_rewarder.config import RewardThresholdMap
+from sovryn_bridge_rewarder.database import create_db_engine, init_sqlalchemy
+from sovryn_bridge_rewarder.models import Reward, RewardStatistic, RewardStatus
+from sovryn_bridge_rewarder import rewards
+from sovryn_bridge_rewarder.rewards import queue_reward, queue_rewards
+from sovryn_bridge_rewarder.statistics import RewardValues, apply_reward_changes, rebuild_reward_statistics
+from .test_config import EXAMPLE_CONFIG_JSON
+from .test_rewards import ANOTHER_DEPOSIT_DIFFERENT_USER, EXAMPLE_DEPOSIT, MockWeb3
+
+THRESHOLDS = RewardThresholdMap({'DAIbs': Decimal('2.00')})
+
+
+def _get_statistics(dbsession: Session):
+    return {
+        (s.status, s.deposit_side_token_symbol): (s.count, s.reward_rbtc_wei, s.deposit_amount_minus_fees_wei)
+        for s in dbsession.query(RewardStatistic)
+        if s.count
+    }
+
+
+def test_statistics_are_updated_on_orm_changes(dbsession: Session):
+    web3 = cast(Web3, MockWeb3())
+    for deposit in [EXAMPLE_DEPOSIT, ANOTHER_DEPOSIT_DIFFERENT_USER]:
+        queue_reward(
+            deposit=deposit,
+            dbsession=dbsession,
+            web3=web3,
+            reward_amount_rbtc=Decimal('0.01'),
+            deposit_thresholds=THRESHOLDS,
+        )
+    dbsession.flush()
+    total_deposits = EXAMPLE_DEPOSIT.amount_minus_fees_wei + ANOTHER_DEPOSIT_DIFFERENT_USER.amount_minus_fees_wei
+    assert _get_statistics(dbsession) == {
+        (RewardStatus.queued, 'DAIbs'): (2, 2 * 10**16, total_deposits),
+    }
+
+    reward = dbsession.query(Reward).filter_by(deposit_transaction_hash=EXAMPLE_DEPOSIT.transaction_hash).one()
+    reward.status = RewardStatus.sent
+    reward.reward_transaction_hash = '0x' + '12' * 32
+    dbsession.flush()
+    assert _get_statistics(dbsession) == {
+        (RewardStatus.queued, 'DAIbs'): (1, 10**16, ANOTHER_DEPOSIT_DIFFERENT_USER.amount_minus_fees_wei),
+        (RewardStatus.sent, 'DAIbs'): (1, 10**16, EXAMPLE_DEPOSIT.amount_minus_fees_wei),
+    }
+
+    # Changes to other columns don't affect the statistics
+    reward.reward_transaction_nonce = 5
+    dbsession.flush()
+    assert _get_statistics(dbsession)[(RewardStatus.sent, 'DAIbs')][0] == 1
+
+    dbsession.delete(reward)
+    dbsession.flush()
+    assert _get_statistics(dbsession) == {
+        (RewardStatus.queued, 'DAIbs'): (1, 10**16, ANOTHER_DEPOSIT_DIFFERENT_USER.amount_minus_fees_wei),
+    }
+
+
+@pytest.fixture(params=['bulk', 'one_by_one'])
+def insert_method(request, monkeypatch):
+    if request.param == 'one_by_one':
+        # As for databases without INSERT ... ON CONFLICT
+        monkeypatch.setattr(rewards, '_insert_rewards_ignoring_duplicates', rewards._insert_rewards_one_by_one)
+    return request.param
+
+
+def test_statistics_are_updated_on_bulk_insert(dbsession: Session, insert_method):
+    web3 = cast(Web3, MockWeb3())
+
+    def queue(deposits):
+        return queue_rewards(
+            deposits=deposits,
+            dbsession=dbsession,
+            web3=web3,
+            reward_amount_rbtc=Decimal('0.01'),
+            deposit_thresholds=THRESHOLDS,
+        )
+
+    queue_reward(
+        deposit=EXAMPLE_DEPOSIT,
+        dbsession=dbsession,
+        web3=web3,
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=THRESHOLDS,
+    )
+    # The first deposit is a duplicate of an existing reward (by deposit, for a different user), so it's only
+    # skipped by the database
+    duplicate = EXAMPLE_DEPOSIT.replace(user_address='0x' + '11' * 20)
+    assert queue([duplicate, ANOTHER_DEPOSIT_DIFFERENT_USER]) == 1
+    assert _get_statistics(dbsession) == {
+        (RewardStatus.queued, 'DAIbs'): (
+            2, 2 * 10**16, EXAMPLE_DEPOSIT.amount_minus_fees_wei + ANOTHER_DEPOSIT_DIFFERENT_USER.amount_minus_fees_wei,
+        ),
+    }
+
+
+def test_rebuild_statistics(dbsession: Session):
+    queue_rewards(
+        deposits=[EXAMPLE_DEPOSIT, ANOTHER_DEPOSIT_DIFFERENT_USER],
+        dbsession=dbsession,
+        web3=cast(Web3, MockWeb3()),
+        reward_amount_rbtc=Decimal('0.01'),
+        deposit_thresholds=THRESHOLDS,
+    )
+    statistics = _get_statistics(dbsession)
+    dbsession.query(RewardStatistic).delete()
+    assert _get_statistics(dbsession) == {}
+    rebuild_reward_statistics(dbsession.connection())
+    assert _get_statistics(dbsession) == statistics
+
+
+def test_concurrent_changes_are_not_lost(tmp_path):
+    # Separate engines, like the rewarder and a backfill in other processes
+    db_url = f'sqlite:///{tmp_path / "db.sqlite3"}'
+    init_sqlalchemy(db_url, create_models=True)
+    values = RewardValues(
+        created_at=datetime(2021, 5, 1, tzinfo=timezone.utc),
+        status=RewardStatus.queued,
+        deposit_side_token_symbol='DAIbs',
+        reward_rbtc_wei=10**16,
+        deposit_amount_minus_fees_wei=10**24 + 1,
+    )
+    changes_per_writer = 20
+
+    def write():
+        engine = create_db_engine(db_url)
+        for _ in range(changes_per_writer):
+            with engine.begin() as connection:
+                apply_reward_changes(connection, added=[values])
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    count = len(threads) * changes_per_writer
+    with init_sqlalchemy(db_url, create_models=False).begin() as dbsession:
+        assert _get_statistics(dbsession) == {
+            (RewardStatus.queued, 'DAIbs'): (count, count * 10**16, count * (10**24 + 1)),
+        }
+
+
+def test_rebuild_statistics_command(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "db.sqlite3"}'
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps(dict(EXAMPLE_CONFIG_JSON, dbUrl=db_url)))
+    with init_sqlalchemy(db_url, create_models=True).begin() as dbsession:
+        queue_rewards(
+            deposits=[EXAMPLE_DEPOSIT, ANOTHER_DEPOSIT_DIFFERENT_USER],
+            dbsession=dbsession,
+            web3=cast(Web3, MockWeb3()),
+            reward_amount_rbtc=Decimal('0.01'),
+            deposit_thresholds=THRESHOLDS,
+        )
+        # Bulk updates bypass the session events
+        dbsession.query(Reward).update({Reward.status: RewardStatus.confirmed}, synchronize_session=False)
+
+    result = CliRunner().invoke(cli.main, ['rebuild-statistics', str(config_file)])
+    assert result.exit_code == 0, result.output
+
+    with init_sqlalchemy(db_url, create_models=False).begin() as dbsession:
+        assert _get_statistics(dbsession) == {
+            (RewardStatus.confirmed, 'DAIbs'): (
+                2,
+                2 * 10**16,
+                EXAMPLE_DEPOSIT.amount_minus_fees_wei + ANOTHER_DEPOSIT_DIFFERENT_USER.amount_minus_fees_wei,
+            ),
+        }
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import websockets
+from eth_abi import encode_abi
+from eth_utils import to_hex
+from web3 import Web3
+
+from sovryn_bridge_rewarder.main import get_bridge_contract, get_bridge_contract_event
+from sovryn_bridge_rewarder.subscriptions import LogSubscription
+from sovryn_bridge_rewarder.utils import decode_logs, get_event_topic
+
+BRIDGE_ADDRESS = '0x8e7199d5f496ea862492f4f983a1627d723328fd'
+TOPIC = get_event_topic(get_bridge_contract_event(Web3()))
+
+
+def make_raw_log(*, block_number: int, log_index: int = 0, removed: bool = False):
+    return {
+        'address': BRIDGE_ADDRESS,
+        'topics': [
+            TOPIC,
+            '0x' + '83241490517384cb28382bdd4d1534ee54d9350f'.rjust(64, '0'),
+            '0x' + 'ca478e11953fe327b46dd71dd9fd31c92dc9a9ae'.rjust(64, '0'),
+        ],
+        'data': to_hex(encode_abi(
+            ['uint256', 'uint8', 'uint256', 'uint256', 'uint8', 'uint256', 'bytes'],
+            [2495000000000000000, 18, 1, 2495000000000000000, 18, 1, b''],
+        )),
+        'blockNumber': hex(block_number),
+        'blockHash': '0x' + f'{block_number:064x}',
+        'transactionHash': '0x' + f'{block_number * 1000 + log_index:064x}',
+        'transactionIndex': '0x0',
+        'logIndex': hex(log_index),
+        'removed': removed,
+    }
+
+
+class FakeNode:
+    """
+    Minimal stand-in for a websocket JSON-RPC node that supports eth_subscribe
+    """
+    def __init__(self, block_number: int):
+        self.block_number = block_number
+        self.subscriptions = {}
+        self.connections = []
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+        self._server = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def url(self):
+        return f'ws://127.0.0.1:{self.port}'
+
+    def start(self):
+        self._thread.start()
+        self._started.wait(5)
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(5)
+
+    def push_log(self, raw_log):
+        self._push('logs', raw_log)
+
+    def push_head(self, block_number):
+        self.block_number = block_number
+        self._push('newHeads', {'number': hex(block_number)})
+
+    def disconnect(self):
+        async def close_all():
+            for ws in self.connections:
+                await ws.close()
+        asyncio.run_coroutine_threadsafe(close_all(), self.loop).result(5)
+
+    def _push(self, subscription_type, result):
+        async def push():
+            for (ws, subscription_id), type_ in list(self.subscriptions.items()):
+                # Subscriptions of closed connections are left behind after a disconnect
+                if type_ == subscription_type and not ws.closed:
+                    await ws.send(json.dumps({
+                        'jsonrpc': '2.0',
+                        'method': 'eth_subscription',
+                        'params': {'subscription': subscription_id, 'result': result},
+                    }))
+        asyncio.run_coroutine_threadsafe(push(), self.loop).result(5)
+
+    async def _handler(self, ws, path):
+        self.connections.append(ws)
+        async for message in ws:
+            request = json.loads(message)
+            if request['method'] == 'eth_subscribe':
+                result = f'0x{len(self.subscriptions) + 1:x}'
+                self.subscriptions[(ws, result)] = request['params'][0]
+            elif request['method'] == 'eth_blockNumber':
+                result = hex(self.block_number)
+            else:
+                result = None
+            await ws.send(json.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': result}))
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self._server = self.loop.run_until_complete(websockets.serve(self._handler, '127.0.0.1', 0))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self.loop.run_forever()
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not met in time')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def node():
+    node = FakeNode(block_number=100)
+    node.start()
+    yield node
+    node.stop()
+
+
+@pytest.fixture
+def subscription(node):
+    subscription = LogSubscription(
+        ws_url=node.url,
+        addresses=[BRIDGE_ADDRESS],
+        topics=[TOPIC],
+        reconnect_seconds=0.05,
+    )
+    subscription.start()
+    wait_until(lambda: subscription.connected)
+    yield subscription
+    subscription.stop()
+
+
+def test_subscription_covers_blocks_after_subscribing(node, subscription):
+    assert subscription.head == 100
+    assert subscription.get_logs(from_block=100, to_block=105) is None
+    # Blocks whose headers have not been received yet are not covered
+    assert subscription.get_logs(from_block=101, to_block=105) is None
+    node.push_head(105)
+    wait_until(lambda: subscription.head == 105)
+    assert subscription.get_logs(from_block=101, to_block=105) == []
+
+
+def test_subscription_buffers_logs(node, subscription):
+    node.push_log(make_raw_log(block_number=103, log_index=1))
+    node.push_log(make_raw_log(block_number=102))
+    node.push_log(make_raw_log(block_number=104))
+    node.push_head(104)
+    wait_until(lambda: subscription.head == 104)
+
+    logs = subscription.get_logs(from_block=101, to_block=103)
+    assert [int(log['blockNumber'], 16) for log in logs] == [102, 103]
+
+    subscription.discard_logs(up_to_block=103)
+    logs = subscription.get_logs(from_block=104, to_block=104)
+    assert [int(log['blockNumber'], 16) for log in logs] == [104]
+    # Processed blocks are polled again if they are reprocessed (e.g. after a reorg)
+    assert subscription.get_logs(from_block=103, to_block=104) is None
+
+
+def test_subscription_drops_removed_logs(node, subscription):
+    node.push_log(make_raw_log(block_number=102))
+    node.push_log(make_raw_log(block_number=102, removed=True))
+    node.push_head(102)
+    wait_until(lambda: subscription.head == 102)
+    assert subscription.get_logs(from_block=101, to_block=102) == []
+
+
+def test_wait_for_block(node, subscription):
+    assert subscription.wait_for_block(103, timeout=0.01) is False
+    node.push_head(103)
+    assert subscription.wait_for_block(103, timeout=5) is True
+
+
+def test_subscription_falls_back_after_disconnect(node, subscription):
+    node.push_log(make_raw_log(block_number=102))
+    node.push_head(102)
+    wait_until(lambda: subscription.head == 102)
+    node.block_number = 110
+    node.disconnect()
+
+    # Until reconnected, and for the blocks missed while disconnected, logs must be polled
+    wait_until(lambda: subscription.connected and subscription.head == 110)
+    assert subscription.get_logs(from_block=101, to_block=110) is None
+    node.push_head(111)
+    wait_until(lambda: subscription.head == 111)
+    assert subscription.get_logs(from_block=111, to_block=111) == []
+
+
+def test_decode_logs():
+    bridge_contract = get_bridge_contract(bridge_address=BRIDGE_ADDRESS, web3=Web3())
+    events = decode_logs(
+        event=bridge_contract.events.AcceptedCrossTransfer,
+        raw_logs=[make_raw_log(block_number=1785018, log_index=7)],
+    )
+    assert len(events) == 1
+    event = events[0]
+    assert event.event == 'AcceptedCrossTransfer'
+    assert event.blockNumber == 1785018
+    assert event.logIndex == 7
+    assert event.args['_formattedAmount'] == 2495000000000000000
+    assert event.args['_to'] == '0xCa478e11953FE327B46Dd71DD9fd31C92DC9A9Ae'
+    assert event.args['_tokenAddress'] == '0x83241490517384cB28382Bdd4D1534eE54d9350F'
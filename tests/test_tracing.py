@@ -0,0 +1,93 @@
+from decimal import Decimal
+from typing import cast
+
+import pytest
+import sentry_sdk
+from sentry_sdk.transport import Transport
+from web3 import Web3
+
+from sovryn_bridge_rewarder.config import RewardThresholdMap
+from sovryn_bridge_rewarder.models import BlockInfo
+from sovryn_bridge_rewarder.rewards import queue_rewards
+from sovryn_bridge_rewarder.tracing import MAX_IDS_PER_SPAN, span, trace_round
+from .test_rewards import ANOTHER_DEPOSIT_DIFFERENT_USER, EXAMPLE_DEPOSIT, MockWeb3
+
+
+class CapturingTransport(Transport):
+    def __init__(self):
+        super().__init__()
+        self.transactions = []
+
+    def capture_envelope(self, envelope):
+        for item in envelope.items:
+            transaction = item.get_transaction_event()
+            if transaction:
+                self.transactions.append(transaction)
+
+
+@pytest.fixture
+def transport():
+    transport = CapturingTransport()
+    sentry_sdk.init('https://public@example.com/1', transport=transport, traces_sample_rate=1.0)
+    yield transport
+    sentry_sdk.init()  # disabled
+
+
+def _get_spans(transport, op):
+    [transaction] = transport.transactions
+    return [s for s in transaction['spans'] if s['op'] == op]
+
+
+def test_round_is_traced_with_child_spans(transport):
+    with trace_round(start_block=100) as round_span:
+        with span('deposits.fetch_window', from_block=100, to_block=199, deposit_ids=['0xab:1']):
+            pass
+        round_span.set_data('current_block', 210)
+
+    [transaction] = transport.transactions
+    assert transaction['contexts']['trace']['op'] == 'rewarder.round'
+    assert transaction['contexts']['trace']['data']['start_block'] == 100
+    assert transaction['contexts']['trace']['data']['current_block'] == 210
+    [fetch_span] = _get_spans(transport, 'deposits.fetch_window')
+    assert fetch_span['parent_span_id'] == transaction['contexts']['trace']['span_id']
+    assert fetch_span['data']['deposit_ids'] == ['0xab:1']
+
+
+def test_long_id_lists_are_truncated(transport):
+    with trace_round():
+        with span('rewards.check_eligibility', deposit_ids=[str(i) for i in range(MAX_IDS_PER_SPAN + 1)]):
+            pass
+
+    [eligibility_span] = _get_spans(transport, 'rewards.check_eligibility')
+    assert len(eligibility_span['data']['deposit_ids']) == MAX_IDS_PER_SPAN
+    assert eligibility_span['data']['deposit_ids_count'] == MAX_IDS_PER_SPAN + 1
+
+
+def test_failed_round_is_marked(transport):
+    with pytest.raises(ValueError):
+        with trace_round():
+            raise ValueError('node down')
+
+    [transaction] = transport.transactions
+    assert transaction['contexts']['trace']['status'] == 'internal_error'
+
+
+def test_queueing_rewards_is_traced(transport, database):
+    with trace_round():
+        with database.begin() as dbsession:
+            queue_rewards(
+                deposits=[EXAMPLE_DEPOSIT, ANOTHER_DEPOSIT_DIFFERENT_USER],
+                dbsession=dbsession,
+                web3=cast(Web3, MockWeb3()),
+                reward_amount_rbtc=Decimal('0.01'),
+                deposit_thresholds=RewardThresholdMap({'DAIbs': Decimal('2.00')}),
+            )
+        with database.begin() as dbsession:
+            dbsession.add(BlockInfo(key='last_processed_block', block_number=123))
+
+    [eligibility_span] = _get_spans(transport, 'rewards.check_eligibility')
+    assert eligibility_span['data']['eligible_deposit_ids'] == [
+        f'{EXAMPLE_DEPOSIT.transaction_hash}:{EXAMPLE_DEPOSIT.log_index}',
+        f'{ANOTHER_DEPOSIT_DIFFERENT_USER.transaction_hash}:{ANOTHER_DEPOSIT_DIFFERENT_USER.log_index}',
+    ]
+    assert len(_get_spans(transport, 'db.commit')) == 2
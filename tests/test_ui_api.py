@@ -0,0 +1,159 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from sovryn_bridge_rewarder.database import init_sqlalchemy
+from sovryn_bridge_rewarder.models import BlockInfo, Reward, RewardStatus
+from sovryn_bridge_rewarder.ui.api import RewarderAPI
+from sovryn_bridge_rewarder.ui.data import BlockingCallRunner
+from .test_export import _add_rewards
+from .test_ui_data import ACCOUNT_ADDRESS, _add_rewarder_status
+
+
+@pytest.fixture
+def database(tmp_path):
+    # A file, as the in-memory database isn't shared between the threads
+    return init_sqlalchemy(f'sqlite:///{tmp_path}/test.sqlite3')
+
+
+@pytest.fixture
+def api(database):
+    _add_rewards(database)
+    with database.begin() as dbsession:
+        dbsession.add(BlockInfo(key='last_processed_block', block_number=100))
+    runner = BlockingCallRunner(max_workers=1)
+    yield RewarderAPI(
+        Session=database,
+        config=SimpleNamespace(account=SimpleNamespace(address=ACCOUNT_ADDRESS)),
+        runner=runner,
+        cache_seconds=60,
+    )
+    runner.shutdown()
+
+
+def _get(api, path, query_params=(), **kwargs):
+    return asyncio.run(api.handle(path, list(query_params), **kwargs))
+
+
+def _get_json(api, path, query_params=()):
+    response = _get(api, path, query_params)
+    assert response.status == 200
+    return json.loads(response.body)
+
+
+def test_rewards_pagination(api):
+    page = _get_json(api, '/api/rewards', [('limit', '3')])
+    assert [reward['id'] for reward in page['rewards']] == [4, 3, 2]
+    assert page['rewards'][0]['depositAmountMinusFeesWei'] == str(123 * 10**24 + 4)
+    assert page['nextCursor'] == 2
+
+    page = _get_json(api, '/api/rewards', [('limit', '3'), ('cursor', '2')])
+    assert [reward['id'] for reward in page['rewards']] == [1]
+    assert page['nextCursor'] is None
+
+
+def test_rewards_filters(api):
+    page = _get_json(api, '/api/rewards', [('status', 'confirmed'), ('status', 'sent'), ('token', 'DAIbs')])
+    assert [(reward['id'], reward['status']) for reward in page['rewards']] == [(3, 'sent'), (1, 'confirmed')]
+
+    page = _get_json(api, '/api/rewards', [('user', '0x' + '0' * 39 + '2')])
+    assert [reward['id'] for reward in page['rewards']] == [2]
+
+    assert _get(api, '/api/rewards', [('status', 'bogus')]).status == 400
+    assert _get(api, '/api/rewards', [('limit', '0')]).status == 400
+    assert _get(api, '/api/rewards', [('cursor', 'x')]).status == 400
+    assert _get(api, '/api/nonexistent').status == 404
+
+
+def test_reward_summary(api):
+    summary = _get_json(api, '/api/rewards/summary')
+    assert summary['total'] == 4
+    assert summary['statuses']['confirmed'] == {'count': 2, 'totalRbtc': '0.0002'}
+    assert summary['statuses']['error_sending'] == {'count': 0, 'totalRbtc': '0'}
+
+
+def test_status(api, database):
+    assert _get_json(api, '/api/status') == {
+        'accountAddress': ACCOUNT_ADDRESS,
+        'lastProcessedBlock': 100,
+        'updatedAt': None,
+    }
+
+    _add_rewarder_status(database, last_processed_block=101)
+    api._cache.clear()
+    status = _get_json(api, '/api/status')
+    assert status['lastProcessedBlock'] == 101
+    assert status['backlogBlocks'] == 8
+    assert status['rbtcBalance'] == '1'
+    assert status['queuedRewards'] == 1
+
+
+def test_etag_and_cache(api, database):
+    response = _get(api, '/api/rewards/summary')
+    etag = response.headers['ETag']
+    not_modified = _get(api, '/api/rewards/summary', if_none_match=etag)
+    assert not_modified.status == 304
+    assert not_modified.body == b''
+    assert _get(api, '/api/rewards/summary', if_none_match=f'"other", W/{etag}').status == 304
+    assert _get(api, '/api/rewards/summary', if_none_match='"other"').status == 200
+
+    # Cached responses are served until they expire
+    with database.begin() as dbsession:
+        dbsession.query(Reward).get(4).status = RewardStatus.sending
+    assert _get(api, '/api/rewards/summary').body == response.body
+    api._cache.clear()
+    assert json.loads(_get(api, '/api/rewards/summary').body)['statuses']['sending']['count'] == 1
+
+
+def test_cache_keeps_the_most_recently_used_responses(api):
+    api.max_cached_responses = 2
+    _get(api, '/api/rewards', [('limit', '1')])
+    _get(api, '/api/rewards', [('limit', '2')])
+    _get(api, '/api/rewards', [('limit', '1')])
+    _get(api, '/api/rewards', [('limit', '3')])
+    assert list(api._cache) == ['/api/rewards?limit=1', '/api/rewards?limit=3']
+
+
+def test_cache_keys_are_encoded(api):
+    # Unencoded, both would be token=DAIbs&user=0x...3
+    injected = _get_json(api, '/api/rewards', [('token', 'DAIbs&user=0x' + '0' * 39 + '3')])
+    assert injected['rewards'] == []
+    page = _get_json(api, '/api/rewards', [('token', 'DAIbs'), ('user', '0x' + '0' * 39 + '3')])
+    assert [reward['id'] for reward in page['rewards']] == [3]
+    assert len(api._cache) == 2
+
+
+def test_statistics(api):
+    statistics = _get_json(api, '/api/statistics', [('since', '2021-05-02'), ('until', '2021-05-03')])
+    assert statistics['days'] == [
+        {
+            'day': '2021-05-02',
+            'status': 'confirmed',
+            'token': 'ETHbs',
+            'count': 1,
+            'rewardRbtc': '0.0001',
+            'depositAmountMinusFeesWei': str(123 * 10**24 + 2),
+        },
+        {
+            'day': '2021-05-03',
+            'status': 'sent',
+            'token': 'DAIbs',
+            'count': 1,
+            'rewardRbtc': '0.0001',
+            'depositAmountMinusFeesWei': str(123 * 10**24 + 3),
+        },
+    ]
+    assert statistics['tokens'] == [
+        {'token': 'DAIbs', 'rewardsPaid': 1, 'rbtcPaid': '0.0001', 'averageDepositWei': str(123 * 10**24 + 3)},
+        {'token': 'ETHbs', 'rewardsPaid': 1, 'rbtcPaid': '0.0001', 'averageDepositWei': str(123 * 10**24 + 2)},
+    ]
+
+    statistics = _get_json(api, '/api/statistics', [('token', 'DAIbs')])
+    assert [row['day'] for row in statistics['days']] == ['2021-05-01', '2021-05-03', '2021-05-31']
+    assert statistics['tokens'] == [
+        {'token': 'DAIbs', 'rewardsPaid': 2, 'rbtcPaid': '0.0002', 'averageDepositWei': str(123 * 10**24 + 2)},
+    ]
+
+    assert _get(api, '/api/statistics', [('since', 'yesterday')]).status == 400
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timezone
+import threading
+
+import pytest
+
+from sovryn_bridge_rewarder.models import Reward, RewarderStatus, RewardStatus
+from sovryn_bridge_rewarder.ui.data import (
+    BlockingCallRunner,
+    diff_rewards,
+    load_latest_rewards,
+    load_page_fingerprint,
+    load_rewarder_status,
+)
+from .test_export import _add_rewards
+
+ACCOUNT_ADDRESS = '0x' + 'ab' * 20
+
+
+def _add_rewarder_status(database, **values):
+    values = {
+        'account_address': ACCOUNT_ADDRESS,
+        'rbtc_balance_wei': 10**18,
+        'gas_price_wei': 65_164_000,
+        'head_block': 110,
+        'last_processed_block': 100,
+        'backlog_blocks': 8,
+        'queued_rewards': 1,
+        'sending_rewards': 0,
+        'sent_rewards': 1,
+        'round_seconds': 1.5,
+        'updated_at': datetime.now(timezone.utc),
+        **values,
+    }
+    with database.begin() as dbsession:
+        dbsession.merge(RewarderStatus(**values))
+
+
+def test_load_latest_rewards(database):
+    _add_rewards(database)
+    latest_rewards = load_latest_rewards(database, num_rewards=3)
+    assert [reward.id for reward in latest_rewards] == [4, 3, 2]
+    assert latest_rewards[0].status == RewardStatus.queued
+
+
+def test_load_rewarder_status(database):
+    assert load_rewarder_status(database, ACCOUNT_ADDRESS) is None
+    _add_rewarder_status(database)
+    status = load_rewarder_status(database, ACCOUNT_ADDRESS.upper())
+    assert status.last_processed_block == 100
+    assert status.rbtc_balance_wei == 10**18
+
+
+def test_blocking_call_runner_timeout():
+    runner = BlockingCallRunner(max_workers=2)
+    release = threading.Event()
+    num_calls = 0
+
+    def slow_call():
+        nonlocal num_calls
+        num_calls += 1
+        release.wait(5)
+        return 'done'
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await runner.call('slow', slow_call, timeout=0.05)
+        # The event loop isn't blocked by the pending call
+        assert await runner.call('fast', lambda: 'fast', timeout=1) == 'fast'
+        # The pending call is reused instead of starting another one
+        with pytest.raises(asyncio.TimeoutError):
+            await runner.call('slow', slow_call, timeout=0.05)
+        release.set()
+        assert await runner.call('slow', slow_call, timeout=1) == 'done'
+
+    try:
+        asyncio.run(run())
+    finally:
+        runner.shutdown()
+    assert num_calls == 1
+
+
+def test_page_fingerprint(database):
+    empty_fingerprint = load_page_fingerprint(database, ACCOUNT_ADDRESS)
+    assert empty_fingerprint == (None, None, None)
+
+    _add_rewards(database)
+    fingerprint = load_page_fingerprint(database, ACCOUNT_ADDRESS)
+    assert fingerprint.max_reward_id == 4
+    assert fingerprint != empty_fingerprint
+    assert load_page_fingerprint(database, ACCOUNT_ADDRESS) == fingerprint
+
+    _add_rewarder_status(database)
+    new_fingerprint = load_page_fingerprint(database, ACCOUNT_ADDRESS)
+    assert new_fingerprint != fingerprint
+    assert new_fingerprint.rewards_equal(fingerprint)
+
+    # Status changes are detected through updated_at
+    with database.begin() as dbsession:
+        reward = dbsession.query(Reward).get(1)
+        reward.status = RewardStatus.orphaned
+    assert not load_page_fingerprint(database, ACCOUNT_ADDRESS).rewards_equal(fingerprint)
+
+
+def test_diff_rewards(database):
+    _add_rewards(database)
+    old_rewards = {reward.id: reward for reward in load_latest_rewards(database, num_rewards=3)}
+    with database.begin() as dbsession:
+        dbsession.query(Reward).get(3).status = RewardStatus.confirmed
+        dbsession.query(Reward).get(2).created_at = datetime(2021, 4, 1, tzinfo=timezone.utc)
+
+    new_rewards = load_latest_rewards(database, num_rewards=3)
+    added, changed, removed = diff_rewards(old_rewards, new_rewards)
+    assert [reward.id for reward in added] == [1]
+    assert [(reward.id, reward.status) for reward in changed] == [(3, RewardStatus.confirmed)]
+    assert removed == [2]
+    assert diff_rewards({reward.id: reward for reward in new_rewards}, new_rewards) == ([], [], [])
@@ -0,0 +1,27 @@
+import pytest
+from hexbytes import HexBytes
+
+from sovryn_bridge_rewarder.utils import _canonical_address, address, canonical_address, lower_address
+
+CHECKSUMMED = '0xCa478e11953FE327B46Dd71DD9fd31C92DC9A9Ae'
+
+
+def test_canonical_address():
+    for a in (CHECKSUMMED, CHECKSUMMED.lower(), CHECKSUMMED.upper().replace('0X', '0x'), HexBytes(CHECKSUMMED)):
+        assert canonical_address(a) == (CHECKSUMMED, CHECKSUMMED.lower())
+        assert address(a) == CHECKSUMMED
+        assert lower_address(a) == CHECKSUMMED.lower()
+
+
+def test_canonical_address_is_memoized_by_lowercase_address():
+    _canonical_address.cache_clear()
+    address(CHECKSUMMED)
+    address(CHECKSUMMED.lower())
+    lower_address(CHECKSUMMED)
+    cache_info = _canonical_address.cache_info()
+    assert (cache_info.hits, cache_info.misses) == (2, 1)
+
+
+def test_invalid_address():
+    with pytest.raises(ValueError):
+        address('0x1234')
@@ -4,6 +4,8 @@ from typing import List, Dict, Any, Union
 from pprint import pprint, pformat
 from web3.datastructures import AttributeDict
 
+from sovryn_bridge_rewarder.deposits import Deposit
+
 
 def pprint_improved(thing):
     pprint(convert_to_pprintable(thing))
@@ -15,6 +17,9 @@ def convert_to_pprintable(a: Any):
     if is_dataclass(a):
         body = pformat(asdict(a))
         return ReprStr(f'{a.__class__.__name__}({body})')
+    if isinstance(a, Deposit):
+        body = pformat(a.as_dict())
+        return ReprStr(f'{a.__class__.__name__}({body})')
     if isinstance(a, AttributeDict):
         return {
             k: convert_to_pprintable(v)